@@ -0,0 +1 @@
+"""Benchmarks for creating and querying matching sets."""
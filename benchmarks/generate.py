@@ -0,0 +1,110 @@
+"""Module for generating synthetic person records offline."""
+
+import string
+
+import numpy as np
+import pandas as pd
+
+FIRST_NAMES = [
+    "Anna", "Bram", "Daan", "Emma", "Eva", "Fleur", "Hanna", "Jan", "Johan",
+    "Julia", "Lars", "Lisa", "Lotte", "Luuk", "Maria", "Milan", "Noah", "Noor",
+    "Pieter", "Sanne", "Sem", "Sophie", "Thijs", "Tim", "Wouter", "Yara",
+]  # fmt: skip
+SURNAMES = [
+    "Bakker", "Bos", "Brouwer", "de Boer", "de Graaf", "de Groot", "de Jong",
+    "de Vries", "Dekker", "Hendriks", "Jansen", "Janssen", "Kok", "Meijer",
+    "Mulder", "Peters", "Smit", "van Dam", "van den Berg", "van der Meer",
+    "van Dijk", "Visser", "Vos", "Weijters", "Willems",
+]  # fmt: skip
+STREETS = [
+    "Dorpstraat", "Kerkstraat", "Molenweg", "Schoolstraat", "Stationsweg",
+    "Julianastraat", "Beatrixlaan", "Nieuwstraat", "Marktplein", "Parkweg",
+    "Lindelaan", "Wilhelminastraat", "Eikenlaan", "Havenkade", "Kanaalweg",
+]  # fmt: skip
+CITIES = [
+    "Amsterdam", "Rotterdam", "Utrecht", "Den Haag", "Eindhoven", "Groningen",
+    "Tilburg", "Almere", "Breda", "Nijmegen", "Apeldoorn", "Haarlem", "Arnhem",
+    "Zwolle", "Leiden", "Maastricht", "Delft", "Alkmaar",
+]  # fmt: skip
+
+
+def generate_people(size: int, seed: int = 0) -> pd.DataFrame:
+    """Generate synthetic person records.
+
+    Parameters
+    ----------
+    size : int
+        Number of records to generate.
+    seed : int, default=0
+        Seed for the random generator; the same seed gives the same records.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Records with `id`, `name`, `birthdate`, `address` and `national_id` columns.
+    """
+    rng = np.random.default_rng(seed)
+
+    def choose(values: list) -> pd.Series:
+        positions = rng.integers(len(values), size=size)
+        return pd.Series(np.asarray(values, dtype=object)[positions])
+
+    def digits(length: int) -> pd.Series:
+        numbers = pd.Series(rng.integers(10**length, size=size))
+        return numbers.astype(str).str.zfill(length)
+
+    def letters(alphabet: str, length: int) -> pd.Series:
+        positions = rng.integers(len(alphabet), size=(size, length))
+        return pd.Series(np.array(list(alphabet))[positions].tolist()).str.join("")
+
+    # Birthdates between 1930 and 2010.
+    days = rng.integers(-14_610, 14_610, size=size).astype("timedelta64[D]")
+    birthdates = pd.Series(np.datetime64("1970-01-01") + days)
+
+    numbers = pd.Series(rng.integers(1, 250, size=size)).astype(str)
+    # Postcodes and cities, as in "1234 AB Utrecht".
+    places = digits(4).str.replace("^0", "1", regex=True)
+    places += " " + letters("ABCDEFGHJKLMNPRSTVWXZ", 2) + " " + choose(CITIES)
+    national_ids = digits(7) + letters(string.ascii_lowercase, 1) + digits(16)
+
+    return pd.DataFrame(
+        {
+            "id": np.arange(size),
+            "name": choose(SURNAMES) + ", " + choose(FIRST_NAMES),
+            "birthdate": birthdates.dt.strftime("%d-%m-%Y"),
+            "address": choose(STREETS) + " " + numbers + ", " + places,
+            "national_id": "nld" + national_ids,
+        }
+    )
+
+
+def generate_queries(data: pd.DataFrame, size: int, seed: int = 1) -> pd.DataFrame:
+    """Sample records and add a typo to their string fields.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        Records to sample from, as returned by `generate_people`.
+    size : int
+        Number of queries to generate.
+    seed : int, default=1
+        Seed for the random generator.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Queries with the same columns as `data`, except `id`.
+    """
+    rng = np.random.default_rng(seed)
+    queries = data.sample(n=size, replace=size > len(data), random_state=seed)
+    queries = queries.drop(columns="id").reset_index(drop=True)
+
+    # Delete one random character from each string.
+    for column in ("name", "address", "national_id"):
+        queries[column] = [
+            value[:position] + value[position + 1 :]
+            for value, position in zip(
+                queries[column], rng.integers(0, queries[column].str.len())
+            )
+        ]
+    return queries
@@ -0,0 +1,174 @@
+"""Benchmark creating and querying matching sets of synthetic person records.
+
+Run from the repository root, for example:
+
+    python -m benchmarks.run --sizes 10000 100000 --output results.json
+
+Results are written as JSON, so they can be compared between versions.
+"""
+
+import argparse
+import json
+import platform
+import statistics
+import tempfile
+import time
+from datetime import datetime, timezone
+from importlib import metadata
+
+import pandas as pd
+
+from benchmarks.generate import generate_people, generate_queries
+from fuzzy_matching.encryption import AESGCM4Encryptor
+from fuzzy_matching.match_multi import MultiMatcher
+
+# Field configurations to benchmark; one per matcher type, a combined one, and ones
+# where a field selects the candidates for the other fields.
+CONFIGS = {
+    "vector": {"name": {"algoritm": "vector"}},
+    "minhash": {"name": {"algoritm": "minhash"}},
+    "levenshtein": {"national_id": {"algoritm": "levenshtein"}},
+    "damerau": {"address": {"algoritm": "damerau"}},
+    "alignment": {"address": {"algoritm": "alignment"}},
+    "timedelta": {"birthdate": {"algoritm": "timedelta"}},
+    "person": {
+        "name": {"algoritm": "vector", "weight": 0.2},
+        "birthdate": {"algoritm": "timedelta", "weight": 0.2},
+        "national_id": {"algoritm": "levenshtein", "weight": 0.6},
+    },
+    "blocking": {
+        "name": {"algoritm": "phonetic", "weight": 0.4, "blocking": True},
+        "birthdate": {"algoritm": "timedelta", "weight": 0.3},
+        "address": {"algoritm": "levenshtein", "weight": 0.3},
+    },
+    "short_circuit": {
+        "national_id": {"algoritm": "exact", "weight": 0.6, "short_circuit": True},
+        "name": {"algoritm": "vector", "weight": 0.2},
+        "birthdate": {"algoritm": "timedelta", "weight": 0.2},
+    },
+}
+
+# Upper bound on the size of the score matrices in batch matching.
+BATCH_CELLS = 64_000_000
+
+
+def benchmark(
+    name: str, data: pd.DataFrame, queries: pd.DataFrame, size: int, top_n: int = 10
+) -> dict:
+    """Time creating and querying a matching set for one configuration.
+
+    Parameters
+    ----------
+    name : str
+        Name of the configuration in `CONFIGS`.
+    data : pandas.DataFrame
+        Records to store; the records after the first `size` are appended.
+    queries : pandas.DataFrame
+        Queries to match.
+    size : int
+        Number of records in the initial matching set.
+    top_n : int, default=10
+        Number of results per query.
+
+    Returns
+    -------
+    dict
+        Timings in seconds.
+    """
+    config = CONFIGS[name]
+    fields = list(config)
+    key = AESGCM4Encryptor.generate_key()
+
+    with tempfile.TemporaryDirectory() as storage_path:
+        matcher = MultiMatcher(top_n, config, key, storage_path)
+        create = _time(matcher.create, data.iloc[:size][["id", *fields]], "id")
+        append = _time(matcher.create, data.iloc[size:][["id", *fields]], "id")
+
+        # A fresh matcher decrypts and loads all stores on the first query.
+        targets = queries[fields].to_dict(orient="records")
+        matcher = MultiMatcher(top_n, config, key, storage_path)
+        cold = _time(matcher.get, targets[0])
+        warm = [_time(matcher.get, target) for target in targets[1:]]
+
+        batch_size = max(1, BATCH_CELLS // len(data))
+        many = _time(matcher.get_many, queries[fields], batch_size)
+
+    return {
+        "config": name,
+        "size": size,
+        "appended": len(data) - size,
+        "queries": len(queries),
+        "create": create,
+        "append": append,
+        "cold_get": cold,
+        "warm_get": statistics.median(warm) if warm else None,
+        "get_many": many,
+        "get_many_per_query": many / len(queries),
+    }
+
+
+def main() -> None:
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark fuzzy matching.")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[10_000, 100_000],
+        help="Numbers of records in the matching set, up to 10_000_000.",
+    )
+    parser.add_argument(
+        "--configs",
+        nargs="+",
+        choices=list(CONFIGS),
+        default=list(CONFIGS),
+        help="Configurations to benchmark.",
+    )
+    parser.add_argument("--queries", type=int, default=20, help="Number of queries.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the data.")
+    parser.add_argument("--output", default="benchmark_results.json", help="Output.")
+    args = parser.parse_args()
+
+    try:
+        version = metadata.version("fuzzy-matching")
+    except metadata.PackageNotFoundError:
+        version = "unknown"
+
+    results = []
+    for size in args.sizes:
+        # Incremental loads add one percent to the initial matching set.
+        data = generate_people(size + max(1, size // 100), args.seed)
+        queries = generate_queries(data, args.queries, args.seed + 1)
+        for name in args.configs:
+            result = benchmark(name, data, queries, size)
+            print(
+                f"{name:>12} {size:>10,}: create {result['create']:.3f}s, "
+                f"cold get {result['cold_get']:.3f}s, "
+                f"warm get {result['warm_get']:.4f}s, "
+                f"get_many {result['get_many_per_query']:.4f}s per query"
+            )
+            results.append(result)
+
+    output = {
+        "version": version,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "seed": args.seed,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as output_file:
+        json.dump(output, output_file, indent=2)
+    print(f"Results written to {args.output}")
+
+
+def _time(function, *args) -> float:
+    """Return the wall time of a function call in seconds."""
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    main()
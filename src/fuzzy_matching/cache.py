@@ -0,0 +1,105 @@
+"""Module for caching match results of repeated queries."""
+
+import hashlib
+import hmac
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+
+class ResultCache:
+    """Bounded least-recently-used cache for match results.
+
+    Entries are keyed on an HMAC of the preprocessed target values, so the keys
+    never contain plaintext target values. Each entry records the generation of
+    the stored data it was computed from and is discarded once the data changes.
+
+    Parameters
+    ----------
+    encryption_key : bytes
+        Encryption key of the matching set; the HMAC key is derived from it.
+    max_size : int
+        Maximum number of cached results.
+    ttl : float, optional
+        Seconds after which cached results expire; never by default.
+    """
+
+    def __init__(
+        self, encryption_key: bytes, max_size: int, ttl: float | None = None
+    ) -> None:
+        self._hmac_key = hmac.digest(encryption_key, b"result cache", "sha256")
+        self._max_size = max_size
+        self._ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self) -> int:
+        """Return the number of cached results."""
+        return len(self._entries)
+
+    def make_key(self, values: list[str]) -> bytes:
+        """Create a cache key for a query.
+
+        Parameters
+        ----------
+        values : list of str
+            Preprocessed target values in field order.
+
+        Returns
+        -------
+        bytes
+            HMAC-SHA256 digest of the values.
+        """
+        message = json.dumps(values).encode("utf8")
+        return hmac.new(self._hmac_key, message, hashlib.sha256).digest()
+
+    def get(self, key: bytes, generation: int) -> pd.DataFrame | None:
+        """Return a cached result, or None if it is missing, expired or outdated.
+
+        Parameters
+        ----------
+        key : bytes
+            Cache key of the query.
+        generation : int
+            Current generation of the stored data.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            entry_generation, expires, results = entry
+            if entry_generation != generation or time.monotonic() > expires:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+        return results.copy()
+
+    def put(self, key: bytes, generation: int, results: pd.DataFrame) -> None:
+        """Cache a result, evicting the least recently used result if full.
+
+        Parameters
+        ----------
+        key : bytes
+            Cache key of the query.
+        generation : int
+            Generation of the stored data the result was computed from.
+        results : pandas.DataFrame
+            Match results to cache.
+        """
+        expires = time.monotonic() + self._ttl if self._ttl else float("inf")
+        with self._lock:
+            self._entries[key] = (generation, expires, results.copy())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Remove all cached results."""
+        with self._lock:
+            self._entries.clear()
@@ -1,10 +1,22 @@
 """Module with encryption helper classes."""
 
+import os
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
 from secrets import token_bytes
+from typing import BinaryIO
 
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM, AESGCMSIV
 
+# Framed format: a header, then frames of a nonce and an encrypted chunk each.
+FRAMED = b"FMENCv1\x00"
+HEADER_SIZE = len(FRAMED) + 16 + 4 + 8
+CHUNK_SIZE = 1024 * 1024
+NONCE_SIZE = 12
+TAG_SIZE = 16
+
 
 class BaseEncryptor:
     """Encryptor base class."""
@@ -90,3 +102,109 @@ class AESGCM4Encryptor(BaseEncryptor):
         # Get the nonce and then decrypt.
         nonce = value[0:12]
         return self._encryptor.decrypt(nonce, value[12:], b"")
+
+    def encrypt_frames(
+        self, value: bytes, chunk_size: int = CHUNK_SIZE, workers: int | None = None
+    ) -> Iterator[bytes]:
+        """Encrypt bytes in chunks on multiple threads, yielding the frames in order.
+
+        Each chunk has its own nonce. The header, which holds a random identifier,
+        the chunk size and the number of chunks, and the position of the chunk are
+        authenticated with each chunk, so frames cannot be reordered, dropped or
+        moved between files unnoticed.
+
+        Parameters
+        ----------
+        value : bytes
+            Bytes to encrypt.
+        chunk_size : int, default=1_048_576
+            Number of bytes per chunk.
+        workers : int, optional
+            Number of threads encrypting chunks; one per core by default.
+
+        Yields
+        ------
+        bytes
+            The header, followed by the frames.
+        """
+        value = memoryview(value).cast("B")
+        n_chunks = -(-len(value) // chunk_size)
+        header = b"".join(
+            [
+                FRAMED,
+                token_bytes(16),
+                chunk_size.to_bytes(4, "little"),
+                n_chunks.to_bytes(8, "little"),
+            ]
+        )
+
+        def encrypt_chunk(index: int) -> bytes:
+            nonce = token_bytes(NONCE_SIZE)
+            chunk = value[index * chunk_size : (index + 1) * chunk_size]
+            aad = header + index.to_bytes(8, "little")
+            return nonce + self._encryptor.encrypt(nonce, chunk, aad)
+
+        yield header
+        yield from _map_ordered(encrypt_chunk, range(n_chunks), workers)
+
+    def decrypt_frames(self, file: BinaryIO, workers: int | None = None) -> bytes:
+        """Read and decrypt a file on multiple threads.
+
+        Frames are read while earlier frames are decrypted, and decrypted into a
+        single buffer, so memory use stays close to one copy of the data.
+
+        Parameters
+        ----------
+        file : file object
+            File opened in binary mode, positioned at the start of the data.
+        workers : int, optional
+            Number of threads decrypting chunks; one per core by default.
+
+        Returns
+        -------
+        bytes
+            The decrypted data, as a writable bytearray.
+        """
+        header = file.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or not header.startswith(FRAMED):
+            raise ValueError("Encrypted data is not in the framed format.")
+
+        chunk_size = int.from_bytes(header[-12:-8], "little")
+        n_chunks = int.from_bytes(header[-8:], "little")
+        frame_size = NONCE_SIZE + chunk_size + TAG_SIZE
+
+        # The size of the data follows from the size of the file.
+        size = os.fstat(file.fileno()).st_size - file.tell()
+        size -= n_chunks * (NONCE_SIZE + TAG_SIZE)
+        if not (n_chunks - 1) * chunk_size <= size <= n_chunks * chunk_size:
+            raise ValueError("Encrypted data is truncated or corrupted.")
+
+        def decrypt_chunk(frame: tuple[int, bytes]) -> bytes:
+            index, data = frame
+            aad = header + index.to_bytes(8, "little")
+            return self._encryptor.decrypt(data[:NONCE_SIZE], data[NONCE_SIZE:], aad)
+
+        frames = ((index, file.read(frame_size)) for index in range(n_chunks))
+        plaintext = bytearray(size)
+        for index, chunk in enumerate(_map_ordered(decrypt_chunk, frames, workers)):
+            plaintext[index * chunk_size : index * chunk_size + len(chunk)] = chunk
+        return plaintext
+
+
+def _map_ordered(
+    function: Callable, items: Iterable, workers: int | None = None
+) -> Iterator:
+    """Apply a function on a thread pool, yielding results in order.
+
+    Only a few items per thread are taken from `items` ahead of the results, so
+    memory use does not grow with the number of items.
+    """
+    n_workers = workers or os.cpu_count() or 1
+    with ThreadPoolExecutor(n_workers, "encryption") as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(function, item))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,16 +1,53 @@
 """Module for fuzzy matching on multiple characteristics."""
 
+import itertools
+import json
+import os
+import threading
+import uuid
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import copy_context
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from pandas.api.extensions import ExtensionArray
 
-from fuzzy_matching.matchers import (
-    DistanceMatcher,
-    NullMatcher,
-    TimedeltaMatcher,
-    VectorMatcher,
+from fuzzy_matching import matchers
+from fuzzy_matching.cache import ResultCache
+from fuzzy_matching.metrics import MetricsCollector, collect, measure
+from fuzzy_matching.storage import (
+    SEGMENT_ROWS,
+    EncryptedStore,
+    _read_legacy,
+    _write_atomic,
 )
 
+# Tolerance for rounding errors when pruning records in cascade mode.
+TOLERANCE = 1e-6
+
+# Number of scores per field in a batch of `get_many`, unless a batch size is given.
+BATCH_CELLS = 64_000_000
+
+# Journal of a compaction dropping removed rows, kept until all stores are rewritten.
+COMPACTION = "multimatcher_compaction.json"
+
+# Matcher for each algoritm; only the matchers in use are imported.
+ALGORITMS = {
+    "levenshtein": "DistanceMatcher",
+    "damerau": "DistanceMatcher",
+    "alignment": "DistanceMatcher",
+    "vector": "VectorMatcher",
+    "minhash": "MinHashMatcher",
+    "timedelta": "TimedeltaMatcher",
+    "null": "NullMatcher",
+    "phonetic": "PhoneticMatcher",
+    "exact": "ExactMatcher",
+}
+
 
 class MultiMatcher:
     """Fuzzy matching on multiple characteristics.
@@ -20,43 +57,162 @@ class MultiMatcher:
     top_n : int
         Number of results to return.
     config : dict
-        Dict of field names and matching settings.
+        Dict of field names and matching settings. Set `blocking` to True for a
+        phonetic or exact field to only match the entities it selects for the
+        target. Set `short_circuit` to True for an exact field to only match its
+        exact hits, if the target has any. Set `min_similarity` for a field to
+        treat lower similarities on that field as zero.
     encryption_key : bytes
         Encryption key for storing data, provided as bytes.
     storage_path : str, default="storage"
         Folder to store data in.
+    cascade : bool, default=False
+        Score fields one by one in order of cost and only score records that can
+        still reach the top results. Returns the same results as scoring all
+        records.
+    cache_size : int, default=0
+        Number of `get` results to keep in a least-recently-used cache; results of
+        repeated queries are then returned without scoring. Disabled by default.
+        The cache is cleared when data is added, updated or removed.
+    cache_ttl : float, optional
+        Seconds after which cached results expire; never by default.
+    metrics : MetricsCollector, optional
+        Collector for the wall time of each stage per field, the number of bytes
+        decrypted and, optionally, peak memory use. Nothing is measured by default.
     """
 
     def __init__(
-        self, top_n, config, encryption_key: bytes, storage_path="storage"
+        self,
+        top_n,
+        config,
+        encryption_key: bytes,
+        storage_path="storage",
+        cascade: bool = False,
+        cache_size: int = 0,
+        cache_ttl: float | None = None,
+        metrics: MetricsCollector | None = None,
     ) -> None:
         # Create the storage path if needed.
         storage_path = Path(storage_path)
         storage_path.mkdir(parents=True, exist_ok=True)
+        self._storage_path = storage_path
 
         self._top_n = top_n
-
-        # Define available matching algoritms.
-        matchers = {algo: DistanceMatcher for algo in DistanceMatcher.ALGORITMS}
-        matchers |= {
-            "vector": VectorMatcher,
-            "timedelta": TimedeltaMatcher,
-            "null": NullMatcher,
-        }
+        self._cascade = cascade
+        self._metrics = metrics
 
         self._matchers = {}
         for field, settings in config.items():
             algoritm = settings.get("algoritm").lower()
-            if algoritm not in matchers:
+            if algoritm not in ALGORITMS:
                 raise ValueError(
                     f"Unknown matching algoritm: {algoritm}."
-                    "Available matchers: " + ", ".join(matchers)
+                    "Available matchers: " + ", ".join(ALGORITMS)
                 )
 
-            self._matchers[field] = matchers[algoritm](
+            matcher = getattr(matchers, ALGORITMS[algoritm])
+            self._matchers[field] = matcher(
                 field, encryption_key, storage_path, settings
             )
 
+        # Fields selecting the candidates for all other fields.
+        self._blocking = [
+            field for field, settings in config.items() if settings.get("blocking")
+        ]
+        self._short_circuit = [
+            field for field, settings in config.items() if settings.get("short_circuit")
+        ]
+        for field in self._blocking + self._short_circuit:
+            if not hasattr(self._matchers[field], "candidates"):
+                raise ValueError(f"The matcher for {field} cannot select candidates.")
+
+        # Entity identifiers, in the row order shared by all matchers.
+        self._ids = EncryptedStore(encryption_key, storage_path / "multimatcher_ids")
+
+        # Row positions of removed entities; their rows are skipped in matching.
+        self._tombstones = EncryptedStore(
+            encryption_key, storage_path / "multimatcher_tombstones"
+        )
+        # Removed rows and hash indexes on the identifiers, updated in place as
+        # entities are added or removed through this object.
+        self._removed = (None, None)
+        self._id_index = (None, None)
+
+        # Held shared while using row positions, and exclusively while compaction
+        # changes them.
+        self._lock = _SharedLock()
+
+        # Cached results are tied to the generation of the identifiers and
+        # tombstones, which changes whenever records are added or removed.
+        self._cache = None
+        if cache_size:
+            self._cache = ResultCache(encryption_key, cache_size, cache_ttl)
+
+        # Finish dropping removed rows if compaction was interrupted.
+        if (storage_path / COMPACTION).exists():
+            self._drop_removed()
+
+        self._import_legacy(encryption_key, storage_path)
+
+    def __len__(self) -> int:
+        """Return the number of stored entities without loading the data."""
+        return len(self._ids) - len(self._tombstones)
+
+    @property
+    def fields(self) -> list[str]:
+        """Names of the fields used in matching."""
+        return list(self._matchers)
+
+    def preload(
+        self, workers: int | None = None, background: bool = False
+    ) -> threading.Thread | None:
+        """Load the stored data for all fields ahead of the first query.
+
+        Otherwise, the first query pays for decrypting and loading all stores one
+        by one. Here, the fields are loaded concurrently; decryption runs in
+        parallel, as it does not hold the interpreter lock.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of threads loading fields; one per field by default.
+        background : bool, default=False
+            Load in a background thread. Queries can be made meanwhile; they wait
+            for the fields they need to be loaded.
+
+        Returns
+        -------
+        threading.Thread or None
+            The started loading thread if `background` is set.
+        """
+
+        def preload_field(field: str, matcher) -> None:
+            with measure("preload", field):
+                matcher.preload()
+
+        def preload_all():
+            with collect(self._metrics, "preload"):
+                n_workers = workers or len(self._matchers) + 1
+                with ThreadPoolExecutor(n_workers, "preload") as executor:
+                    # Run each task in a copy of the context to keep metrics.
+                    futures = [executor.submit(copy_context().run, self._load_ids)]
+                    futures += [
+                        executor.submit(
+                            copy_context().run, preload_field, field, matcher
+                        )
+                        for field, matcher in self._matchers.items()
+                    ]
+                    for future in futures:
+                        future.result()
+
+        if not background:
+            preload_all()
+            return None
+
+        thread = threading.Thread(target=preload_all, name="preload")
+        thread.start()
+        return thread
+
     def create(self, data: pd.DataFrame, id_column: str) -> None:
         """Add data to the matching set.
 
@@ -66,7 +222,8 @@ class MultiMatcher:
             Pandas DataFrame with data to add to the matching set.
         id_column : str
             Name of the column with entity identifiers.
-            Note: Entitity dentifiers must be unique!
+            Note: Entitity dentifiers must be unique! Use `upsert` to replace
+            stored entities.
         """
         if id_column not in data.columns:
             raise RuntimeError(f"Missing ID column {id_column!r} in the data")
@@ -76,35 +233,1273 @@ class MultiMatcher:
         if missing:
             raise RuntimeError("Missing columns in the data: " + ".".join(missing))
 
-        for field, matcher in self._matchers.items():
-            matcher.create(data[["id", field]])
+        with collect(self._metrics, "create"), self._lock.shared():
+            # Parse all fields first, so invalid values do not leave partial rows.
+            prepared = {}
+            for field, matcher in self._matchers.items():
+                with measure("prepare", field):
+                    prepared[field] = matcher.prepare(data[[field]])
 
-    def get(self, target: dict) -> pd.DataFrame:
+            # All fields share the row order of the identifiers. Rows beyond the
+            # identifiers were stored by an interrupted create and are rolled back.
+            n_rows = len(self._ids)
+            for field, matcher in self._matchers.items():
+                if len(matcher) < n_rows:
+                    raise RuntimeError(
+                        f"Stored rows for {field} do not match the stored "
+                        "identifiers; the matching set needs to be rebuilt."
+                    )
+                matcher.truncate(n_rows)
+
+            for field, matcher in self._matchers.items():
+                with measure("create", field):
+                    matcher.append(prepared[field])
+
+            # Identifiers are stored last; they mark the rows as complete.
+            with measure("store_ids"):
+                generation = self._ids.generation
+                self._ids.append(data[["id"]])
+                self._index_ids(data["id"].to_numpy(), n_rows, generation)
+
+    def upsert(self, data: pd.DataFrame, id_column: str) -> None:
+        """Add data to the matching set, replacing entities with the same identifier.
+
+        The new records are appended and the rows of the replaced entities are
+        marked as removed, so only the changed records are written.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Pandas DataFrame with data to add or update in the matching set.
+        id_column : str
+            Name of the column with entity identifiers.
+        """
+        if id_column not in data.columns:
+            raise RuntimeError(f"Missing ID column {id_column!r} in the data")
+
+        with collect(self._metrics, "upsert"), self._lock.shared():
+            rows = self._live_rows(data[id_column].to_numpy())
+            self.create(data, id_column)
+
+            # Old rows are removed after the new records are stored; an interrupted
+            # upsert leaves both versions rather than none.
+            self._add_tombstones(rows)
+
+    def remove(self, ids) -> None:
+        """Remove entities from the matching set.
+
+        Removed entities are marked by their row positions and skipped in matching;
+        their stored values remain until the matching set is compacted.
+
+        Parameters
+        ----------
+        ids : array-like
+            Identifiers of the entities to remove; unknown identifiers are ignored.
+        """
+        with collect(self._metrics, "remove"), self._lock.shared():
+            self._add_tombstones(self._live_rows(np.asarray(ids)))
+
+    def get(self, target: dict, min_score: float | None = None) -> pd.DataFrame:
         """Match records from the matching set.
 
         Parameters
         ----------
         target : dict
             Search query as dict of field : value pairs.
+        min_score : float, optional
+            Only return records with at least this total similarity. Above zero,
+            only records matching the target on some field are aggregated.
+        """
+        with collect(self._metrics, "get"), self._lock.shared():
+            if self._cache is None:
+                return self._get(target, min_score)
+
+            # Results computed during a concurrent change are tagged as outdated.
+            generation = self._ids.generation + self._tombstones.generation
+            with measure("cache"):
+                values = [
+                    matcher.normalize(target[field])
+                    for field, matcher in self._matchers.items()
+                ]
+                if min_score is not None:
+                    values.append(f"min_score {min_score!r}")
+                key = self._cache.make_key(values)
+                results = self._cache.get(key, generation)
+
+            if results is None:
+                results = self._get(target, min_score)
+                self._cache.put(key, generation, results)
+            return results
+
+    def _get(self, target: dict, min_score: float | None = None) -> pd.DataFrame:
+        """Match records by scoring all fields for all records.
+
+        Parameters
+        ----------
+        target : dict
+            Search query as dict of field : value pairs.
+        min_score : float, optional
+            Minimum total similarity of the returned records.
         """
+        ids = self._load_ids()
+        removed = self._removed_rows(len(ids))
+        rows = self._blocked_rows(target, len(ids), removed)
+        if self._cascade:
+            # Removed entities are never scored.
+            if rows is None:
+                rows = np.arange(len(ids))
+                if removed is not None:
+                    rows = np.flatnonzero(~removed)
+            return self._get_cascade(target, ids, rows, min_score)
+        if min_score is not None and min_score > 0:
+            return self._get_sparse(target, ids, rows, removed, min_score)
+
+        # Get similarity scores from the individual matchers; rows beyond the
+        # identifiers are not committed yet.
+        scores = {}
+        for field, matcher in self._matchers.items():
+            with measure("score", field):
+                scores[field] = matcher.score(target[field], rows)[: len(ids)]
+
+        with measure("aggregate"):
+            total = np.zeros(len(ids) if rows is None else len(rows), dtype=np.float32)
+            for score in scores.values():
+                total += score
+
+            if rows is None and removed is not None:
+                total[removed] = -np.inf
+
+        with measure("select"):
+            if rows is None:
+                top = self._top_rows(total, self._n_live(len(ids), removed))
+            else:
+                top = self._top_rows(total)
+            if min_score is not None:
+                top = top[total[top] >= min_score]
+            rows = top if rows is None else rows[top]
+            scores = {field: score[top] for field, score in scores.items()}
+        return self._make_results(ids, rows, scores, total[top])
+
+    def _get_sparse(
+        self,
+        target: dict,
+        ids: ExtensionArray,
+        rows: np.ndarray | None,
+        removed: np.ndarray | None,
+        min_score: float,
+    ) -> pd.DataFrame:
+        """Match records by aggregating the matches of each field only.
+
+        Records without a match on any field have a total similarity of zero and
+        cannot reach a positive `min_score`, so the work of aggregating scales with
+        the number of matches rather than the number of records. Returns the same
+        results as scoring all records.
+
+        Parameters
+        ----------
+        target : dict
+            Search query as dict of field : value pairs.
+        ids : pandas.api.extensions.ExtensionArray
+            Identifiers of all stored entities.
+        rows : numpy.ndarray or None
+            Sorted row positions of the entities to consider, or None for all.
+        removed : numpy.ndarray or None
+            Mask of removed rows.
+        min_score : float
+            Minimum total similarity of the returned records; above zero.
+        """
+        matches = {}
+        for field, matcher in self._matchers.items():
+            with measure("score", field):
+                field_rows, field_scores = matcher.matches(target[field], rows)
+                committed = field_rows < len(ids)
+                matches[field] = field_rows[committed], field_scores[committed]
+
+        # Sum in the configured order, as in the exhaustive mode.
+        with measure("aggregate"):
+            matched = np.unique(
+                np.concatenate(
+                    [np.empty(0, dtype=np.int64)]
+                    + [field_rows for field_rows, _ in matches.values()]
+                )
+            )
+            total = np.zeros(len(matched), dtype=np.float32)
+            scores = {}
+            for field, (field_rows, field_scores) in matches.items():
+                scores[field] = np.zeros(len(matched), dtype=np.float32)
+                scores[field][np.searchsorted(matched, field_rows)] = field_scores
+                total += scores[field]
+
+            keep = total >= min_score
+            if removed is not None:
+                keep &= ~removed[matched]
+
+        with measure("select"):
+            matched, total = matched[keep], total[keep]
+            top = self._top_rows(total)
+            scores = {field: score[keep][top] for field, score in scores.items()}
+        return self._make_results(ids, matched[top], scores, total[top])
+
+    def _get_cascade(
+        self,
+        target: dict,
+        ids: ExtensionArray,
+        rows: np.ndarray,
+        min_score: float | None = None,
+    ) -> pd.DataFrame:
+        """Match records by scoring fields in order of cost and pruning records.
+
+        After scoring a field, the lowest possible total score of the current top-n
+        records serves as a threshold. Records that cannot reach this threshold,
+        even with the highest possible scores on the remaining fields, are dropped
+        before scoring the next field. A `min_score` raises the threshold.
+
+        Parameters
+        ----------
+        target : dict
+            Search query as dict of field : value pairs.
+        ids : pandas.api.extensions.ExtensionArray
+            Identifiers of all stored entities.
+        rows : numpy.ndarray
+            Row positions of the entities to consider.
+        min_score : float, optional
+            Minimum total similarity of the returned records.
+        """
+        # Score cheap fields first; among equal costs, fields with most weight.
+        fields = sorted(
+            self._matchers,
+            key=lambda field: (
+                self._matchers[field].cost,
+                -self._matchers[field].bounds[1],
+            ),
+        )
+        low = sum(matcher.bounds[0] for matcher in self._matchers.values())
+        high = sum(matcher.bounds[1] for matcher in self._matchers.values())
+
+        partial = np.zeros(len(rows), dtype=np.float32)
+        scores = {}
+        for field in fields:
+            matcher = self._matchers[field]
+            with measure("score", field):
+                scores[field] = matcher.score(target[field], rows)
+            partial += scores[field]
+
+            # Bounds on the total score from the fields not scored yet.
+            low -= matcher.bounds[0]
+            high -= matcher.bounds[1]
+            if len(rows) <= self._top_n and min_score is None:
+                continue
+
+            # Allow for rounding differences from the order of summation.
+            with measure("prune"):
+                threshold = -np.inf if min_score is None else min_score
+                if len(rows) > self._top_n:
+                    threshold = max(
+                        threshold,
+                        np.partition(partial + low, -self._top_n)[-self._top_n],
+                    )
+                keep = partial + high >= threshold - TOLERANCE
+
+                rows, partial = rows[keep], partial[keep]
+                scores = {field: score[keep] for field, score in scores.items()}
+
+        # Sum in the configured order, as in the exhaustive mode.
+        with measure("aggregate"):
+            total = np.zeros(len(rows), dtype=np.float32)
+            for field in self._matchers:
+                total += scores[field]
+
+        with measure("select"):
+            top = self._top_rows(total)
+            if min_score is not None:
+                top = top[total[top] >= min_score]
+            scores = {field: scores[field][top] for field in self._matchers}
+        return self._make_results(ids, rows[top], scores, total[top])
+
+    def get_many(
+        self, targets: pd.DataFrame, batch_size: int | None = None
+    ) -> pd.DataFrame:
+        """Match a batch of records from the matching set.
+
+        Each field scores a whole batch of targets in one call, which avoids the
+        fixed per-query overhead of calling `get` in a loop. Each field returns a
+        dense matrix of scores for all stored entities, so memory use is about
+        `batch_size` times the number of entities times 4 bytes, per field and once
+        more for the totals. By default, batches hold 64 million scores per field,
+        about 256 MB, whatever the number of entities.
+
+        Parameters
+        ----------
+        targets : pandas.DataFrame
+            Search queries with a column for each field.
+        batch_size : int, optional
+            Number of targets scored at once; by default, 64 million divided by the
+            number of entities.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Top matches for all targets in long format. The `target` column holds
+            the index label of the target in `targets`.
+        """
+        missing = set(self._matchers) - set(targets.columns)
+        if missing:
+            raise RuntimeError("Missing columns in the targets: " + ", ".join(missing))
+
+        with collect(self._metrics, "get_many"), self._lock.shared():
+            ids = self._load_ids()
+            if batch_size is None:
+                batch_size = max(1, BATCH_CELLS // max(len(ids), 1))
+
+            results = []
+            for start in range(0, len(targets), batch_size):
+                batch = targets.iloc[start : start + batch_size]
+
+                # Get similarity scores from the individual matchers.
+                scores = {}
+                for field, matcher in self._matchers.items():
+                    with measure("score", field):
+                        scores[field] = matcher.get_many(batch[field])[:, : len(ids)]
+
+                with measure("aggregate"):
+                    total = np.zeros((len(batch), len(ids)), dtype=np.float32)
+                    for score in scores.values():
+                        total += score
+
+                    removed = self._removed_rows(len(ids))
+                    if removed is not None:
+                        total[:, removed] = -np.inf
+
+                    # Entities not selected for a target are dropped below.
+                    if self._blocking or self._short_circuit:
+                        blocked = np.zeros(total.shape, dtype=bool)
+                        fields = self._blocking + self._short_circuit
+                        for position, target in enumerate(
+                            batch[fields].to_dict(orient="records")
+                        ):
+                            candidates = self._blocked_rows(target, len(ids), removed)
+                            if candidates is not None:
+                                blocked[position] = True
+                                blocked[position, candidates] = False
+                        total[blocked] = -np.inf
+
+                # Select and rank the top matches per target, breaking ties as `get`.
+                with measure("select"):
+                    top_n = self._n_live(len(ids), removed)
+                    top = [self._top_rows(row, top_n) for row in total]
+                    top = np.array(top, dtype=np.int64).reshape(len(batch), top_n)
+
+                with measure("results"):
+                    rows = top.ravel()
+                    result = {
+                        "target": np.repeat(batch.index, top_n),
+                        "id": np.asarray(ids[rows]),
+                    }
+                    for field, matcher in self._matchers.items():
+                        with measure("values", field):
+                            result[field] = matcher.values(rows)
+                        result[f"similarity_{field}"] = np.take_along_axis(
+                            scores[field], top, axis=1
+                        ).ravel()
+                    total = np.take_along_axis(total, top, axis=1).ravel()
+                    result["similarity"] = total
+                    result = pd.DataFrame(result)
+                    if self._blocking or self._short_circuit:
+                        result = result[result["similarity"] > -np.inf]
+                    results.append(result)
+
+            if not results:
+                return pd.DataFrame(columns=["target", "id", "similarity"])
+            return pd.concat(results, ignore_index=True)
+
+    def link(
+        self,
+        source: str | Path | Iterable[pd.DataFrame],
+        output: str | Path,
+        chunk_size: int = 10_000,
+        batch_size: int | None = None,
+        resume: bool = True,
+        progress: Callable[[int], None] | None = None,
+    ) -> None:
+        """Match all records of an external source and write the top matches.
+
+        The source is read and matched chunk by chunk, so it never needs to fit in
+        memory. After each chunk, the results are appended to the output file and a
+        checkpoint is written next to it. An interrupted run continues after the
+        last completed chunk; the checkpoint is removed when all chunks are done.
+        The checkpoint records the path, size and modification time of a source
+        file and the chunk size; resuming with another source or chunk size fails.
+        Chunks of records cannot be identified, so they must be the same on resume.
+
+        Parameters
+        ----------
+        source : str, pathlib.Path or iterable of pandas.DataFrame
+            CSV or Parquet file, or chunks of records, with a column for each field.
+            Reading Parquet files requires pyarrow.
+        output : str or pathlib.Path
+            CSV file to write the matches to, with the position of the record in
+            the source in `source_row`, the identifier of the match in `id`, the
+            similarity scores per field and the total `similarity`.
+        chunk_size : int, default=10_000
+            Number of records read from a file at once.
+        batch_size : int, optional
+            Number of records scored at once; by default, sized to the number of
+            stored entities, see `get_many`.
+        resume : bool, default=True
+            Continue from the checkpoint of an interrupted run, if any. Otherwise,
+            the output and checkpoint are overwritten.
+        progress : callable, optional
+            Called with the number of linked records after each chunk.
+        """
+        output = Path(output)
+        checkpoint = output.with_name(output.name + ".checkpoint")
+
+        # A checkpoint only applies to the same source, read in the same chunks.
+        run = {"source": _source_identity(source), "chunk_size": chunk_size}
+        done = {"chunks": 0, "rows": 0, "size": 0}
+        if resume and checkpoint.exists():
+            done = json.loads(checkpoint.read_text(encoding="utf-8"))
+            if {key: done.get(key) for key in run} != run:
+                raise RuntimeError(
+                    f"The checkpoint {checkpoint} was written for another source or "
+                    "chunk size; link with resume=False to start over."
+                )
+
+        columns = ["source_row", "id"]
+        columns += [f"similarity_{field}" for field in self._matchers]
+        columns += ["similarity"]
+        if done["chunks"]:
+            # Discard results written after the last checkpoint.
+            with open(output, "r+b") as output_file:
+                output_file.truncate(done["size"])
+        else:
+            pd.DataFrame(columns=columns).to_csv(output, index=False)
+
+        for number, chunk in enumerate(_read_chunks(source, chunk_size)):
+            if number < done["chunks"]:
+                continue
+
+            # Label the records by their position in the source.
+            start = done["rows"]
+            chunk = chunk.set_axis(pd.RangeIndex(start, start + len(chunk)))
+            results = self.get_many(chunk, batch_size)
+            results = results.rename(columns={"target": "source_row"})
+
+            with open(output, "a", encoding="utf-8", newline="") as output_file:
+                results.reindex(columns=columns).to_csv(
+                    output_file, header=False, index=False
+                )
+                output_file.flush()
+                os.fsync(output_file.fileno())
+
+            done = run | {
+                "chunks": number + 1,
+                "rows": start + len(chunk),
+                "size": output.stat().st_size,
+            }
+            _write_atomic(checkpoint, json.dumps(done).encode("utf8"))
+            if progress is not None:
+                progress(done["rows"])
+
+        checkpoint.unlink(missing_ok=True)
+
+    def deduplicate(
+        self,
+        threshold: float,
+        output=None,
+        chunk_size: int = 1000,
+        workers: int | None = None,
+    ) -> Iterator[pd.DataFrame] | None:
+        """Find pairs of similar entities within the matching set.
+
+        The stored records are compared with each other in chunks, using the
+        configured matchers and weights. Like targets of `get`, records are only
+        compared with their exact hits on short-circuit fields, if they have any,
+        or else with the records in their blocks. Without such fields, records are
+        compared with all records, in tiles of `chunk_size` records.
+
+        Chunks are scored in parallel threads and each pair of entities is compared
+        once, with the record selecting the other as target, or the first stored if
+        both select each other. Memory use is roughly `workers` times `chunk_size`
+        squared per field.
+
+        Parameters
+        ----------
+        threshold : float
+            Minimum total similarity of a pair, on the scale of the weighted scores.
+        output : str or pathlib.Path, optional
+            CSV file to write the pairs to; by default the pairs are returned.
+        chunk_size : int, default=1000
+            Number of entities compared with their candidates at once.
+        workers : int, optional
+            Number of threads scoring chunks; one per core by default.
+
+        Returns
+        -------
+        iterator of pandas.DataFrame or None
+            Pairs per chunk, with the identifiers in `id_left` and `id_right`, the
+            similarity scores per field and the total `similarity`. Nothing is
+            returned when writing to `output`.
+        """
+        pairs = self._duplicate_pairs(threshold, chunk_size, workers)
+        if output is None:
+            return pairs
+
+        # Write the header first, so the file is complete even without pairs.
+        columns = ["id_left", "id_right"]
+        columns += [f"similarity_{field}" for field in self._matchers]
+        pd.DataFrame(columns=[*columns, "similarity"]).to_csv(output, index=False)
+        for chunk in pairs:
+            chunk.to_csv(output, mode="a", header=False, index=False)
+        return None
+
+    def _duplicate_pairs(
+        self, threshold: float, chunk_size: int, workers: int | None
+    ) -> Iterator[pd.DataFrame]:
+        """Score chunks of entities in parallel and yield their pairs in order."""
+        with self._lock.shared():
+            ids = self._load_ids()
+            removed = self._removed_rows(len(ids))
+            live = np.arange(len(ids)) if removed is None else np.flatnonzero(~removed)
+            chunks = [
+                live[start : start + chunk_size]
+                for start in range(0, len(live), chunk_size)
+            ]
+
+            n_workers = workers or os.cpu_count() or 1
+            with ThreadPoolExecutor(n_workers, "deduplicate") as executor:
+                # Entities with short-circuit hits are only compared with their hits.
+                has_hits = np.zeros(len(ids), dtype=bool)
+                if self._short_circuit:
+                    found = executor.map(
+                        lambda rows: self._has_hits(rows, len(ids), removed), chunks
+                    )
+                    for rows, hits in zip(chunks, found):
+                        has_hits[rows] = hits
+
+                # Limit the chunks in progress, so memory does not grow with the data.
+                pending = deque()
+                for rows in chunks:
+                    pending.append(
+                        executor.submit(
+                            self._score_duplicates,
+                            rows,
+                            ids,
+                            live,
+                            removed,
+                            has_hits,
+                            threshold,
+                            chunk_size,
+                        )
+                    )
+                    if len(pending) >= n_workers:
+                        yield pending.popleft().result()
+                while pending:
+                    yield pending.popleft().result()
+
+    def _has_hits(
+        self, rows: np.ndarray, n_rows: int, removed: np.ndarray | None
+    ) -> np.ndarray:
+        """Return whether stored entities have short-circuit hits besides themselves.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Row positions of the entities.
+        n_rows : int
+            Number of committed rows.
+        removed : numpy.ndarray or None
+            Mask of removed rows.
+        """
+        values = {
+            field: self._matchers[field].values(rows) for field in self._short_circuit
+        }
+        hits = np.zeros(len(rows), dtype=bool)
+        for position, row in enumerate(rows):
+            target = {field: values[field][position] for field in self._short_circuit}
+            found = self._candidate_rows(
+                self._short_circuit, target, n_rows, removed, row
+            )
+            hits[position] = len(found) > 0
+        return hits
+
+    def _score_duplicates(
+        self,
+        rows: np.ndarray,
+        ids: ExtensionArray,
+        live: np.ndarray,
+        removed: np.ndarray | None,
+        has_hits: np.ndarray,
+        threshold: float,
+        chunk_size: int,
+    ) -> pd.DataFrame:
+        """Score the pairs of a chunk of stored entities.
+
+        Entities are compared with the entities they would select as a target:
+        their short-circuit hits or the entities in their blocks. Entities without
+        hits or blocking fields are compared with all entities, in tiles. Hits and
+        blocks select each other, so each pair is scored from its lowest row, except
+        pairs of an entity with hits and one without, which only the latter selects.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Row positions of the entities in the chunk.
+        ids : pandas.api.extensions.ExtensionArray
+            Identifiers of all stored entities.
+        live : numpy.ndarray
+            Row positions of all entities that have not been removed.
+        removed : numpy.ndarray or None
+            Mask of removed rows.
+        has_hits : numpy.ndarray
+            Mask of rows with short-circuit hits besides themselves.
+        threshold : float
+            Minimum total similarity of a pair.
+        chunk_size : int
+            Size of the tiles of entities scored at once.
+        """
+        fields = self._short_circuit + self._blocking
+        open_rows, selected = rows, []
+        if fields:
+            values = {field: self._matchers[field].values(rows) for field in fields}
+            open_rows = []
+            for position, row in enumerate(rows):
+                target = {field: values[field][position] for field in fields}
+                candidates = self._blocked_rows(target, len(ids), removed, row)
+                if candidates is None:
+                    open_rows.append(row)
+                    continue
+
+                # Entities in the same block share their lowest candidate.
+                block = min(row, candidates[0]) if len(candidates) else row
+                keep = (candidates > row) | (has_hits[candidates] != has_hits[row])
+                if keep.any():
+                    selected.append((block, row, candidates[keep]))
+
         results = []
+        if selected:
+            selected.sort(key=lambda target: target[0])
+            results.extend(self._score_candidates(selected, threshold, chunk_size))
+        if len(open_rows):
+            open_rows = np.asarray(open_rows, dtype=np.int64)
+            results.extend(
+                self._score_tiles(open_rows, live, has_hits, threshold, chunk_size)
+            )
+
+        if not results:
+            empty = np.empty(0, dtype=np.int64)
+            scores = {field: np.empty(0, dtype=np.float32) for field in self._matchers}
+            results.append((empty, empty, scores))
+
+        # Order the pairs by row, as they are listed in the stored order.
+        left = np.concatenate([result[0] for result in results])
+        right = np.concatenate([result[1] for result in results])
+        order = np.lexsort((right, left))
+        pairs = {
+            "id_left": np.asarray(ids[left[order]]),
+            "id_right": np.asarray(ids[right[order]]),
+        }
+        total = np.zeros(len(order), dtype=np.float32)
+        for field in self._matchers:
+            score = np.concatenate([result[2][field] for result in results])[order]
+            pairs[f"similarity_{field}"] = score
+            total += score
+        pairs["similarity"] = total
+        return pd.DataFrame(pairs)
+
+    def _score_candidates(
+        self,
+        selected: list[tuple[int, int, np.ndarray]],
+        threshold: float,
+        chunk_size: int,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, dict]]:
+        """Score stored entities against their candidates.
+
+        Entities are scored in batches against the union of their candidates,
+        keeping about `chunk_size` squared scores per field at once. Entities in
+        the same block are batched together, so they share their candidates.
+
+        Parameters
+        ----------
+        selected : list of tuple
+            Block of each entity, its row position and the sorted row positions of
+            its candidates, ordered by block.
+        threshold : float
+            Minimum total similarity of a pair.
+        chunk_size : int
+            Square root of the number of scores per field in a batch.
+
+        Yields
+        ------
+        tuple
+            Row positions of the pairs reaching the threshold and their similarity
+            scores per field.
+        """
+        batches, batch, columns = [], [], np.empty(0, dtype=np.int64)
+        for _, block in itertools.groupby(selected, key=lambda target: target[0]):
+            block = [target[1:] for target in block]
+            union = np.unique(np.concatenate([candidates for _, candidates in block]))
+
+            # Large blocks are split over several batches.
+            size = max(1, chunk_size**2 // len(union))
+            for start in range(0, len(block), size):
+                part = block[start : start + size]
+                merged = np.union1d(columns, union)
+                if batch and (len(batch) + len(part)) * len(merged) > chunk_size**2:
+                    batches.append((batch, columns))
+                    batch, merged = [], union
+                batch.extend(part)
+                columns = merged
+        batches.append((batch, columns))
+
+        for batch, columns in batches:
+            rows = np.array([row for row, _ in batch], dtype=np.int64)
+            counts = [len(candidates) for _, candidates in batch]
+            left = np.repeat(rows, counts)
+            right = np.concatenate([candidates for _, candidates in batch])
+            positions = np.repeat(np.arange(len(rows)), counts)
+            column_positions = np.searchsorted(columns, right)
+
+            scores = {}
+            total = np.zeros(len(left), dtype=np.float32)
+            for field, matcher in self._matchers.items():
+                values = pd.Series(matcher.values(rows))
+                scores[field] = matcher.get_many(values, columns)[
+                    positions, column_positions
+                ]
+                total += scores[field]
+
+            keep = total >= threshold
+            yield (
+                left[keep],
+                right[keep],
+                {field: score[keep] for field, score in scores.items()},
+            )
+
+    def _score_tiles(
+        self,
+        rows: np.ndarray,
+        live: np.ndarray,
+        has_hits: np.ndarray,
+        threshold: float,
+        chunk_size: int,
+    ) -> Iterator[tuple[np.ndarray, np.ndarray, dict]]:
+        """Score stored entities without candidates against all live entities.
+
+        The live entities are scored in tiles of `chunk_size`. Fields with an index
+        look up the matches of the entities once, rather than for every tile.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities without candidates.
+        live : numpy.ndarray
+            Row positions of all entities that have not been removed.
+        has_hits : numpy.ndarray
+            Mask of rows with short-circuit hits besides themselves.
+        threshold : float
+            Minimum total similarity of a pair.
+        chunk_size : int
+            Number of entities in a tile.
 
-        # Get similarity scores from the individual matchers.
+        Yields
+        ------
+        tuple
+            Row positions of the pairs reaching the threshold and their similarity
+            scores per field.
+        """
+        values, matches = {}, {}
         for field, matcher in self._matchers.items():
-            result = matcher.get(target[field])
-            if result is None:
-                raise RuntimeError(f"No results for {field}; aborting...")
+            values[field] = pd.Series(matcher.values(rows))
+            if matcher.indexed:
+                # Matches of all entities, as target positions, rows and scores.
+                found = [matcher.matches(value) for value in values[field]]
+                counts = [len(matched) for matched, _ in found]
+                targets = np.repeat(np.arange(len(rows)), counts)
+                matched = np.concatenate(
+                    [np.empty(0, dtype=np.int64), *(matched for matched, _ in found)]
+                )
+                scores = np.concatenate(
+                    [np.empty(0, dtype=np.float32), *(scores for _, scores in found)]
+                )
+                order = np.argsort(matched, kind="stable")
+                matches[field] = targets[order], matched[order], scores[order]
+
+        for start in range(0, len(live), chunk_size):
+            columns = live[start : start + chunk_size]
+
+            # Pairs of entities without candidates are scored from the lowest row.
+            skip = (columns <= rows[:, np.newaxis]) & ~has_hits[columns]
+            if skip.all():
+                continue
+
+            scores = {}
+            total = np.zeros((len(rows), len(columns)), dtype=np.float32)
+            for field, matcher in self._matchers.items():
+                if field in matches:
+                    scores[field] = _scatter(*matches[field], columns, len(rows))
+                else:
+                    scores[field] = matcher.get_many(values[field], columns)
+                total += scores[field]
+            total[skip] = -np.inf
+
+            left, right = np.nonzero(total >= threshold)
+            yield (
+                rows[left],
+                columns[right],
+                {field: score[left, right] for field, score in scores.items()},
+            )
+
+    def _import_legacy(self, encryption_key: bytes, storage_path: Path) -> None:
+        """Import a matching set stored by a version without segmented storage.
+
+        Those versions stored each field in a single file, `<matcher>_<field>.dat`,
+        with the identifiers in every file. The fields are added to the matching set
+        with `create`, after which the old files are removed. Stores that cannot be
+        imported raise an error instead of appearing empty.
+        """
+        legacy = sorted(path for path in storage_path.glob("*.dat") if path.is_file())
+        if not legacy:
+            return
+        if len(self._ids):
+            # An import was interrupted after storing the identifiers.
+            print(f"Warning: Ignoring files stored by an older version: {legacy}")
+            return
+
+        frames = {}
+        for field, matcher in self._matchers.items():
+            path = storage_path / matcher._make_filename("dat")
+            if path.is_file():
+                frames[field] = _read_legacy(encryption_key, path)
+
+        ids = None
+        for frame in frames.values():
+            if ids is None:
+                ids = frame["id"].reset_index(drop=True)
+            elif not frame["id"].reset_index(drop=True).equals(ids):
+                frames = {}
+        if len(frames) != len(self._matchers) or len(frames) != len(legacy):
+            raise RuntimeError(
+                f"The matching set in {storage_path} was stored by an older version "
+                "for other fields or algoritms; it needs to be rebuilt with `create` "
+                "in an empty folder."
+            )
+
+        print(f"Importing {len(ids)} records stored by an older version...")
+        data = {field: frame[field].to_numpy() for field, frame in frames.items()}
+        self.create(pd.DataFrame({"id": ids} | data), "id")
+
+        # Vector fields also stored their vectors, which are rebuilt on import.
+        for path in legacy:
+            path.unlink()
+            path.with_suffix(".npz").unlink(missing_ok=True)
+
+    def _load_ids(self) -> ExtensionArray:
+        """Load the identifiers of all stored entities in row order.
+
+        String identifiers are decoded only for the rows that are selected from the
+        returned array.
+        """
+        with measure("load_ids"):
+            ids = self._ids.load()
+        if ids is None:
+            raise RuntimeError("No data in the matching set; aborting...")
+        return ids["id"].array
+
+    def _blocked_rows(
+        self,
+        target: dict,
+        n_rows: int,
+        removed: np.ndarray | None,
+        row: int | None = None,
+    ) -> np.ndarray | None:
+        """Return the live rows selected for a target, or None to match all rows.
+
+        Exact hits on short-circuit fields are selected if there are any. Otherwise,
+        the rows in the blocks of the blocking fields are selected, if any are set.
+
+        Parameters
+        ----------
+        target : dict
+            Search query as dict of field : value pairs.
+        n_rows : int
+            Number of committed rows.
+        removed : numpy.ndarray or None
+            Mask of removed rows.
+        row : int, optional
+            Row position of a stored target, which does not select itself.
+        """
+        with measure("block"):
+            if self._short_circuit:
+                rows = self._candidate_rows(
+                    self._short_circuit, target, n_rows, removed, row
+                )
+                if len(rows):
+                    return rows
+            if self._blocking:
+                return self._candidate_rows(
+                    self._blocking, target, n_rows, removed, row
+                )
+        return None
+
+    def _candidate_rows(
+        self,
+        fields: list[str],
+        target: dict,
+        n_rows: int,
+        removed: np.ndarray | None,
+        row: int | None = None,
+    ) -> np.ndarray:
+        """Return the sorted live rows selected by any of the fields for a target."""
+        found = [self._matchers[field].candidates(target[field]) for field in fields]
+        rows = found[0] if len(found) == 1 else np.unique(np.concatenate(found))
+        rows = rows[rows < n_rows]
+        if row is not None:
+            rows = rows[rows != row]
+        if removed is not None:
+            rows = rows[~removed[rows]]
+        return rows
+
+    def _removed_rows(self, n_rows: int) -> np.ndarray | None:
+        """Return a mask of removed rows, or None if no entities were removed.
+
+        The mask is rebuilt only if the tombstones changed elsewhere; it has spare
+        capacity, so adding entities does not copy it each time.
+        """
+        generation, removed = self._removed
+        if generation != self._tombstones.generation:
+            generation, removed = self._tombstones.generation, None
+            if len(self._tombstones):
+                with measure("load_tombstones"):
+                    rows = self._tombstones.load()["row"].to_numpy()
+                removed = self._grow_mask(None, n_rows)
+                removed[rows] = True
+            self._removed = (generation, removed)
+
+        if removed is None:
+            return None
+        if len(removed) < n_rows:
+            removed = self._grow_mask(removed, n_rows)
+            self._removed = (generation, removed)
+        return removed[:n_rows]
+
+    @staticmethod
+    def _grow_mask(mask: np.ndarray | None, n_rows: int) -> np.ndarray:
+        """Return a mask of at least n_rows, doubling its capacity if needed."""
+        if mask is None:
+            mask = np.zeros(0, dtype=bool)
+        if len(mask) >= n_rows:
+            return mask
+        grown = np.zeros(max(n_rows, 2 * len(mask)), dtype=bool)
+        grown[: len(mask)] = mask
+        return grown
+
+    def _n_live(self, n_rows: int, removed: np.ndarray | None) -> int:
+        """Return the number of results to select given the removed rows."""
+        if removed is not None:
+            n_rows -= np.count_nonzero(removed)
+        return min(self._top_n, n_rows)
+
+    def _live_rows(self, ids: np.ndarray) -> np.ndarray:
+        """Return the row positions of stored entities that have not been removed.
+
+        Parameters
+        ----------
+        ids : numpy.ndarray
+            Identifiers to look up; unknown identifiers are ignored.
+        """
+        n_rows = len(self._ids)
+        if not n_rows:
+            return np.empty(0, dtype=np.int64)
+
+        # The hash indexes are rebuilt only if the identifiers changed elsewhere.
+        cached_generation, parts = self._id_index
+        if cached_generation != self._ids.generation:
+            parts = [(0, pd.Index(np.asarray(self._load_ids())))]
+            self._id_index = (self._ids.generation, parts)
+
+        rows = []
+        for offset, index in parts:
+            found = index.get_indexer_for(ids)
+            rows.append(offset + found[found >= 0])
+        rows = np.unique(np.concatenate(rows))
+
+        removed = self._removed_rows(n_rows)
+        if removed is not None:
+            rows = rows[~removed[rows]]
+        return rows
+
+    def _index_ids(self, ids: np.ndarray, offset: int, generation: int) -> None:
+        """Add appended identifiers to the hash indexes, if they are up to date.
+
+        New identifiers get their own index. Like sized indexes are merged, so
+        there are only a few indexes and each identifier is hashed a few times.
+
+        Parameters
+        ----------
+        ids : numpy.ndarray
+            Appended identifiers.
+        offset : int
+            Row position of the first appended identifier.
+        generation : int
+            Generation of the identifiers before the append.
+        """
+        cached_generation, parts = self._id_index
+        if cached_generation != generation or not len(ids):
+            return
+
+        parts = [*parts, (offset, pd.Index(ids))]
+        while len(parts) > 1 and len(parts[-1][1]) >= len(parts[-2][1]):
+            (offset, older), (_, newer) = parts[-2:]
+            parts[-2:] = [(offset, older.append(newer))]
+        self._id_index = (self._ids.generation, parts)
+
+    def _add_tombstones(self, rows: np.ndarray) -> None:
+        """Mark rows as removed and invalidate cached results."""
+        if len(rows):
+            with measure("store_tombstones"):
+                generation = self._tombstones.generation
+                self._tombstones.append(pd.DataFrame({"row": rows}))
+
+                # Update the cached mask in place, rather than rebuilding it.
+                cached_generation, removed = self._removed
+                if cached_generation == generation:
+                    removed = self._grow_mask(removed, rows.max() + 1)
+                    removed[rows] = True
+                    self._removed = (self._tombstones.generation, removed)
+
+    def _top_rows(self, total: np.ndarray, top_n: int | None = None) -> np.ndarray:
+        """Return the positions of the highest total scores in descending order.
+
+        Ties are broken by row position, so the same rows are selected no matter
+        which subset of rows was scored.
+        """
+        top_n = min(self._top_n if top_n is None else top_n, len(total))
+        if top_n == 0:
+            return np.empty(0, dtype=np.int64)
+
+        threshold = np.partition(total, -top_n)[-top_n]
+        rows = np.flatnonzero(total > threshold)
+        ties = np.flatnonzero(total == threshold)[: top_n - len(rows)]
+
+        rows = np.concatenate([rows, ties])
+        return rows[np.argsort(-total[rows], kind="stable")]
+
+    def _make_results(
+        self, ids: ExtensionArray, rows: np.ndarray, scores: dict, total: np.ndarray
+    ) -> pd.DataFrame:
+        """Materialize identifiers, values and scores for the selected rows.
+
+        Parameters
+        ----------
+        ids : pandas.api.extensions.ExtensionArray
+            Identifiers of all stored entities.
+        rows : numpy.ndarray
+            Row positions of the selected entities.
+        scores : dict
+            Similarity scores per field for the selected entities.
+        total : numpy.ndarray
+            Total similarity scores for the selected entities.
+        """
+        with measure("results"):
+            results = pd.DataFrame(index=pd.Index(np.asarray(ids[rows]), name="id"))
+            for field, matcher in self._matchers.items():
+                with measure("values", field):
+                    results[field] = matcher.values(rows)
+                results[f"similarity_{field}"] = scores[field]
+            results["similarity"] = total
+
+            return results
+
+    def compact(
+        self, segment_rows: int = SEGMENT_ROWS, background: bool = False
+    ) -> threading.Thread | None:
+        """Drop removed entities and merge small storage segments for all fields.
+
+        First, the rows of removed and replaced entities are dropped from all stores
+        and the remaining rows are renumbered. Queries and changes wait while the
+        rows are dropped; an interrupted compaction is finished when the matching
+        set is opened again. Then, small segments are merged. Merged segments are
+        written next to the existing ones and swapped in atomically, so `get` keeps
+        serving the data loaded before.
 
-            results.append(result)
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        background : bool, default=False
+            Run compaction in a background thread.
+
+        Returns
+        -------
+        threading.Thread or None
+            The started compaction thread if `background` is set.
+        """
+
+        def compact_all():
+            self._drop_removed()
+            for matcher in self._matchers.values():
+                matcher.compact(segment_rows)
+            self._ids.compact(segment_rows)
+            self._tombstones.compact(segment_rows)
 
-        results = pd.concat(results, axis=1, join="inner")
-        columns = [c for c in results.columns if c.startswith("similarity")]
-        results["similarity"] = results[columns].sum(axis=1)
-        results = results.nlargest(self._top_n, columns="similarity")
+        if not background:
+            compact_all()
+            return None
+
+        thread = threading.Thread(target=compact_all, name="compaction")
+        thread.start()
+        return thread
+
+    def _drop_removed(self) -> None:
+        """Rewrite all stores without the rows of removed entities.
+
+        The kept rows follow from the tombstones and the number of identifiers,
+        which are recorded in a journal before any store is rewritten. Stores are
+        tagged with the journal token, so an interrupted rewrite can be repeated.
+        """
+        journal = self._storage_path / COMPACTION
+        with self._lock.exclusive():
+            if journal.exists():
+                state = json.loads(journal.read_text(encoding="utf-8"))
+            elif len(self._tombstones):
+                state = {"token": uuid.uuid4().hex, "rows": len(self._ids)}
+                _write_atomic(journal, json.dumps(state).encode("utf8"))
+            else:
+                return
 
-        return results.sort_values(by="similarity", ascending=False)
+            if len(self._tombstones):
+                removed = np.zeros(state["rows"], dtype=bool)
+                removed[self._tombstones.load()["row"].to_numpy()] = True
+                rows = np.flatnonzero(~removed)
+
+                # Rows beyond the identifiers were left by an interrupted create.
+                for field, matcher in self._matchers.items():
+                    with measure("drop_removed", field):
+                        matcher.truncate(state["rows"])
+                        matcher.keep_rows(rows, state["token"])
+
+                # Identifiers are rewritten last and tombstones are cleared after.
+                self._ids.keep_rows(rows, state["token"])
+                self._tombstones.delete()
+            journal.unlink(missing_ok=True)
+
+            self._removed = (None, None)
+            self._id_index = (None, None)
+            if self._cache is not None:
+                self._cache.clear()
 
     def delete(self) -> None:
         """Delete all matching data."""
-        for field, matcher in self._matchers.items():
-            matcher.delete(field)
+        for matcher in self._matchers.values():
+            matcher.delete()
+        self._ids.delete()
+        self._tombstones.delete()
+        if self._cache is not None:
+            self._cache.clear()
+
+
+class _SharedLock:
+    """Lock held by any number of threads at once, or by one thread exclusively.
+
+    Threads taking the lock shared do not wait for a thread waiting to take it
+    exclusively, so the lock can be taken shared again by a thread holding it.
+    """
+
+    def __init__(self) -> None:
+        self._condition = threading.Condition()
+        self._shared = 0
+        self._exclusive = False
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        """Hold the lock shared with other threads."""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._exclusive)
+            self._shared += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._shared -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def exclusive(self) -> Iterator[None]:
+        """Hold the lock, waiting until no other thread holds it."""
+        with self._condition:
+            self._condition.wait_for(lambda: not (self._exclusive or self._shared))
+            self._exclusive = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._exclusive = False
+                self._condition.notify_all()
+
+
+def _scatter(
+    targets: np.ndarray,
+    rows: np.ndarray,
+    scores: np.ndarray,
+    columns: np.ndarray,
+    n_targets: int,
+) -> np.ndarray:
+    """Return sparse scores as a dense matrix for a set of rows.
+
+    Parameters
+    ----------
+    targets : numpy.ndarray
+        Target position of each score.
+    rows : numpy.ndarray
+        Sorted row position of each score.
+    scores : numpy.ndarray
+        Scores to place.
+    columns : numpy.ndarray
+        Sorted row positions of the columns of the matrix.
+    n_targets : int
+        Number of rows of the matrix.
+    """
+    dense = np.zeros((n_targets, len(columns)), dtype=np.float32)
+    start = np.searchsorted(rows, columns[0], side="left")
+    end = np.searchsorted(rows, columns[-1], side="right")
+    positions = np.searchsorted(columns, rows[start:end])
+    found = columns[positions] == rows[start:end]
+    dense[targets[start:end][found], positions[found]] = scores[start:end][found]
+    return dense
+
+
+def _source_identity(source: str | Path | Iterable[pd.DataFrame]) -> dict | None:
+    """Identify a source file by its path, size and modification time."""
+    if not isinstance(source, (str, Path)):
+        return None
+
+    path = Path(source).resolve()
+    stat = path.stat()
+    return {"path": str(path), "size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def _read_chunks(
+    source: str | Path | Iterable[pd.DataFrame], chunk_size: int
+) -> Iterator[pd.DataFrame]:
+    """Read records from a CSV or Parquet file in chunks, or pass chunks through."""
+    if not isinstance(source, (str, Path)):
+        yield from source
+        return
+
+    path = Path(source)
+    if path.suffix.lower() not in (".parquet", ".pq"):
+        # Read all values as text, so codes keep leading zeros.
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype=str)
+        return
+
+    try:
+        from pyarrow import parquet
+    except ImportError as error:
+        raise RuntimeError(
+            "Reading Parquet files requires pyarrow; "
+            "install it with: pip install fuzzy-matching[parquet]"
+        ) from error
+
+    for batch in parquet.ParquetFile(path).iter_batches(chunk_size):
+        yield batch.to_pandas()
@@ -0,0 +1,258 @@
+"""Module for fuzzy matching on multiple characteristics across processes."""
+
+import json
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fuzzy_matching.match_multi import MultiMatcher
+from fuzzy_matching.storage import SEGMENT_ROWS
+
+# File recording the number of shards in the storage folder.
+SHARDING = "sharding.json"
+
+# Matcher for the shard loaded in a worker process.
+_shard = None
+
+
+class ShardedMultiMatcher:
+    """Fuzzy matching on multiple characteristics, sharded over worker processes.
+
+    Entities are assigned to shards by a hash of their identifier. Each shard has
+    its own storage folder and a dedicated worker process that keeps the shard
+    loaded. Queries are scored by all shards in parallel and the top results of the
+    shards are merged.
+
+    Parameters
+    ----------
+    top_n : int
+        Number of results to return.
+    config : dict
+        Dict of field names and matching settings.
+    encryption_key : bytes
+        Encryption key for storing data, provided as bytes.
+    storage_path : str, default="storage"
+        Folder to store data in.
+    shards : int, default=4
+        Number of shards; cannot be changed after data has been added.
+    cascade : bool, default=False
+        Use cascade mode within each shard, see `MultiMatcher`.
+    """
+
+    def __init__(
+        self,
+        top_n,
+        config,
+        encryption_key: bytes,
+        storage_path="storage",
+        shards: int = 4,
+        cascade: bool = False,
+    ) -> None:
+        storage_path = Path(storage_path)
+        storage_path.mkdir(parents=True, exist_ok=True)
+
+        # Data would end up in the wrong shards with a different shard count.
+        sharding = storage_path / SHARDING
+        if sharding.exists():
+            stored = json.loads(sharding.read_text(encoding="utf-8"))["shards"]
+            if stored != shards:
+                raise ValueError(
+                    f"Storage folder contains {stored} shards, not {shards}."
+                )
+        else:
+            sharding.write_text(json.dumps({"shards": shards}), encoding="utf-8")
+
+        self._top_n = top_n
+        self._storage_path = storage_path
+
+        # Shards already run in parallel; avoid starting a thread per core in each.
+        config = {
+            field: {"workers": 1} | settings for field, settings in config.items()
+        }
+
+        # One single-process pool per shard, so each shard has one loaded copy.
+        self._pools = [
+            ProcessPoolExecutor(
+                max_workers=1,
+                initializer=_load_shard,
+                initargs=(
+                    top_n,
+                    config,
+                    encryption_key,
+                    storage_path / f"shard_{shard:03d}",
+                    cascade,
+                ),
+            )
+            for shard in range(shards)
+        ]
+
+    def __len__(self) -> int:
+        """Return the number of stored entities."""
+        return sum(self._map("__len__"))
+
+    def create(self, data: pd.DataFrame, id_column: str) -> None:
+        """Add data to the matching set.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Pandas DataFrame with data to add to the matching set.
+        id_column : str
+            Name of the column with entity identifiers.
+            Note: Entitity dentifiers must be unique!
+        """
+        if id_column not in data.columns:
+            raise RuntimeError(f"Missing ID column {id_column!r} in the data")
+
+        self._route("create", data, data[id_column], id_column)
+
+    def upsert(self, data: pd.DataFrame, id_column: str) -> None:
+        """Add data to the matching set, replacing entities with the same identifier.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Pandas DataFrame with data to add or update in the matching set.
+        id_column : str
+            Name of the column with entity identifiers.
+        """
+        if id_column not in data.columns:
+            raise RuntimeError(f"Missing ID column {id_column!r} in the data")
+
+        self._route("upsert", data, data[id_column], id_column)
+
+    def remove(self, ids) -> None:
+        """Remove entities from the matching set.
+
+        Parameters
+        ----------
+        ids : array-like
+            Identifiers of the entities to remove; unknown identifiers are ignored.
+        """
+        ids = pd.Series(ids)
+        self._route("remove", ids, ids)
+
+    def get(self, target: dict, min_score: float | None = None) -> pd.DataFrame:
+        """Match records from the matching set.
+
+        Parameters
+        ----------
+        target : dict
+            Search query as dict of field : value pairs.
+        min_score : float, optional
+            Only return records with at least this total similarity.
+        """
+        results = [
+            result
+            for result in self._map("get", target, min_score)
+            if result is not None
+        ]
+        if not results:
+            raise RuntimeError("No data in the matching set; aborting...")
+
+        results = pd.concat(results)
+        order = np.argsort(-results["similarity"].to_numpy(), kind="stable")
+        return results.iloc[order[: self._top_n]]
+
+    def get_many(
+        self, targets: pd.DataFrame, batch_size: int | None = None
+    ) -> pd.DataFrame:
+        """Match a batch of records from the matching set.
+
+        Parameters
+        ----------
+        targets : pandas.DataFrame
+            Search queries with a column for each field.
+        batch_size : int, optional
+            Number of targets scored at once by each shard; by default, sized by
+            each shard to its number of entities, see `MultiMatcher.get_many`.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Top matches for all targets in long format. The `target` column holds
+            the index label of the target in `targets`.
+        """
+        # Shards refer to targets by position, labels need not be unique.
+        labels = targets.index
+        targets = targets.reset_index(drop=True)
+
+        results = [
+            result
+            for result in self._map("get_many", targets, batch_size)
+            if result is not None
+        ]
+        if not results:
+            raise RuntimeError("No data in the matching set; aborting...")
+
+        # Rank the matches of all shards per target and keep the best.
+        results = pd.concat(results, ignore_index=True)
+        positions = results["target"].to_numpy()
+        order = np.lexsort((-results["similarity"].to_numpy(), positions))
+        results = results.iloc[order]
+        results = results[results.groupby("target").cumcount() < self._top_n]
+        return results.assign(target=labels[results["target"].to_numpy()]).reset_index(
+            drop=True
+        )
+
+    def preload(self) -> None:
+        """Load the stored data of all shards ahead of the first query."""
+        self._map("preload")
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for all shards.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        self._map("compact", segment_rows)
+
+    def delete(self) -> None:
+        """Delete all matching data."""
+        self._map("delete")
+        (self._storage_path / SHARDING).unlink(missing_ok=True)
+
+    def close(self) -> None:
+        """Stop the worker processes."""
+        for pool in self._pools:
+            pool.shutdown()
+
+    def _map(self, method: str, *args) -> list:
+        """Call a MultiMatcher method on all shards in parallel."""
+        futures = [pool.submit(_call_shard, method, *args) for pool in self._pools]
+        return [future.result() for future in futures]
+
+    def _route(self, method: str, data, ids: pd.Series, *args) -> None:
+        """Call a MultiMatcher method on each shard with the data of its entities."""
+        shards = self._assign_shards(ids)
+        futures = [
+            pool.submit(_call_shard, method, data[shards == shard], *args)
+            for shard, pool in enumerate(self._pools)
+            if (shards == shard).any()
+        ]
+        for future in futures:
+            future.result()
+
+    def _assign_shards(self, ids: pd.Series) -> np.ndarray:
+        """Assign identifiers to shards by a hash that is stable across processes."""
+        hashes = pd.util.hash_array(ids.astype(str).to_numpy(dtype=object))
+        return (hashes % np.uint64(len(self._pools))).astype(np.int64)
+
+
+def _load_shard(
+    top_n: int, config: dict, encryption_key: bytes, storage_path: Path, cascade: bool
+) -> None:
+    """Create the matcher for the shard of a worker process."""
+    global _shard
+    _shard = MultiMatcher(top_n, config, encryption_key, storage_path, cascade)
+
+
+def _call_shard(method: str, *args):
+    """Call a method of the shard matcher; queries on empty shards return None."""
+    if method in ("get", "get_many") and not len(_shard):
+        return None
+    return getattr(_shard, method)(*args)
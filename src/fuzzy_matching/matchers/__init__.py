@@ -1,14 +1,43 @@
-"""Module for matching algoritms."""
+"""Module for matching algoritms.
 
-from .distance import DistanceMatcher
-from .null import NullMatcher
-from .timedelta import TimedeltaMatcher
-from .vector import VectorMatcher
+Matchers are imported on first access, so their dependencies, such as scikit-learn
+for `VectorMatcher`, are only imported when a matcher is used.
+"""
 
+import importlib
+
+# Module defining each matcher.
+MODULES = {
+    "DistanceMatcher": ".distance",
+    "ExactMatcher": ".exact",
+    "MinHashMatcher": ".minhash",
+    "NullMatcher": ".null",
+    "PhoneticMatcher": ".phonetic",
+    "TimedeltaMatcher": ".timedelta",
+    "VectorMatcher": ".vector",
+}
 
 __all__ = [
     "DistanceMatcher",
+    "ExactMatcher",
+    "MinHashMatcher",
     "NullMatcher",
+    "PhoneticMatcher",
     "TimedeltaMatcher",
     "VectorMatcher",
 ]
+
+
+def __getattr__(name: str):
+    """Import a matcher on first access."""
+    if name not in MODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    matcher = getattr(importlib.import_module(MODULES[name], __name__), name)
+    globals()[name] = matcher
+    return matcher
+
+
+def __dir__() -> list[str]:
+    """List the matchers, including those not imported yet."""
+    return sorted(set(globals()) | set(__all__))
@@ -1,11 +1,24 @@
 """Module with base classes for matchering algoritms."""
 
-import re
 import string
 import unicodedata
 from pathlib import Path
 
-from fuzzy_matching.storage import EncryptedStore
+import numpy as np
+import pandas as pd
+
+from fuzzy_matching.metrics import measure
+from fuzzy_matching.storage import SEGMENT_ROWS, EncryptedStore
+
+# Version of the string preprocessing; stored with the preprocessed data.
+PREPROCESSING = 1
+
+# Translation table replacing punctuation and ASCII whitespace with spaces.
+WHITESPACE = "".join(char for char in map(chr, range(128)) if char.isspace())
+SPACES = str.maketrans(dict.fromkeys(string.punctuation + WHITESPACE, " "))
+
+# Separator for joining values; not changed by any preprocessing step.
+SEPARATOR = "\x00"
 
 
 class BaseMatcher:
@@ -18,11 +31,20 @@ class BaseMatcher:
     encryption_key : bytes
         Encryption key for storing data, provided as bytes.
     storage_path : pathlib.Path
-        Path to a file to store the data in.
+        Folder to store the data in.
     settings : dict, optional
-        Additional settings for the algoritm.
+        Additional settings for the algoritm. The `cost` setting overrides the
+        relative cost used to order fields in a cascade. Unweighted similarities
+        below `min_similarity` are set to zero.
     """
 
+    # Relative cost of scoring an entity and the range of unweighted similarities.
+    COST = 1
+    BOUNDS = (0.0, 1.0)
+
+    # Whether `matches` looks up the matches in an index, without scoring all.
+    INDEXED = False
+
     def __init__(
         self,
         field: str,
@@ -33,18 +55,219 @@ class BaseMatcher:
         self._field = field
         self._settings = settings or {}
         self._weight = settings.get("weight", 1.0)
+        self._min_similarity = self._settings.get("min_similarity")
 
         storage_path = storage_path / self._make_filename()
         self._storage = EncryptedStore(encryption_key, storage_path)
 
-    def _make_filename(self, extension="dat") -> str:
-        """Create a filename from a field name."""
+    def __len__(self) -> int:
+        """Return the number of stored entities without loading the data."""
+        return len(self._storage)
+
+    @property
+    def bounds(self) -> tuple[float, float]:
+        """Lowest and highest possible weighted similarity score."""
+        low, high = (bound * self._weight for bound in self.BOUNDS)
+        return min(low, high), max(low, high)
+
+    @property
+    def cost(self) -> float:
+        """Relative cost of scoring an entity."""
+        return self._settings.get("cost", self.COST)
+
+    @property
+    def indexed(self) -> bool:
+        """Whether matches are looked up in an index, without scoring all entities."""
+        return self.INDEXED
+
+    def create(self, data: pd.DataFrame) -> None:
+        """Add entities to the matching set.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            DataFrame with entities to add to the matching set.
+        """
+        self.append(self.prepare(data))
+
+    def prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Parse and preprocess entities before storing them.
+
+        Invalid values raise here, before anything is stored, so `MultiMatcher`
+        prepares all fields of a batch before appending any of them.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            DataFrame with entities to add to the matching set.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Prepared entities for `append`.
+        """
+        return data
+
+    def append(self, data: pd.DataFrame) -> None:
+        """Store prepared entities after the stored entities.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            Entities returned by `prepare`.
+        """
+        self._storage.append(data)
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored entities at and beyond a row position.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of entities to keep.
+        """
+        self._storage.truncate(n_rows)
+
+    def keep_rows(self, rows: np.ndarray, token: str) -> None:
+        """Remove all stored entities except those at the given row positions.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities to keep.
+        token : str
+            Identifies the rewrite; stores already rewritten with it are skipped.
+        """
+        self._storage.keep_rows(rows, token)
+
+    def matches(
+        self, target, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the entities with a nonzero similarity to the target.
+
+        Other entities have a similarity of zero, so scores can be summed over the
+        matches only. Matchers that select candidates override this to avoid
+        scoring all entities.
+
+        Parameters
+        ----------
+        target
+            Target value to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to consider; all by default.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Sorted row positions of the matches and their weighted similarity.
+        """
+        similarities = self.score(target, rows)
+        positions = np.flatnonzero(similarities)
+        matched = positions if rows is None else rows[positions]
+        return matched, similarities[positions]
+
+    def values(self, rows: np.ndarray) -> np.ndarray:
+        """Return the stored values for a set of rows.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Row positions of the entities.
+
+        Returns
+        -------
+        numpy.ndarray
+            Stored values in the order of `rows`.
+        """
+        return np.asarray(self._storage.load()[self._field].array[rows])
+
+    def normalize(self, value) -> str:
+        """Return a target value in the form used for scoring.
+
+        Targets with the same normalized values get the same scores.
+
+        Parameters
+        ----------
+        value
+            Target value.
+
+        Returns
+        -------
+        str
+            Normalized target value.
+        """
+        return str(value)
+
+    def preload(self) -> None:
+        """Load the stored data for the field ahead of the first query."""
+        self._storage.load()
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for the field.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        self._storage.compact(segment_rows)
+
+    def _cutoff(self, similarities: np.ndarray) -> np.ndarray:
+        """Set unweighted similarities below `min_similarity` to zero, in place."""
+        if self._min_similarity is not None:
+            similarities[similarities < self._min_similarity] = 0.0
+        return similarities
+
+    def _sparse_matches(
+        self, rows: np.ndarray, similarities: np.ndarray, selected: np.ndarray | None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the similarities of scored rows in the form of `matches`.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Unique row positions of the scored entities, in any order.
+        similarities : numpy.ndarray
+            Unweighted similarities of the entities; `min_similarity` is applied.
+        selected : numpy.ndarray or None
+            Sorted row positions of the entities to consider, or None for all.
+        """
+        order = np.argsort(rows, kind="stable")
+        rows, similarities = rows[order], self._cutoff(similarities[order])
+
+        keep = similarities != 0
+        if selected is not None:
+            keep &= np.isin(rows, selected, assume_unique=True)
+        return rows[keep], similarities[keep] * self._weight
+
+    def _sparse_many(
+        self, scored: list[tuple[np.ndarray, np.ndarray]], selected: np.ndarray
+    ) -> np.ndarray:
+        """Return the similarities of scored rows in the form of `get_many`.
+
+        Parameters
+        ----------
+        scored : list of tuple of numpy.ndarray
+            For each target, the unique row positions of the scored entities, in any
+            order, and their unweighted similarities.
+        selected : numpy.ndarray
+            Sorted row positions of the entities to score.
+        """
+        similarities = np.zeros((len(scored), len(selected)), dtype=np.float32)
+        for target, (rows, scores) in enumerate(scored):
+            rows, scores = self._sparse_matches(rows, scores, selected)
+            similarities[target, np.searchsorted(selected, rows)] = scores
+        return similarities
+
+    def _make_filename(self, extension: str | None = None) -> str:
+        """Create a file or folder name from a field name."""
         field = self._field.lower().strip().replace(" ", "_")
         field = "".join(
             [char for char in field if char in string.ascii_lowercase + "_-"]
         )
 
-        return f"{self.__class__.__name__.lower()}_{field}.{extension}"
+        filename = f"{self.__class__.__name__.lower()}_{field}"
+        return f"{filename}.{extension}" if extension else filename
 
 
 class StringMixin:
@@ -70,34 +293,66 @@ class StringMixin:
         str
             Preprocessed string value.
         """
-        functions = [
-            str.lower,
-            self._string_normalize,
-            self._strip_puntuation,
-            self._clean_whitespace,
-            str.strip,
-        ]
+        with measure("preprocess"):
+            value = value.lower()
+            if not value.isascii():
+                value = self._string_normalize(value)
 
-        for function in functions:
-            value = function(value)
+            return " ".join(value.translate(SPACES).split())
 
-        return value
+    def _preprocess_many(self, values: pd.Series) -> pd.Series:
+        """Preprocess a series of string values.
 
-    @staticmethod
-    def _clean_whitespace(value: str) -> str:
-        """Replace all whitespace with a single space.
+        Gives the same results as `_preprocess`, but each unique value is only
+        processed once and all steps run on a single joined string.
 
         Parameters
         ----------
-        values : str
-            String value to process.
+        values : pandas.Series
+            String values to preprocess.
 
         Returns
         -------
-        str
-            Processed string value.
+        pandas.Series
+            Preprocessed string values.
         """
-        return re.sub(r"\s+", " ", value)
+        codes, uniques = pd.factorize(values, use_na_sentinel=False)
+        joined = SEPARATOR.join(uniques)
+        if not len(uniques) or joined.count(SEPARATOR) != len(uniques) - 1:
+            return values.map(self._preprocess)
+
+        with measure("preprocess"):
+            joined = joined.lower()
+            if not joined.isascii():
+                joined = self._string_normalize(joined)
+
+            # After normalization, all whitespace is ASCII and replaced by spaces.
+            joined = joined.translate(SPACES)
+            while "  " in joined:
+                joined = joined.replace("  ", " ")
+
+            uniques = [value.strip(" ") for value in joined.split(SEPARATOR)]
+            uniques = np.array(uniques, dtype=object)
+            return pd.Series(uniques[codes], index=values.index, name=values.name)
+
+    def _store_preprocessed(self, data: pd.DataFrame) -> None:
+        """Store preprocessed data along with the preprocessing version.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            DataFrame with preprocessed values.
+        """
+        # Data stored before versioning used identical preprocessing.
+        version = self._storage.metadata.get("preprocessing", PREPROCESSING)
+        if version != PREPROCESSING and len(self._storage):
+            raise RuntimeError(
+                f"Stored data for {self._field} uses preprocessing version "
+                f"{version} instead of {PREPROCESSING}; the field needs to be "
+                "rebuilt."
+            )
+
+        self._storage.append(data, {"preprocessing": PREPROCESSING})
 
     @staticmethod
     def _string_normalize(value: str) -> str:
@@ -116,17 +371,27 @@ class StringMixin:
         return unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode()
 
     @staticmethod
-    def _strip_puntuation(value: str) -> str:
-        """Replace punctuation characters with whitespace."
+    def _qgrams(value: str, size: int) -> np.ndarray:
+        """Convert a preprocessed string to a set of integer q-gram keys.
+
+        The string is padded with a space on both sides, so the first and last
+        characters are part of the same number of q-grams as other characters.
 
         Parameters
         ----------
-        values : str
-            String value to process.
+        value : str
+            Preprocessed (ASCII) string value.
+        size : int
+            Number of characters per q-gram; at most 7 to fit in an int64.
 
         Returns
         -------
-        str
-            Processed string value.
+        numpy.ndarray
+            Unique q-gram keys.
         """
-        return "".join(c if c not in string.punctuation else " " for c in value)
+        value = f" {value} ".encode()
+        keys = {
+            int.from_bytes(value[start : start + size], "big")
+            for start in range(len(value) - size + 1)
+        }
+        return np.fromiter(keys, dtype=np.int64, count=len(keys))
@@ -1,13 +1,18 @@
 """Module for fuzzy matching using edit distances."""
 
+import math
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from rapidfuzz.distance.DamerauLevenshtein import normalized_similarity as damerau
 from rapidfuzz.distance.Levenshtein import normalized_similarity as levenshtein
 from rapidfuzz.distance.OSA import normalized_similarity as optimal_alignment
 from rapidfuzz.process import cdist
 
+from fuzzy_matching.metrics import measure
+from fuzzy_matching.storage import SEGMENT_ROWS, IndexStore
+
 from .bases import BaseMatcher, StringMixin
 
 
@@ -23,9 +28,16 @@ class DistanceMatcher(BaseMatcher, StringMixin):
     storage_path : pathlib.Path
         Path to a file to store the data in.
     settings : dict, optional
-        Additional settings for the algoritm.
+        Additional settings for the algoritm. Set `qgram_index` to True to build an
+        index of character q-grams and only compute distances for candidates that
+        share at least a `qgram_overlap` fraction (default 0.5) of the q-grams of
+        the target. Q-grams are `qgram_size` (default 3) characters long. Lower
+        overlaps favour recall, higher overlaps favour speed. Distances are computed
+        with `workers` threads (default -1, one per core). With `min_similarity`,
+        distances stop early once a value cannot reach the similarity.
     """
 
+    COST = 3
     ALGORITMS = {
         "levenshtein": levenshtein,
         "damerau": damerau,
@@ -41,52 +53,267 @@ class DistanceMatcher(BaseMatcher, StringMixin):
     ) -> None:
         super().__init__(field, encryption_key, storage_path, settings)
         self._algoritm = self.ALGORITMS[settings["algoritm"].lower()]
+        self._workers = self._settings.get("workers", -1)
+
+        # Optional q-gram index for selecting candidates.
+        self._index = None
+        if self._settings.get("qgram_index", False):
+            self._qgram_size = self._settings.get("qgram_size", 3)
+            self._qgram_overlap = self._settings.get("qgram_overlap", 0.5)
+            if not 1 <= self._qgram_size <= 7:
+                raise ValueError("Setting qgram_size should be between 1 and 7.")
+
+            index_path = storage_path / self._make_filename("qgrams")
+            self._index = IndexStore(encryption_key, index_path)
+
+    @property
+    def indexed(self) -> bool:
+        """Whether matches are looked up in an index; only with `qgram_index` set."""
+        return self._index is not None
+
+    def prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Preprocess entities for `append`; see `BaseMatcher.prepare`."""
+        return data.assign(**{self._field: self._preprocess_many(data[self._field])})
 
-    def create(self, data: pd.DataFrame) -> None:
-        """Add entities to the matching set.
+    def append(self, data: pd.DataFrame) -> None:
+        """Store prepared entities; see `BaseMatcher.append`."""
+        # Index before storing: stored rows missing from the index could never be
+        # matched. Q-grams left by an interrupted append would count for new rows.
+        if self._index is not None:
+            offset = len(self._storage)
+            self._index.truncate(offset)
+            if offset and not len(self._index):
+                existing = self._storage.load()
+                self._index_values(existing[self._field], 0)
+            self._index_values(data[self._field], offset)
+
+        self._store_preprocessed(data)
+
+    def score(self, target: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Return the weighted similarity of stored entities to the target.
 
         Parameters
         ----------
-        data : pandas.DataFrame
-            DataFrame with entities to add to the matching set.
+        target : str
+            Target string to match against.
+        rows : numpy.ndarray, optional
+            Row positions of the entities to score; scores all entities by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores in the order of `rows`.
         """
-        # Perform basic data preprocessing.
-        data = data.assign(**{self._field: data[self._field].map(self._preprocess)})
+        values = self._storage.load()[self._field].to_numpy()
+        target = self._preprocess(target)
+
+        candidates = self._candidates(target, len(values))
+        if rows is not None:
+            values = values[rows]
+        if candidates is None:
+            similarities = self._distances([target], values)
+            return similarities[0] * self._weight
+
+        # Only compute distances for candidates from the q-gram index.
+        if rows is not None:
+            candidates = np.flatnonzero(np.isin(rows, candidates))
 
-        existing = self._storage.load()
-        data = pd.concat([existing, data])
-        self._storage.store(data)
+        similarities = np.zeros(len(values), dtype=np.float32)
+        similarities[candidates] = self._distances([target], values[candidates])[0]
+        return similarities * self._weight
 
-    def get(self, target: str) -> pd.DataFrame:
-        """Return all entities and their similarity to the target.
+    def get_many(
+        self, targets: pd.Series, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the similarity of all entities to a batch of targets.
+
+        Parameters
+        ----------
+        targets : pandas.Series
+            Target strings to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to score; scores all entities by
+            default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores with one row per target and one column per
+            stored entity, or per entity in `rows`.
+        """
+        targets = self._preprocess_many(targets)
+        values = self._storage.load()[self._field].to_numpy()
+
+        candidates = [self._candidates(target, len(values)) for target in targets]
+        if self._index is None or any(found is None for found in candidates):
+            selected = values if rows is None else values[rows]
+            similarities = self._distances(targets, selected)
+            return similarities * self._weight
+
+        # Score all targets against the union of their candidates at once.
+        columns = np.arange(len(values)) if rows is None else rows
+        if rows is not None:
+            candidates = [found[np.isin(found, rows)] for found in candidates]
+        union = np.unique(np.concatenate([np.empty(0, dtype=np.int64), *candidates]))
+        scores = self._distances(targets, values[union])
+
+        similarities = np.zeros((len(targets), len(columns)), dtype=np.float32)
+        for target, found in enumerate(candidates):
+            positions = np.searchsorted(columns, found)
+            similarities[target, positions] = scores[
+                target, np.searchsorted(union, found)
+            ]
+        return similarities * self._weight
+
+    def matches(
+        self, target: str, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the entities with a nonzero similarity to the target.
 
         Parameters
         ----------
         target : str
             Target string to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to consider; all by default.
 
         Returns
         -------
-        pandas.DataFrame
-            DataFrame of entities and their similarity scores.
+        tuple of numpy.ndarray
+            Sorted row positions of the matches and their weighted similarity.
         """
-        data = self._storage.load()
-        if data is None:
-            return None
+        values = self._storage.load()[self._field].to_numpy()
+        value = self._preprocess(target)
+        candidates = self._candidates(value, len(values))
+        if candidates is None:
+            return super().matches(target, rows)
 
-        target = self._preprocess(target)
-        similarities = cdist(
-            [target],
-            data[self._field],
-            scorer=self._algoritm,
-            workers=-1,
-        )
+        # Only compute distances for candidates from the q-gram index.
+        if rows is not None:
+            candidates = candidates[np.isin(candidates, rows, assume_unique=True)]
+        similarities = self._distances([value], values[candidates])
+        return self._sparse_matches(candidates, similarities[0], None)
 
-        data = data.assign(
-            **{f"similarity_{self._field}": similarities[0] * self._weight}
-        )
-        return data.set_index("id")
+    def _distances(self, targets: list | pd.Series, values: np.ndarray) -> np.ndarray:
+        """Compute unweighted similarities between targets and stored values.
+
+        Parameters
+        ----------
+        targets : list or pandas.Series
+            Preprocessed target strings.
+        values : numpy.ndarray
+            Stored values.
+
+        Returns
+        -------
+        numpy.ndarray
+            Similarities with one row per target and one column per stored value.
+        """
+        with measure("distance"):
+            return cdist(
+                targets,
+                values,
+                scorer=self._algoritm,
+                score_cutoff=self._min_similarity,
+                dtype=np.float32,
+                workers=self._workers,
+            )
+
+    def normalize(self, value: str) -> str:
+        """Return a target value in the form used for scoring; see `BaseMatcher`."""
+        return self._preprocess(value)
+
+    def preload(self) -> None:
+        """Load the stored data for the field ahead of the first query."""
+        self._storage.load()
+        if self._index is not None:
+            self._index.preload()
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for the field.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        self._storage.compact(segment_rows)
+        if self._index is not None:
+            self._index.compact(segment_rows)
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored entities at and beyond a row position.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of entities to keep.
+        """
+        self._storage.truncate(n_rows)
+        if self._index is not None:
+            self._index.truncate(n_rows)
+
+    def keep_rows(self, rows: np.ndarray, token: str) -> None:
+        """Remove all stored entities except those at the given row positions.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities to keep.
+        token : str
+            Identifies the rewrite; stores already rewritten with it are skipped.
+        """
+        self._storage.keep_rows(rows, token)
+        if self._index is not None:
+            self._index.keep_rows(rows, token, {"rows": len(rows)})
 
     def delete(self) -> None:
         """Delete all matching data for the field."""
         self._storage.delete()
+        if self._index is not None:
+            self._index.delete()
+
+    def _index_values(self, values: pd.Series, offset: int) -> None:
+        """Add the q-grams of preprocessed values to the index.
+
+        Parameters
+        ----------
+        values : pandas.Series
+            Preprocessed values to index.
+        offset : int
+            Row position of the first value in the stored data.
+        """
+        keys = [self._qgrams(value, self._qgram_size) for value in values]
+        rows = np.repeat(
+            np.arange(offset, offset + len(keys), dtype=np.int64),
+            [len(key) for key in keys],
+        )
+        keys = np.concatenate([np.empty(0, dtype=np.int64), *keys])
+        self._index.append(
+            pd.DataFrame({"key": keys, "row": rows}), {"rows": offset + len(values)}
+        )
+
+    def _candidates(self, target: str, n_rows: int) -> np.ndarray | None:
+        """Select candidate rows sharing enough q-grams with the target.
+
+        Parameters
+        ----------
+        target : str
+            Preprocessed target string.
+        n_rows : int
+            Number of stored rows.
+
+        Returns
+        -------
+        numpy.ndarray or None
+            Sorted candidate row positions or None if there is no index.
+        """
+        if self._index is None or self._index.load() is None:
+            return None
+
+        keys = self._qgrams(target, self._qgram_size)
+        rows, counts = np.unique(self._index.lookup(keys), return_counts=True)
+
+        threshold = max(1, math.ceil(self._qgram_overlap * len(keys)))
+        rows = rows[counts >= threshold]
+        return rows[rows < n_rows]
@@ -0,0 +1,225 @@
+"""Module for exact matching on keyed tokens of values."""
+
+import hmac
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fuzzy_matching.storage import SEGMENT_ROWS, IndexStore
+
+from .bases import BaseMatcher, StringMixin
+
+
+class ExactMatcher(BaseMatcher, StringMixin):
+    """Exact matching on keyed tokens of values, for example identifiers.
+
+    Values are preprocessed as for the other string matchers and replaced by an
+    HMAC token, keyed with a key derived from the encryption key. An encrypted
+    index maps the tokens to rows, so an equality lookup only needs a binary search
+    and never compares plaintext values. Entities with the same value as the target
+    get a similarity of one, all other entities zero.
+
+    With the `short_circuit` setting, `MultiMatcher` only scores the other fields
+    for the exact hits of a target, if it has any. With the `blocking` setting, it
+    only scores the exact hits.
+
+    Parameters
+    ----------
+    field : str
+        Name of the field used in matching.
+    encryption_key : bytes
+        Encryption key for storing data, provided as bytes.
+    storage_path : pathlib.Path
+        Folder to store the data in.
+    settings : dict, optional
+        Additional settings for the algoritm.
+    """
+
+    COST = 1
+    INDEXED = True
+
+    def __init__(
+        self,
+        field: str,
+        encryption_key: bytes,
+        storage_path: Path,
+        settings: dict = None,
+    ) -> None:
+        super().__init__(field, encryption_key, storage_path, settings)
+
+        # Tokens differ between fields with the same values.
+        self._hmac_key = hmac.digest(
+            encryption_key, f"exact {field}".encode(), "sha256"
+        )
+
+        index_path = storage_path / self._make_filename("tokens")
+        self._index = IndexStore(encryption_key, index_path)
+
+    def prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Preprocess entities for `append`; see `BaseMatcher.prepare`."""
+        # Identifiers may be numbers.
+        values = self._preprocess_many(data[self._field].astype(str))
+        return data.assign(**{self._field: values})
+
+    def append(self, data: pd.DataFrame) -> None:
+        """Store prepared entities; see `BaseMatcher.append`."""
+        # Index before storing, so a crash cannot leave rows without index entries.
+        # Entries left by an interrupted append would point at the new rows.
+        values = data[self._field]
+        offset = len(self._storage)
+        self._index.truncate(offset)
+        rows = np.arange(offset, offset + len(values), dtype=np.int64)
+        self._index.append(
+            pd.DataFrame({"key": self._tokens(values), "row": rows}),
+            {"rows": offset + len(values)},
+        )
+        self._store_preprocessed(data)
+
+    def score(self, target: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Return the weighted similarity of stored entities to the target.
+
+        Parameters
+        ----------
+        target : str
+            Target string to match against.
+        rows : numpy.ndarray, optional
+            Row positions of the entities to score; scores all entities by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores in the order of `rows`.
+        """
+        similarities = np.zeros(len(self._storage.load()), dtype=np.float32)
+        similarities[self.candidates(target)] = 1.0
+        if rows is not None:
+            similarities = similarities[rows]
+        return similarities * self._weight
+
+    def get_many(
+        self, targets: pd.Series, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the similarity of all entities to a batch of targets.
+
+        Parameters
+        ----------
+        targets : pandas.Series
+            Target strings to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to score; scores all entities by
+            default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores with one row per target and one column per
+            stored entity, or per entity in `rows`.
+        """
+        n_rows = len(self._storage.load())
+        values = self._preprocess_many(targets.astype(str))
+        hits = [self._lookup(token, n_rows) for token in self._tokens(values)]
+        if rows is not None:
+            scored = [(found, np.ones(len(found), dtype=np.float32)) for found in hits]
+            return self._sparse_many(scored, rows)
+
+        similarities = np.zeros((len(targets), n_rows), dtype=np.float32)
+        for target, target_hits in enumerate(hits):
+            similarities[target, target_hits] = 1.0
+        return similarities * self._weight
+
+    def matches(
+        self, target: str, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the exact hits of the target; see `BaseMatcher.matches`."""
+        hits = self.candidates(target)
+        return self._sparse_matches(hits, np.ones(len(hits), dtype=np.float32), rows)
+
+    def candidates(self, target: str) -> np.ndarray:
+        """Return the rows with the same value as the target.
+
+        Parameters
+        ----------
+        target : str
+            Target string to match against.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted row positions of the exact hits.
+        """
+        token = self._tokens(pd.Series([self.normalize(target)]))[0]
+        return self._lookup(token, len(self._storage.load()))
+
+    def normalize(self, value: str) -> str:
+        """Return a target value in the form used for scoring; see `BaseMatcher`."""
+        return self._preprocess(str(value))
+
+    def preload(self) -> None:
+        """Load the stored data for the field ahead of the first query."""
+        super().preload()
+        self._index.preload()
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for the field.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        super().compact(segment_rows)
+        self._index.compact(segment_rows)
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored entities at and beyond a row position.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of entities to keep.
+        """
+        self._storage.truncate(n_rows)
+        self._index.truncate(n_rows)
+
+    def keep_rows(self, rows: np.ndarray, token: str) -> None:
+        """Remove all stored entities except those at the given row positions.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities to keep.
+        token : str
+            Identifies the rewrite; stores already rewritten with it are skipped.
+        """
+        self._storage.keep_rows(rows, token)
+        self._index.keep_rows(rows, token, {"rows": len(rows)})
+
+    def delete(self) -> None:
+        """Delete all matching data for the field."""
+        self._storage.delete()
+        self._index.delete()
+
+    def _lookup(self, token: int, n_rows: int) -> np.ndarray:
+        """Return the sorted rows having a token, ignoring rows not stored yet."""
+        rows = np.unique(self._index.lookup(np.array([token], dtype=np.int64)))
+        return rows[rows < n_rows]
+
+    def _tokens(self, values: pd.Series) -> np.ndarray:
+        """Compute 64 bit HMAC-SHA256 tokens of preprocessed values.
+
+        Parameters
+        ----------
+        values : pandas.Series
+            Preprocessed values.
+
+        Returns
+        -------
+        numpy.ndarray
+            Tokens as signed 64 bit integers.
+        """
+        digests = b"".join(
+            hmac.digest(self._hmac_key, value.encode("utf8"), "sha256")[:8]
+            for value in values
+        )
+        return np.frombuffer(digests, dtype=">i8").astype(np.int64)
@@ -0,0 +1,310 @@
+"""Module for approximate fuzzy matching using MinHash locality sensitive hashing."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fuzzy_matching.storage import SEGMENT_ROWS, IndexStore
+
+from .vector import VectorMatcher
+
+# Mersenne prime for the universal hash functions.
+PRIME = np.uint64(2**31 - 1)
+SEED = 42
+CHUNK_SIZE = 10_000
+
+
+class MinHashMatcher(VectorMatcher):
+    """Approximate fuzzy matching using MinHash locality sensitive hashing.
+
+    Values are encoded as MinHash signatures over their character q-grams. The
+    signatures are split into bands, and an encrypted index maps each band to the
+    rows sharing it. A query only scores rows colliding with the target in at least
+    one band, using the exact cosine similarity between vectors. Rows that do not
+    collide get a similarity of zero.
+
+    Parameters
+    ----------
+    field : str
+        Name of the field used in matching.
+    encryption_key : bytes
+        Encryption key for storing data, provided as bytes.
+    storage_path : pathlib.Path
+        Folder to store the data in.
+    settings : dict, optional
+        Additional settings for the algoritm. The signature consists of
+        `minhash_bands` (default 20) bands of `minhash_rows` (default 3) values
+        each, computed over q-grams of `qgram_size` (default 3) characters. More
+        bands or fewer rows per band favour recall, the reverse favours speed.
+    """
+
+    COST = 1
+    INDEXED = True
+
+    def __init__(
+        self,
+        field: str,
+        encryption_key: bytes,
+        storage_path: Path,
+        settings: dict = None,
+    ):
+        super().__init__(field, encryption_key, storage_path, settings)
+
+        self._bands = self._settings.get("minhash_bands", 20)
+        self._rows = self._settings.get("minhash_rows", 3)
+        self._qgram_size = self._settings.get("qgram_size", 3)
+        if not 1 <= self._bands <= 127:
+            raise ValueError("Setting minhash_bands should be between 1 and 127.")
+        if not 1 <= self._qgram_size <= 7:
+            raise ValueError("Setting qgram_size should be between 1 and 7.")
+
+        # Parameters for the universal hash functions (a * x + b) mod prime.
+        rng = np.random.default_rng(SEED)
+        n_hashes = self._bands * self._rows
+        self._hash_a = rng.integers(1, PRIME, n_hashes, dtype=np.uint64)[:, np.newaxis]
+        self._hash_b = rng.integers(0, PRIME, n_hashes, dtype=np.uint64)[:, np.newaxis]
+
+        index_path = storage_path / self._make_filename("lsh")
+        self._index = IndexStore(encryption_key, index_path)
+
+    def append(self, data: pd.DataFrame) -> None:
+        """Store prepared entities; see `BaseMatcher.append`."""
+        # Index before storing, so a crash cannot leave rows without index entries.
+        # Band keys left by an interrupted append would count for new rows.
+        offset = len(self._storage)
+        self._index.truncate(offset)
+        if offset and not len(self._index):
+            existing = self._storage.load()
+            self._index_values(existing[self._field], 0)
+        self._index_values(data[self._field], offset)
+
+        super().append(data)
+
+    def score(self, target: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Return the weighted similarity of stored entities to the target.
+
+        Parameters
+        ----------
+        target : str
+            Target string to match against.
+        rows : numpy.ndarray, optional
+            Row positions of the entities to score; scores all entities by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores in the order of `rows`.
+        """
+        target = self._preprocess(target)
+        vectors = self._vector_storage.load()
+        candidates = self._candidates(target, vectors.shape[0])
+
+        if rows is not None:
+            vectors = vectors[rows]
+            candidates = np.flatnonzero(np.isin(rows, candidates))
+
+        # Compute exact similarities for colliding rows only.
+        similarities = np.zeros(vectors.shape[0], dtype=np.float32)
+        if len(candidates):
+            target_vector = self._vectorizer.transform([target])
+            similarities[candidates] = self._similarities(
+                target_vector, vectors[candidates]
+            )[0]
+        return self._cutoff(similarities) * self._weight
+
+    def get_many(
+        self, targets: pd.Series, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the similarity of all entities to a batch of targets.
+
+        Parameters
+        ----------
+        targets : pandas.Series
+            Target strings to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to score; scores all entities by
+            default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores with one row per target and one column per
+            stored entity, or per entity in `rows`.
+        """
+        vectors = self._vector_storage.load()
+        targets = self._preprocess_many(targets)
+        candidates = [self._candidates(target, vectors.shape[0]) for target in targets]
+        columns = np.arange(vectors.shape[0]) if rows is None else rows
+        if rows is not None:
+            candidates = [found[np.isin(found, rows)] for found in candidates]
+
+        # Score all targets against the union of their candidates at once.
+        similarities = np.zeros((len(targets), len(columns)), dtype=np.float32)
+        union = np.unique(np.concatenate([np.empty(0, dtype=np.int64), *candidates]))
+        if not len(union):
+            return similarities
+
+        target_vectors = self._vectorizer.transform(targets)
+        scores = self._similarities(target_vectors, vectors[union])
+        for target, found in enumerate(candidates):
+            positions = np.searchsorted(columns, found)
+            similarities[target, positions] = scores[
+                target, np.searchsorted(union, found)
+            ]
+        return self._cutoff(similarities) * self._weight
+
+    def matches(
+        self, target: str, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the colliding entities with a nonzero similarity to the target.
+
+        Parameters
+        ----------
+        target : str
+            Target string to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to consider; all by default.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Sorted row positions of the matches and their weighted similarity.
+        """
+        target = self._preprocess(target)
+        vectors = self._vector_storage.load()
+        candidates = self._candidates(target, vectors.shape[0])
+        if rows is not None:
+            candidates = candidates[np.isin(candidates, rows, assume_unique=True)]
+
+        similarities = np.empty(0, dtype=np.float32)
+        if len(candidates):
+            target_vector = self._vectorizer.transform([target])
+            similarities = self._similarities(target_vector, vectors[candidates])[0]
+        return self._sparse_matches(candidates, similarities, None)
+
+    def preload(self) -> None:
+        """Load the stored data for the field ahead of the first query."""
+        super().preload()
+        self._index.preload()
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for the field.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        super().compact(segment_rows)
+        self._index.compact(segment_rows)
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored entities at and beyond a row position.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of entities to keep.
+        """
+        super().truncate(n_rows)
+        self._index.truncate(n_rows)
+
+    def keep_rows(self, rows: np.ndarray, token: str) -> None:
+        """Remove all stored entities except those at the given row positions.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities to keep.
+        token : str
+            Identifies the rewrite; stores already rewritten with it are skipped.
+        """
+        super().keep_rows(rows, token)
+        self._index.keep_rows(rows, token, {"rows": len(rows)})
+
+    def delete(self) -> None:
+        """Delete all matching data for the field."""
+        super().delete()
+        self._index.delete()
+
+    def _index_values(self, values: pd.Series, offset: int) -> None:
+        """Add the LSH band keys of preprocessed values to the index.
+
+        Parameters
+        ----------
+        values : pandas.Series
+            Preprocessed values to index.
+        offset : int
+            Row position of the first value in the stored data.
+        """
+        # Compute keys in chunks to limit the size of the hash matrices.
+        keys = [
+            self._band_keys(values.iloc[start : start + CHUNK_SIZE])
+            for start in range(0, len(values), CHUNK_SIZE)
+        ]
+        if not keys:
+            return
+
+        keys = np.concatenate(keys)
+        rows = np.arange(offset, offset + len(keys), dtype=np.int64)
+        self._index.append(
+            pd.DataFrame({"key": keys.ravel(), "row": np.repeat(rows, self._bands)}),
+            {"rows": offset + len(keys)},
+        )
+
+    def _candidates(self, target: str, n_rows: int) -> np.ndarray:
+        """Select rows colliding with the target in at least one band.
+
+        Parameters
+        ----------
+        target : str
+            Preprocessed target string.
+        n_rows : int
+            Number of stored rows.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted candidate row positions.
+        """
+        keys = self._band_keys(pd.Series([target]))[0]
+        rows = np.unique(self._index.lookup(keys))
+        return rows[rows < n_rows]
+
+    def _band_keys(self, values: pd.Series) -> np.ndarray:
+        """Compute LSH band keys for preprocessed values.
+
+        Parameters
+        ----------
+        values : pandas.Series
+            Preprocessed values.
+
+        Returns
+        -------
+        numpy.ndarray
+            Band keys with one row per value and one column per band. The band
+            number is stored in the top bits, so keys of different bands differ.
+        """
+        qgrams = [self._qgrams(value, self._qgram_size) for value in values]
+        lengths = np.array([len(keys) for keys in qgrams])
+
+        # Values without q-grams get the maximum value for all hash functions.
+        signatures = np.full((len(qgrams), len(self._hash_a)), PRIME, dtype=np.uint64)
+        filled = lengths > 0
+        if filled.any():
+            qgrams = np.concatenate(qgrams).astype(np.uint64) % PRIME
+            hashes = (self._hash_a * qgrams + self._hash_b) % PRIME
+            starts = np.concatenate([[0], np.cumsum(lengths[filled])[:-1]])
+            signatures[filled] = np.minimum.reduceat(hashes, starts, axis=1).T
+
+        # Combine the values in each band into a single 56 bit key.
+        signatures = signatures.reshape(len(signatures), self._bands, self._rows)
+        keys = np.zeros(signatures.shape[:2], dtype=np.uint64)
+        with np.errstate(over="ignore"):
+            for row in range(self._rows):
+                keys = keys * np.uint64(1_000_003) + signatures[:, :, row]
+
+        keys &= np.uint64(2**56 - 1)
+        keys |= np.arange(self._bands, dtype=np.uint64) << np.uint64(56)
+        return keys.astype(np.int64)
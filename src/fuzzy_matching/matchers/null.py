@@ -1,5 +1,6 @@
 """Module for fields not used in matching."""
 
+import numpy as np
 import pandas as pd
 
 from .bases import BaseMatcher
@@ -8,32 +9,49 @@ from .bases import BaseMatcher
 class NullMatcher(BaseMatcher):
     """Module for fields not used in matching."""
 
-    def create(self, data: pd.DataFrame) -> None:
-        """Add entities to the matching set.
+    COST = 0
+    BOUNDS = (0.0, 0.0)
+
+    def normalize(self, _: str) -> str:
+        """Return an empty string; target values are not used in scoring."""
+        return ""
+
+    def score(self, _: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Return the weighted similarity of stored entities to the target.
 
         Parameters
         ----------
-        data : pandas.DataFrame
-            DataFrame with entities to add to the matching set.
+        rows : numpy.ndarray, optional
+            Row positions of the entities to score; scores all entities by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Zero similarity scores in the order of `rows`.
         """
-        existing = self._storage.load()
-        data = pd.concat([existing, data])
-        self._storage.store(data)
+        if rows is None:
+            return np.zeros(len(self._storage.load()), dtype=np.float32)
+        return np.zeros(len(rows), dtype=np.float32)
+
+    def matches(
+        self, _: str, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return no entities; all similarities are zero."""
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
 
-    def get(self, _: str) -> pd.DataFrame:
-        """Return all entities and their similarity to the target.
+    def get_many(
+        self, targets: pd.Series, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the similarity of all entities to a batch of targets.
 
         Returns
         -------
-        pandas.DataFrame
-            DataFrame of entities and their similarity scores.
+        numpy.ndarray
+            Zero similarity scores with one row per target and one column per
+            stored entity, or per entity in `rows`.
         """
-        data = self._storage.load()
-        if data is None:
-            return None
-
-        data = data.assign(**{f"similarity_{self._field}": 0})
-        return data.set_index("id")
+        n_rows = len(self._storage.load()) if rows is None else len(rows)
+        return np.zeros((len(targets), n_rows), dtype=np.float32)
 
     def delete(self) -> None:
         """Delete all matching data for the field."""
@@ -0,0 +1,319 @@
+"""Module for fuzzy matching on how words sound, using Soundex codes."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fuzzy_matching.storage import SEGMENT_ROWS, IndexStore
+
+from .bases import BaseMatcher, StringMixin
+
+# Soundex digits for consonants; vowels separate repeated digits, "h" and "w" do not.
+SOUNDEX = {
+    **dict.fromkeys("bfpv", "1"),
+    **dict.fromkeys("cgjkqsxz", "2"),
+    **dict.fromkeys("dt", "3"),
+    "l": "4",
+    **dict.fromkeys("mn", "5"),
+    "r": "6",
+}
+
+
+class PhoneticMatcher(BaseMatcher, StringMixin):
+    """Fuzzy matching on how words sound, using Soundex codes.
+
+    Each word of a value is encoded with its Soundex code, so spelling variants
+    that sound alike, such as "Jansen" and "Janssen", get the same code. An
+    encrypted index maps each code to the rows having it. The similarity is the
+    fraction of shared codes among all codes of the target and an entity; a query
+    only touches the rows sharing at least one code with the target.
+
+    With the `blocking` setting, `MultiMatcher` only scores the other fields for
+    entities sharing a code with the target.
+
+    Parameters
+    ----------
+    field : str
+        Name of the field used in matching.
+    encryption_key : bytes
+        Encryption key for storing data, provided as bytes.
+    storage_path : pathlib.Path
+        Folder to store the data in.
+    settings : dict, optional
+        Additional settings for the algoritm.
+    """
+
+    COST = 1
+    INDEXED = True
+
+    def __init__(
+        self,
+        field: str,
+        encryption_key: bytes,
+        storage_path: Path,
+        settings: dict = None,
+    ) -> None:
+        super().__init__(field, encryption_key, storage_path, settings)
+
+        index_path = storage_path / self._make_filename("soundex")
+        self._index = IndexStore(encryption_key, index_path)
+        self._counts = (None, None)
+
+    def prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Preprocess entities for `append`; see `BaseMatcher.prepare`."""
+        return data.assign(**{self._field: self._preprocess_many(data[self._field])})
+
+    def append(self, data: pd.DataFrame) -> None:
+        """Store prepared entities; see `BaseMatcher.append`."""
+        # Index before storing, so a crash cannot leave rows without index entries.
+        # Codes left by an interrupted append would be counted for the new rows.
+        offset = len(self._storage)
+        self._index.truncate(offset)
+        self._index_values(data[self._field], offset)
+        self._store_preprocessed(data)
+
+    def score(self, target: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Return the weighted similarity of stored entities to the target.
+
+        Parameters
+        ----------
+        target : str
+            Target string to match against.
+        rows : numpy.ndarray, optional
+            Row positions of the entities to score; scores all entities by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores in the order of `rows`.
+        """
+        n_rows = len(self._storage.load())
+        similarities = self._similarities(self._codes(self._preprocess(target)), n_rows)
+        if rows is not None:
+            similarities = similarities[rows]
+        return similarities * self._weight
+
+    def get_many(
+        self, targets: pd.Series, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the similarity of all entities to a batch of targets.
+
+        Parameters
+        ----------
+        targets : pandas.Series
+            Target strings to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to score; scores all entities by
+            default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores with one row per target and one column per
+            stored entity, or per entity in `rows`.
+        """
+        n_rows = len(self._storage.load())
+        if rows is not None:
+            values = self._preprocess_many(targets)
+            scored = [self._shared(self._codes(value), n_rows) for value in values]
+            return self._sparse_many(scored, rows)
+
+        similarities = np.zeros((len(targets), n_rows), dtype=np.float32)
+        for target, value in enumerate(self._preprocess_many(targets)):
+            similarities[target] = self._similarities(self._codes(value), n_rows)
+        return similarities * self._weight
+
+    def matches(
+        self, target: str, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the entities sharing a target code; see `BaseMatcher.matches`."""
+        n_rows = len(self._storage.load())
+        codes = self._codes(self._preprocess(target))
+        matched, similarities = self._shared(codes, n_rows)
+        return self._sparse_matches(matched, similarities, rows)
+
+    def candidates(self, target: str) -> np.ndarray:
+        """Return the rows sharing at least one code with the target.
+
+        Parameters
+        ----------
+        target : str
+            Target string to match against.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted candidate row positions.
+        """
+        n_rows = len(self._storage.load())
+        rows = np.unique(self._index.lookup(self._codes(self._preprocess(target))))
+        return rows[rows < n_rows]
+
+    def normalize(self, value: str) -> str:
+        """Return a target value in the form used for scoring; see `BaseMatcher`."""
+        return " ".join(map(str, self._codes(self._preprocess(value))))
+
+    def preload(self) -> None:
+        """Load the stored data for the field ahead of the first query."""
+        super().preload()
+        self._index.preload()
+        self._code_counts(len(self._storage.load()))
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for the field.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        super().compact(segment_rows)
+        self._index.compact(segment_rows)
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored entities at and beyond a row position.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of entities to keep.
+        """
+        self._storage.truncate(n_rows)
+        self._index.truncate(n_rows)
+
+    def keep_rows(self, rows: np.ndarray, token: str) -> None:
+        """Remove all stored entities except those at the given row positions.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities to keep.
+        token : str
+            Identifies the rewrite; stores already rewritten with it are skipped.
+        """
+        self._storage.keep_rows(rows, token)
+        self._index.keep_rows(rows, token, {"rows": len(rows)})
+
+    def delete(self) -> None:
+        """Delete all matching data for the field."""
+        self._storage.delete()
+        self._index.delete()
+        self._counts = (None, None)
+
+    def _index_values(self, values: pd.Series, offset: int) -> None:
+        """Add the codes of preprocessed values to the index.
+
+        Parameters
+        ----------
+        values : pandas.Series
+            Preprocessed values to index.
+        offset : int
+            Row position of the first value in the stored data.
+        """
+        # Encode each unique value once.
+        positions, uniques = pd.factorize(values, use_na_sentinel=False)
+        codes = [self._codes(value) for value in uniques]
+        codes = [codes[position] for position in positions]
+
+        rows = np.repeat(
+            np.arange(offset, offset + len(codes), dtype=np.int64),
+            [len(code) for code in codes],
+        )
+        keys = np.concatenate([np.empty(0, dtype=np.int64), *codes])
+        self._index.append(
+            pd.DataFrame({"key": keys, "row": rows}), {"rows": offset + len(codes)}
+        )
+
+    def _similarities(self, codes: np.ndarray, n_rows: int) -> np.ndarray:
+        """Compute unweighted similarities between target codes and all entities.
+
+        Parameters
+        ----------
+        codes : numpy.ndarray
+            Unique codes of the target.
+        n_rows : int
+            Number of stored rows.
+
+        Returns
+        -------
+        numpy.ndarray
+            Number of shared codes divided by the number of distinct codes of the
+            target and the entity together.
+        """
+        similarities = np.zeros(n_rows, dtype=np.float32)
+        rows, shared = self._shared(codes, n_rows)
+        similarities[rows] = self._cutoff(shared)
+        return similarities
+
+    def _shared(self, codes: np.ndarray, n_rows: int) -> tuple[np.ndarray, np.ndarray]:
+        """Compute unweighted similarities for the entities sharing a target code.
+
+        Parameters
+        ----------
+        codes : numpy.ndarray
+            Unique codes of the target.
+        n_rows : int
+            Number of stored rows.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Sorted row positions of the entities and their similarity.
+        """
+        rows, shared = np.unique(self._index.lookup(codes), return_counts=True)
+        shared, rows = shared[rows < n_rows], rows[rows < n_rows]
+        if not len(rows):
+            return rows, np.empty(0, dtype=np.float32)
+
+        total = len(codes) + self._code_counts(n_rows)[rows] - shared
+        return rows, (shared / total).astype(np.float32)
+
+    def _code_counts(self, n_rows: int) -> np.ndarray:
+        """Return the number of codes per stored row; recounted after changes."""
+        key = (self._index.generation, n_rows)
+        cached_key, counts = self._counts
+        if cached_key != key:
+            index = self._index.load()
+            rows = np.empty(0, dtype=np.int64) if index is None else index["row"]
+            counts = np.bincount(rows, minlength=n_rows)[:n_rows]
+            self._counts = (key, counts)
+        return counts
+
+    @staticmethod
+    def _codes(value: str) -> np.ndarray:
+        """Encode the words of a preprocessed string as integer Soundex codes.
+
+        Soundex keeps the first letter of a word, followed by the digits of the
+        next consonants, skipping repeated digits, up to three digits. The letter
+        and digits are combined into one integer: "jansen", coded J525, is 9525.
+
+        Parameters
+        ----------
+        value : str
+            Preprocessed (ASCII) string value.
+
+        Returns
+        -------
+        numpy.ndarray
+            Unique codes of the words; words without letters are skipped.
+        """
+        codes = set()
+        for word in value.split():
+            letters = [char for char in word if "a" <= char <= "z"]
+            if not letters:
+                continue
+
+            digits = []
+            previous = SOUNDEX.get(letters[0], "")
+            for char in letters[1:]:
+                if char in "hw":
+                    continue
+                digit = SOUNDEX.get(char, "")
+                if digit and digit != previous:
+                    digits.append(digit)
+                previous = digit
+
+            number = int("".join(digits[:3]).ljust(3, "0"))
+            codes.add((ord(letters[0]) - ord("a")) * 1000 + number)
+        return np.fromiter(codes, dtype=np.int64, count=len(codes))
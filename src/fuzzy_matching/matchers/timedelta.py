@@ -1,15 +1,28 @@
 """Module for matching time differences."""
 
+import math
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+from fuzzy_matching.storage import SEGMENT_ROWS, IndexStore
+
 from .bases import BaseMatcher
 
+# Nanoseconds per day and the integer representation of missing dates.
+DAY = 86_400 * 10**9
+NAT = np.iinfo(np.int64).min
+
 
 class TimedeltaMatcher(BaseMatcher):
     """Class for matching time differences.
 
+    Dates are indexed as a sorted array of epoch timestamps with their row
+    positions, so a query only scores the entities within a window around the
+    target. The similarity halves every `decay_days` days of difference, which
+    keeps scores independent of the other stored dates.
+
     Parameters
     ----------
     field : str
@@ -19,7 +32,12 @@ class TimedeltaMatcher(BaseMatcher):
     storage_path : pathlib.Path
         Path to a file to store the data in.
     settings : dict, optional
-        Additional settings for the algoritm.
+        Additional settings for the algoritm. Dates are parsed with `date_format`
+        (default "%d-%m-%Y"). The similarity halves every `decay_days` (default 365)
+        days. Only entities within `window_days` (default 10 times `decay_days`)
+        of the target are scored, and of those only the `neighbors` nearest when
+        set. All other entities get a similarity of zero. With `min_similarity`,
+        the window shrinks to the dates that can reach the similarity.
     """
 
     def __init__(
@@ -30,51 +48,239 @@ class TimedeltaMatcher(BaseMatcher):
         settings: dict = None,
     ):
         super().__init__(field, encryption_key, storage_path, settings)
-        self._format = settings.get("date_format", "%d-%m-%Y")
+        self._format = self._settings.get("date_format", "%d-%m-%Y")
 
-    def create(self, data) -> None:
-        """Add entities to the matching set.
+        decay_days = self._settings.get("decay_days", 365)
+        window_days = self._settings.get("window_days", 10 * decay_days)
+        self._neighbors = self._settings.get("neighbors")
+        if decay_days <= 0:
+            raise ValueError("Setting decay_days should be positive.")
+        if window_days < 0:
+            raise ValueError("Setting window_days should not be negative.")
+        if self._neighbors is not None and self._neighbors < 1:
+            raise ValueError("Setting neighbors should be at least 1.")
 
-        Parameters
-        ----------
-        data : pandas.DataFrame
-            DataFrame with entities to add to the matching set.
-        """
-        data = data.assign(
+        self._decay = decay_days * DAY
+        self._window = int(window_days * DAY)
+
+        # Dates further away than the half-lives to the cutoff cannot reach it.
+        if self._min_similarity is not None and 0 < self._min_similarity <= 1:
+            cutoff = math.ceil(-math.log2(self._min_similarity) * self._decay)
+            self._window = min(self._window, cutoff)
+
+        index_path = storage_path / self._make_filename("sorted")
+        self._index = IndexStore(encryption_key, index_path)
+
+    def prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Parse the dates for `append`; see `BaseMatcher.prepare`."""
+        return data.assign(
             **{self._field: pd.to_datetime(data[self._field], format=self._format)}
         )
 
-        existing = self._storage.load()
-        data = pd.concat([existing, data])
-        self._storage.store(data)
+    def append(self, data: pd.DataFrame) -> None:
+        """Store prepared entities; see `BaseMatcher.append`."""
+        # Index before storing: stored rows missing from the index could never be
+        # matched. Dates left by an interrupted append would score the new rows.
+        offset = len(self._storage)
+        self._index.truncate(offset)
+        if offset and not len(self._index):
+            existing = self._storage.load()
+            self._index_values(existing[self._field], 0)
+        self._index_values(data[self._field], offset)
 
-    def get(self, target: str) -> pd.DataFrame:
-        """Return all entities and their similarity to the target.
+        self._storage.append(data)
+
+    def score(self, target: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Return the weighted similarity of stored entities to the target.
 
         Parameters
         ----------
         target : str
-            Target string to match against.
+            Target date to match against.
+        rows : numpy.ndarray, optional
+            Row positions of the entities to score; scores all entities by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores in the order of `rows`.
+        """
+        target = self._to_epoch(pd.Series([target]))[0]
+
+        similarities = np.zeros(len(self._storage.load()), dtype=np.float32)
+        window, scores = self._nearest(target, len(similarities))
+        similarities[window] = scores
+        if rows is not None:
+            similarities = similarities[rows]
+        return similarities * self._weight
+
+    @property
+    def indexed(self) -> bool:
+        """Whether matches are looked up in an index; only with `neighbors` set."""
+        return self._neighbors is not None
+
+    def get_many(
+        self, targets: pd.Series, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the similarity of all entities to a batch of targets.
+
+        Parameters
+        ----------
+        targets : pandas.Series
+            Target strings to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to score; scores all entities by
+            default.
 
         Returns
         -------
-        pandas.DataFrame
-            DataFrame of entities and their similarity scores.
+        numpy.ndarray
+            Weighted similarity scores with one row per target and one column per
+            stored entity, or per entity in `rows`.
         """
-        data = self._storage.load()
-        if data is None:
-            return None
+        targets = self._to_epoch(targets)
+        if rows is not None and self._neighbors is None:
+            # Score the selected dates directly, rather than looking up each window.
+            dates = self._storage.load()[self._field].to_numpy(dtype="datetime64[ns]")
+            keys = dates.view(np.int64)[rows]
+            deltas = np.abs(keys - targets[:, np.newaxis])
+            inside = (keys != NAT) & (targets != NAT)[:, np.newaxis]
+            inside &= deltas <= self._window
+            similarities = np.exp2(-deltas / self._decay).astype(np.float32)
+            similarities[~inside] = 0.0
+            return self._cutoff(similarities) * self._weight
+        if rows is not None:
+            n_rows = len(self._storage.load())
+            scored = [self._nearest(target, n_rows) for target in targets]
+            return self._sparse_many(scored, rows)
+
+        n_rows = len(self._storage.load())
+        similarities = np.zeros((len(targets), n_rows), dtype=np.float32)
+        for position, target in enumerate(targets):
+            window, scores = self._nearest(target, similarities.shape[1])
+            similarities[position, window] = scores
+        return similarities * self._weight
 
-        target = pd.to_datetime(target, format=self._format)
+    def matches(
+        self, target: str, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the entities near the target date; see `BaseMatcher.matches`."""
+        target = self._to_epoch(pd.Series([target]))[0]
+        window, similarities = self._nearest(target, len(self._storage.load()))
+        return self._sparse_matches(window, similarities, rows)
 
-        # Compute absolute time differences and normalize.
-        deltas = (data[self._field] - target).abs()
-        deltas = (deltas.max() - deltas) / deltas.max()
+    def normalize(self, value: str) -> str:
+        """Return a target value in the form used for scoring; see `BaseMatcher`."""
+        return str(pd.to_datetime(value, format=self._format))
 
-        data = data.assign(**{f"similarity_{self._field}": deltas * self._weight})
-        return data.set_index("id")
+    def preload(self) -> None:
+        """Load the stored data for the field ahead of the first query."""
+        self._storage.load()
+        self._index.preload()
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for the field.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        self._storage.compact(segment_rows)
+        self._index.compact(segment_rows)
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored entities at and beyond a row position.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of entities to keep.
+        """
+        self._storage.truncate(n_rows)
+        self._index.truncate(n_rows)
+
+    def keep_rows(self, rows: np.ndarray, token: str) -> None:
+        """Remove all stored entities except those at the given row positions.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities to keep.
+        token : str
+            Identifies the rewrite; stores already rewritten with it are skipped.
+        """
+        self._storage.keep_rows(rows, token)
+        self._index.keep_rows(rows, token, {"rows": len(rows)})
 
     def delete(self) -> None:
         """Delete all matching data for the field."""
-        self._vector_store.delete()
         self._storage.delete()
+        self._index.delete()
+
+    def _to_epoch(self, values: pd.Series) -> np.ndarray:
+        """Convert dates to nanoseconds since the epoch; missing dates become NAT."""
+        values = pd.to_datetime(values, format=self._format)
+        return values.to_numpy(dtype="datetime64[ns]").view(np.int64)
+
+    def _index_values(self, values: pd.Series, offset: int) -> None:
+        """Add dates to the sorted index.
+
+        Parameters
+        ----------
+        values : pandas.Series
+            Parsed dates to index.
+        offset : int
+            Row position of the first value in the stored data.
+        """
+        keys = values.to_numpy(dtype="datetime64[ns]").view(np.int64)
+        rows = np.arange(offset, offset + len(keys), dtype=np.int64)
+        metadata = {"rows": offset + len(keys)}
+
+        # Missing dates are never matched. Sorted segments make the sort after
+        # loading a cheap merge of sorted runs.
+        valid = keys != NAT
+        keys, rows = keys[valid], rows[valid]
+        order = np.argsort(keys, kind="stable")
+        self._index.append(
+            pd.DataFrame({"key": keys[order], "row": rows[order]}), metadata
+        )
+
+    def _nearest(self, target: int, n_rows: int) -> tuple[np.ndarray, np.ndarray]:
+        """Select and score the entities near a target date.
+
+        Parameters
+        ----------
+        target : int
+            Target date in nanoseconds since the epoch.
+        n_rows : int
+            Number of stored rows.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Row positions of the selected entities and their unweighted similarity.
+        """
+        if target == NAT:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        keys, rows = self._index.between(target - self._window, target + self._window)
+        if self._neighbors is not None:
+            # The nearest dates are at most `neighbors` positions from the target.
+            position = np.searchsorted(keys, target)
+            start = max(0, position - self._neighbors)
+            keys = keys[start : position + self._neighbors]
+            rows = rows[start : position + self._neighbors]
+
+        keep = rows < n_rows
+        deltas = np.abs(keys[keep] - target)
+        rows = rows[keep]
+        if self._neighbors is not None:
+            nearest = np.argsort(deltas, kind="stable")[: self._neighbors]
+            deltas, rows = deltas[nearest], rows[nearest]
+
+        similarities = np.exp2(-deltas / self._decay).astype(np.float32)
+        if self._min_similarity is not None:
+            keep = similarities >= self._min_similarity
+            rows, similarities = rows[keep], similarities[keep]
+        return rows, similarities
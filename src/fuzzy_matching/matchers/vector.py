@@ -2,11 +2,13 @@
 
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+from scipy import sparse
 from sklearn.feature_extraction.text import HashingVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
 
-from fuzzy_matching.storage import VectorStore
+from fuzzy_matching.metrics import measure
+from fuzzy_matching.storage import SEGMENT_ROWS, VectorStore
 
 from .bases import BaseMatcher, StringMixin
 
@@ -23,9 +25,15 @@ class VectorMatcher(BaseMatcher, StringMixin):
     storage_path : pathlib.Path
         Path to a file to store the data in.
     settings : dict, optional
-        Additional settings for the algoritm.
+        Additional settings for the algoritm. Set `mmap_path` to a folder on a
+        memory backed file system, like `/dev/shm/fuzzy_matching`, to share the
+        decrypted vectors between processes through memory mapping.
     """
 
+    # Hashed vectors use alternating signs, so similarities can be negative.
+    COST = 2
+    BOUNDS = (-1.0, 1.0)
+
     def __init__(
         self,
         field: str,
@@ -35,8 +43,10 @@ class VectorMatcher(BaseMatcher, StringMixin):
     ):
         super().__init__(field, encryption_key, storage_path, settings)
 
-        storage_path = storage_path / self._make_filename("npz")
-        self._vector_storage = VectorStore(storage_path)
+        storage_path = storage_path / self._make_filename("vectors")
+        self._vector_storage = VectorStore(
+            encryption_key, storage_path, self._settings.get("mmap_path")
+        )
 
         self._vectorizer = HashingVectorizer(
             encoding="utf8",
@@ -45,53 +55,181 @@ class VectorMatcher(BaseMatcher, StringMixin):
             analyzer="char_wb",
         )
 
-    def create(self, data: pd.DataFrame) -> None:
-        """Add entities to the matching set.
+    def prepare(self, data: pd.DataFrame) -> pd.DataFrame:
+        """Preprocess entities for `append`; see `BaseMatcher.prepare`."""
+        return data.assign(**{self._field: self._preprocess_many(data[self._field])})
+
+    def append(self, data: pd.DataFrame) -> None:
+        """Store prepared entities; see `BaseMatcher.append`."""
+        # Vectors share the row order of the stored values; vectors stored without
+        # their values by an interrupted append are rolled back.
+        self._vector_storage.truncate(len(self._storage))
+        if len(self._vector_storage) != len(self._storage):
+            raise RuntimeError(
+                f"Stored vectors for {self._field} do not match the stored values; "
+                "the field needs to be rebuilt."
+            )
+
+        # The vectorizer is stateless, so only the new values need vectorizing.
+        self._vector_storage.append(self._vectorizer.transform(data[self._field]))
+        self._store_preprocessed(data)
+
+    def score(self, target: str, rows: np.ndarray | None = None) -> np.ndarray:
+        """Return the weighted similarity of stored entities to the target.
 
         Parameters
         ----------
-        data : pandas.DataFrame
-            DataFrame with entities to add to the matching set.
+        target : str
+            Target string to match against.
+        rows : numpy.ndarray, optional
+            Row positions of the entities to score; scores all entities by default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores in the order of `rows`.
         """
-        # Perform basic data preprocessing.
-        data = data.assign(**{self._field: data[self._field].map(self._preprocess)})
+        target = self._preprocess(target)
 
-        # Store values with UUIDs and name.
-        existing = self._storage.load()
-        data = pd.concat([existing, data])
-        self._storage.store(data)
+        # Compute vector similarities.
+        target_vector = self._vectorizer.transform([target])
+        vectors = self._vector_storage.load()
+        if rows is not None:
+            vectors = vectors[rows]
 
-        # Convert to vectors and store.
-        vectors = self._vectorizer.fit_transform(data[self._field])
-        self._vector_storage.store(vectors)
+        similarities = self._similarities(target_vector, vectors)[0]
+        return self._cutoff(similarities) * self._weight
 
-    def get(self, target: str) -> pd.DataFrame:
-        """Return all entities and their similarity to the target.
+    def get_many(
+        self, targets: pd.Series, rows: np.ndarray | None = None
+    ) -> np.ndarray:
+        """Return the similarity of all entities to a batch of targets.
+
+        Parameters
+        ----------
+        targets : pandas.Series
+            Target strings to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to score; scores all entities by
+            default.
+
+        Returns
+        -------
+        numpy.ndarray
+            Weighted similarity scores with one row per target and one column per
+            stored entity, or per entity in `rows`.
+        """
+        vectors = self._vector_storage.load()
+        if rows is not None:
+            vectors = vectors[rows]
+
+        # Vectorize all targets at once; one sparse product scores the batch.
+        target_vectors = self._vectorizer.transform(self._preprocess_many(targets))
+        similarities = self._similarities(target_vectors, vectors)
+        return self._cutoff(similarities) * self._weight
+
+    def matches(
+        self, target: str, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the entities with a nonzero similarity to the target.
+
+        Only entities sharing a feature with the target have a nonzero product, so
+        the sparse product is used as is, without expanding it to all entities.
 
         Parameters
         ----------
         target : str
             Target string to match against.
+        rows : numpy.ndarray, optional
+            Sorted row positions of the entities to consider; all by default.
 
         Returns
         -------
-        pandas.DataFrame
-            DataFrame of entities and their similarity scores.
+        tuple of numpy.ndarray
+            Sorted row positions of the matches and their weighted similarity.
         """
-        # Load the encrypted values.
-        data = self._storage.load()
-        if data is None:
-            return None
+        target_vector = self._vectorizer.transform([self._preprocess(target)])
+        vectors = self._vector_storage.load()
+        if rows is not None:
+            vectors = vectors[rows]
+
+        with measure("similarity"):
+            product = (target_vector @ vectors.T).tocsr()
+            matched = product.indices.astype(np.int64)
+            if rows is not None:
+                matched = rows[matched]
+            similarities = product.data.astype(np.float32)
+        return self._sparse_matches(matched, similarities, None)
+
+    @staticmethod
+    def _similarities(
+        target_vectors: sparse.csr_matrix, vectors: sparse.csr_matrix
+    ) -> np.ndarray:
+        """Compute cosine similarities between target and stored vectors.
+
+        The vectorizer normalizes vectors to unit length, so the dot product
+        equals the cosine similarity. Unlike `cosine_similarity`, this does not
+        copy the stored vectors to normalize them.
 
-        target = self._preprocess(target)
+        Parameters
+        ----------
+        target_vectors : scipy.sparse.csr_matrix
+            Vectors of the targets.
+        vectors : scipy.sparse.csr_matrix
+            Stored vectors.
 
-        # Compute vector similarities.
-        target_vector = self._vectorizer.fit_transform([target])
-        vectors = self._vector_storage.load()
-        similarities = cosine_similarity(target_vector, vectors)[0]
+        Returns
+        -------
+        numpy.ndarray
+            Similarities with one row per target and one column per stored vector.
+        """
+        with measure("similarity"):
+            similarities = target_vectors @ vectors.T
+            return similarities.toarray().astype(np.float32)
+
+    def normalize(self, value: str) -> str:
+        """Return a target value in the form used for scoring; see `BaseMatcher`."""
+        return self._preprocess(value)
+
+    def preload(self) -> None:
+        """Load the stored data for the field ahead of the first query."""
+        self._storage.load()
+        self._vector_storage.load()
+
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge small storage segments for the field.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        self._storage.compact(segment_rows)
+        self._vector_storage.compact(segment_rows)
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored entities at and beyond a row position.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of entities to keep.
+        """
+        self._storage.truncate(n_rows)
+        self._vector_storage.truncate(n_rows)
+
+    def keep_rows(self, rows: np.ndarray, token: str) -> None:
+        """Remove all stored entities except those at the given row positions.
 
-        data = data.assign(**{f"similarity_{self._field}": similarities * self._weight})
-        return data.set_index("id")
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the entities to keep.
+        token : str
+            Identifies the rewrite; stores already rewritten with it are skipped.
+        """
+        self._storage.keep_rows(rows, token)
+        self._vector_storage.keep_rows(rows, token)
 
     def delete(self) -> None:
         """Delete all matching data for the field."""
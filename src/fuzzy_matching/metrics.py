@@ -0,0 +1,195 @@
+"""Module for collecting timing and memory metrics of matching operations.
+
+Pass a collector to `MultiMatcher` to record the wall time of every stage of an
+operation, per field: loading and decrypting stores, preprocessing, computing
+similarities and aggregating the results. Without a collector, the measuring points
+do nothing.
+"""
+
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import pandas as pd
+
+# Collector and field of the operation running in the current context.
+_active = ContextVar("fuzzy_matching_metrics", default=None)
+
+
+class MetricsCollector:
+    """Base class for metrics collectors; records nothing.
+
+    Subclass and override `record` and `record_memory` to forward metrics to a
+    monitoring system.
+
+    Parameters
+    ----------
+    trace_memory : bool, default=False
+        Trace peak memory use of operations with `tracemalloc`; this slows down
+        allocations considerably while tracing.
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        self.trace_memory = trace_memory
+
+    def record(
+        self, field: str | None, stage: str, seconds: float, nbytes: int = 0
+    ) -> None:
+        """Record the duration of a stage.
+
+        Parameters
+        ----------
+        field : str or None
+            Field the stage belongs to or None for stages of the whole operation.
+        stage : str
+            Name of the stage, for example "decrypt" or "score".
+        seconds : float
+            Wall time of the stage in seconds.
+        nbytes : int, default=0
+            Number of bytes processed, for example decrypted, in the stage.
+        """
+
+    def record_memory(self, operation: str, peak: int) -> None:
+        """Record the peak memory use of an operation.
+
+        Parameters
+        ----------
+        operation : str
+            Name of the operation, for example "get".
+        peak : int
+            Peak traced memory in bytes during the operation.
+        """
+
+
+class Metrics(MetricsCollector):
+    """Collector keeping totals per field and stage in memory.
+
+    Parameters
+    ----------
+    trace_memory : bool, default=False
+        Trace peak memory use of operations with `tracemalloc`; this slows down
+        allocations considerably while tracing.
+    """
+
+    def __init__(self, trace_memory: bool = False) -> None:
+        super().__init__(trace_memory)
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._memory = {}
+
+    def record(
+        self, field: str | None, stage: str, seconds: float, nbytes: int = 0
+    ) -> None:
+        """Add the duration of a stage to the totals; see `MetricsCollector`."""
+        with self._lock:
+            calls, total, total_bytes = self._stages.get((field, stage), (0, 0.0, 0))
+            self._stages[field, stage] = (
+                calls + 1,
+                total + seconds,
+                total_bytes + nbytes,
+            )
+
+    def record_memory(self, operation: str, peak: int) -> None:
+        """Keep the highest peak memory per operation; see `MetricsCollector`."""
+        with self._lock:
+            self._memory[operation] = max(peak, self._memory.get(operation, 0))
+
+    def summary(self) -> pd.DataFrame:
+        """Return the collected metrics.
+
+        Returns
+        -------
+        pandas.DataFrame
+            Number of calls, total seconds and total bytes per field and stage.
+            Operations have an empty field and, when traced, their peak memory.
+        """
+        with self._lock:
+            stages = dict(self._stages)
+            memory = dict(self._memory)
+
+        rows = [
+            {
+                "field": field or "",
+                "stage": stage,
+                "calls": calls,
+                "seconds": seconds,
+                "bytes": nbytes,
+                "peak_memory": memory.get(stage) if field is None else None,
+            }
+            for (field, stage), (calls, seconds, nbytes) in stages.items()
+        ]
+        columns = ["field", "stage", "calls", "seconds", "bytes", "peak_memory"]
+        summary = pd.DataFrame(rows, columns=columns).set_index(["field", "stage"])
+        return summary.sort_index(level="field", sort_remaining=False)
+
+    def reset(self) -> None:
+        """Discard all collected metrics."""
+        with self._lock:
+            self._stages.clear()
+            self._memory.clear()
+
+
+@contextmanager
+def collect(collector: MetricsCollector | None, operation: str):
+    """Collect metrics for an operation and all stages measured within it.
+
+    Parameters
+    ----------
+    collector : MetricsCollector or None
+        Collector to record to; does nothing if None.
+    operation : str
+        Name of the operation, for example "get".
+    """
+    if collector is None:
+        yield
+        return
+
+    # Leave tracing on if it was started by someone else.
+    started = collector.trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    elif collector.trace_memory:
+        tracemalloc.reset_peak()
+
+    token = _active.set((collector, None))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.record(None, operation, time.perf_counter() - start)
+        _active.reset(token)
+        if collector.trace_memory:
+            collector.record_memory(operation, tracemalloc.get_traced_memory()[1])
+        if started:
+            tracemalloc.stop()
+
+
+@contextmanager
+def measure(stage: str, field: str | None = None, nbytes: int = 0):
+    """Measure a stage of the operation being collected, if any.
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage.
+    field : str, optional
+        Field the stage belongs to; stages measured within inherit the field.
+    nbytes : int, default=0
+        Number of bytes processed in the stage.
+    """
+    active = _active.get()
+    if active is None:
+        yield
+        return
+
+    collector, current = active
+    field = field or current
+    token = _active.set((collector, field))
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.record(field, stage, time.perf_counter() - start, nbytes)
+        _active.reset(token)
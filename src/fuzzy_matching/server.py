@@ -0,0 +1,477 @@
+"""Module for serving matches from a long-running local process.
+
+The server loads all field stores once and keeps them in memory. Concurrent requests
+arriving within a short window are scored together in a single batch, or one by one
+with `MultiMatcher.get` to use its cascade mode, result cache and `min_score`. It
+speaks a minimal subset of HTTP/1.1 over TCP or a Unix socket:
+
+- `GET /health` returns the number of stored records.
+- `POST /match` takes a JSON target of field : value pairs and returns the same
+  matches as `MultiMatcher.get`. An optional `min_score` query parameter sets the
+  minimum total similarity, as in `POST /match?min_score=2.5`.
+
+Start the server with `python -m fuzzy_matching.server`; the encryption key is read
+as a hex string from the `FUZZY_MATCHING_KEY` environment variable.
+"""
+
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import pandas as pd
+
+from fuzzy_matching.match_multi import MultiMatcher
+
+# Largest accepted request body in bytes.
+MAX_BODY = 1_000_000
+
+# Errors raised by the matchers for invalid target values.
+MATCH_ERRORS = (KeyError, RuntimeError, TypeError, ValueError)
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Content Too Large",
+    500: "Internal Server Error",
+}
+
+
+class MatchServer:
+    """Serve matches for a MultiMatcher with request micro-batching.
+
+    Batches are scored with `MultiMatcher.get_many`, which scores all records for
+    every target in the batch: each field holds a dense matrix of `max_batch` by the
+    number of records. Requests with a `min_score`, and all requests if `batch` is
+    False, are matched one by one with `MultiMatcher.get` instead, which uses the
+    cascade mode and result cache of the matcher and only aggregates the records
+    matching the target on some field when `min_score` is above zero.
+
+    Parameters
+    ----------
+    matcher : MultiMatcher
+        Matcher to serve queries from.
+    max_batch : int, default=64
+        Maximum number of requests scored in one batch.
+    max_delay : float, default=0.005
+        Seconds to wait for more requests after the first request of a batch.
+    batch : bool, default=True
+        Score requests without a `min_score` together with `get_many`. Disable it
+        for matchers in cascade mode or with a result cache.
+    """
+
+    def __init__(
+        self,
+        matcher: MultiMatcher,
+        max_batch: int = 64,
+        max_delay: float = 0.005,
+        batch: bool = True,
+    ) -> None:
+        self._matcher = matcher
+        self._max_batch = max_batch
+        self._max_delay = max_delay
+        self._batch = batch
+
+        # Batches are scored one at a time, off the event loop.
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._batcher = None
+
+    async def start(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        socket_path: str | None = None,
+    ) -> asyncio.Server:
+        """Load all stores and start accepting connections.
+
+        Parameters
+        ----------
+        host : str, default="127.0.0.1"
+            Host to listen on; ignored when `socket_path` is set.
+        port : int, default=8765
+            Port to listen on; ignored when `socket_path` is set.
+        socket_path : str, optional
+            Path of a Unix socket to listen on instead of a TCP port.
+
+        Returns
+        -------
+        asyncio.Server
+            The started server.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._matcher.preload)
+
+        self._queue = asyncio.Queue()
+        self._batcher = asyncio.create_task(self._batch_loop())
+        if socket_path is None:
+            return await asyncio.start_server(self._handle, host, port)
+
+        # Only the owner may connect; responses contain plaintext values.
+        server = await asyncio.start_unix_server(self._handle, socket_path)
+        os.chmod(socket_path, 0o600)
+        return server
+
+    async def serve(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        socket_path: str | None = None,
+    ) -> None:
+        """Serve matches until cancelled; see `start` for the parameters."""
+        server = await self.start(host, port, socket_path)
+        async with server:
+            await server.serve_forever()
+
+    async def match(self, target: dict, min_score: float | None = None) -> bytes:
+        """Queue a target for the next batch and wait for its JSON encoded matches.
+
+        Parameters
+        ----------
+        target : dict
+            Search query as dict of field : value pairs.
+        min_score : float, optional
+            Only return records with at least this total similarity.
+
+        Returns
+        -------
+        bytes
+            JSON object with the matches as a list of records under `results`.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put(((target, min_score), future))
+        return await future
+
+    async def close(self) -> None:
+        """Stop batching and release the scoring thread."""
+        if self._batcher is not None:
+            self._batcher.cancel()
+            try:
+                await self._batcher
+            except asyncio.CancelledError:
+                pass
+        self._executor.shutdown()
+
+    async def _batch_loop(self) -> None:
+        """Collect queued requests into batches and score them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._max_delay
+            while len(batch) < self._max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            requests = [request for request, _ in batch]
+            try:
+                results = await loop.run_in_executor(
+                    self._executor, self._score, requests
+                )
+            except Exception as error:
+                # Fail this batch only; the loop keeps serving later requests.
+                results = [error] * len(batch)
+            for (_, future), result in zip(batch, results):
+                if future.cancelled():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _score(self, requests: list[tuple]) -> list[bytes | Exception]:
+        """Score a batch of requests, isolating targets that fail.
+
+        Parameters
+        ----------
+        requests : list of tuple
+            Search queries as dicts of field : value pairs, each with its minimum
+            total similarity or None.
+
+        Returns
+        -------
+        list
+            JSON encoded matches or the raised exception for every request.
+        """
+        results = [None] * len(requests)
+        batched = []
+        for position, (target, min_score) in enumerate(requests):
+            if self._batch and min_score is None:
+                batched.append(position)
+                continue
+            try:
+                matches = self._matcher.get(target, min_score)
+            except Exception as error:
+                results[position] = error
+            else:
+                results[position] = self._encode(matches.reset_index())
+
+        targets = [requests[position][0] for position in batched]
+        for position, result in zip(batched, self._score_many(targets)):
+            results[position] = result
+        return results
+
+    def _score_many(self, targets: list[dict]) -> list[bytes | Exception]:
+        """Score targets together with `get_many`, isolating targets that fail."""
+        if not targets:
+            return []
+        try:
+            matches = self._matcher.get_many(pd.DataFrame(targets))
+        except Exception as error:
+            if len(targets) == 1:
+                return [error]
+            # Score the targets one by one, so one bad target fails alone.
+            return [
+                result for target in targets for result in self._score_many([target])
+            ]
+
+        columns = matches.columns.drop("target")
+        return [
+            self._encode(matches.loc[matches["target"] == position, columns])
+            for position in range(len(targets))
+        ]
+
+    @staticmethod
+    def _encode(matches: pd.DataFrame) -> bytes:
+        """Encode matches with an `id` column as a JSON response."""
+        records = matches.to_json(
+            orient="records", date_format="iso", double_precision=15
+        )
+        return b'{"results": ' + records.encode() + b"}"
+
+    async def _handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Serve HTTP requests on a connection until it is closed."""
+        try:
+            while True:
+                request = await reader.readline()
+                if not request.strip():
+                    break
+
+                method, path, _ = request.decode("latin-1").split(" ", 2)
+                headers = {}
+                while (line := await reader.readline()).strip():
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    self._respond(writer, 413, {"error": "Request body too large."})
+                    break
+
+                body = await reader.readexactly(length)
+                status, payload = await self._dispatch(method, path, body)
+                self._respond(writer, status, payload)
+                await writer.drain()
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(
+        self, method: str, path: str, body: bytes
+    ) -> tuple[int, dict | bytes]:
+        """Route a request and return the status code and response payload."""
+        url = urlsplit(path)
+        if method == "GET" and url.path == "/health":
+            return 200, {"status": "ok", "records": len(self._matcher)}
+        if method != "POST" or url.path != "/match":
+            return 404, {"error": f"Unknown endpoint: {method} {url.path}."}
+
+        min_score = parse_qs(url.query).get("min_score")
+        if min_score is not None:
+            try:
+                min_score = float(min_score[-1])
+            except ValueError:
+                return 400, {"error": "The min_score should be a number."}
+
+        try:
+            target = json.loads(body)
+        except ValueError:
+            return 400, {"error": "Request body is not valid JSON."}
+        if not isinstance(target, dict):
+            return 400, {"error": "Target should be a JSON object."}
+
+        missing = set(self._matcher.fields) - set(target)
+        if missing:
+            return 400, {"error": "Missing fields in the target: " + ", ".join(missing)}
+
+        invalid = [
+            field
+            for field in self._matcher.fields
+            if not isinstance(target[field], str)
+        ]
+        if invalid:
+            return 400, {
+                "error": "Target values should be strings: " + ", ".join(invalid)
+            }
+
+        try:
+            return 200, await self.match(target, min_score)
+        except MATCH_ERRORS as error:
+            return 400, {"error": str(error)}
+        except Exception as error:
+            return 500, {"error": f"Matching failed: {error!r}"}
+
+    @staticmethod
+    def _respond(
+        writer: asyncio.StreamWriter, status: int, payload: dict | bytes
+    ) -> None:
+        """Write an HTTP response with a JSON payload."""
+        if isinstance(payload, dict):
+            payload = json.dumps(payload).encode()
+
+        head = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + payload)
+
+
+class MatchClient:
+    """Client for a local MatchServer.
+
+    Parameters
+    ----------
+    host : str, default="127.0.0.1"
+        Host the server listens on.
+    port : int, default=8765
+        Port the server listens on.
+    socket_path : str, optional
+        Path of the Unix socket the server listens on, instead of a TCP port.
+    timeout : float, default=60.0
+        Seconds to wait for a response.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8765,
+        socket_path: str | None = None,
+        timeout: float = 60.0,
+    ) -> None:
+        if socket_path is None:
+            self._connection = http.client.HTTPConnection(host, port, timeout=timeout)
+        else:
+            self._connection = _UnixConnection(socket_path, timeout)
+
+    def get(self, target: dict, min_score: float | None = None) -> pd.DataFrame:
+        """Match a target; returns the same matches as `MultiMatcher.get`.
+
+        Parameters
+        ----------
+        target : dict
+            Search query as dict of field : value pairs.
+        min_score : float, optional
+            Only return records with at least this total similarity.
+        """
+        path = "/match"
+        if min_score is not None:
+            path += "?" + urlencode({"min_score": repr(float(min_score))})
+        records = self._request("POST", path, target)["results"]
+        results = pd.DataFrame.from_records(records)
+        return results.set_index("id") if len(results) else results
+
+    def health(self) -> dict:
+        """Return the status of the server."""
+        return self._request("GET", "/health")
+
+    def close(self) -> None:
+        """Close the connection to the server."""
+        self._connection.close()
+
+    def _request(self, method: str, path: str, payload: dict | None = None) -> dict:
+        """Send a request and decode the JSON response."""
+        body = None if payload is None else json.dumps(payload).encode()
+        headers = {"Content-Type": "application/json"}
+        self._connection.request(method, path, body=body, headers=headers)
+
+        response = self._connection.getresponse()
+        content = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError(f"Match server error: {content.get('error')}")
+        return content
+
+
+class _UnixConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket."""
+
+    def __init__(self, socket_path: str, timeout: float) -> None:
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = socket_path
+
+    def connect(self) -> None:
+        """Connect to the Unix socket."""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+def main() -> None:
+    """Start a match server from the command line."""
+    parser = argparse.ArgumentParser(description="Serve fuzzy matches locally.")
+    parser.add_argument("config", help="JSON file with the field configuration.")
+    parser.add_argument("--storage", default="storage", help="Storage folder.")
+    parser.add_argument("--top-n", type=int, default=10, help="Results per query.")
+    parser.add_argument(
+        "--cascade",
+        action="store_true",
+        help="Use cascade mode; requests are then matched one by one.",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=0,
+        help="Results to cache; requests are then matched one by one.",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Host to listen on.")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on.")
+    parser.add_argument("--socket", help="Unix socket to listen on instead.")
+    parser.add_argument("--max-batch", type=int, default=64, help="Batch size.")
+    parser.add_argument(
+        "--max-delay", type=float, default=0.005, help="Batch window in seconds."
+    )
+    args = parser.parse_args()
+
+    key = os.environ.get("FUZZY_MATCHING_KEY")
+    if key is None:
+        raise RuntimeError("Set the encryption key in FUZZY_MATCHING_KEY as hex.")
+
+    with open(args.config, encoding="utf-8") as config_file:
+        config = json.load(config_file)
+
+    matcher = MultiMatcher(
+        args.top_n,
+        config,
+        bytes.fromhex(key),
+        args.storage,
+        cascade=args.cascade,
+        cache_size=args.cache_size,
+    )
+    # Batches score all records exhaustively, bypassing the cascade and the cache.
+    batch = not (args.cascade or args.cache_size)
+    server = MatchServer(matcher, args.max_batch, args.max_delay, batch)
+
+    address = args.socket or f"{args.host}:{args.port}"
+    print(f"Serving matches on {address}...")
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.socket))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
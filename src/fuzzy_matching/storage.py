@@ -1,128 +1,1144 @@
 """Module for encrypted storage of pandas data structures."""
 
+import hashlib
 import io
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import uuid
+from collections.abc import Iterable
 from pathlib import Path
+from typing import TYPE_CHECKING, BinaryIO
 
+import numpy as np
 import pandas as pd
-from scipy import sparse
+from pandas.api.extensions import (
+    ExtensionArray,
+    ExtensionDtype,
+    no_default,
+    register_extension_dtype,
+    take,
+)
+from pandas.api.indexers import check_array_indexer
 
 from fuzzy_matching.encryption import AESGCM4Encryptor
+from fuzzy_matching.metrics import measure
 
+# SciPy is imported by vector stores on first use, as only vector fields need it.
+if TYPE_CHECKING:
+    from scipy import sparse
 
-class EncryptedStore:
-    """Class for encrypted storage of pandas data structures.
+MANIFEST = "manifest.json"
+SEGMENT_ROWS = 1_000_000
+
+# Marks segments in the columnar format.
+COLUMNAR = b"FMCOLv1\x00"
+ALIGNMENT = 64
+
+# Separator used to split many UTF-8 strings with a single decode.
+SEPARATOR = "\x00"
+
+
+def _write_atomic(path: Path, content: bytes | Iterable[bytes]) -> None:
+    """Write a file atomically by writing a temporary file and renaming it.
+
+    The content can be given in parts, which are written as they are produced.
+    """
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "wb") as file:
+        if isinstance(content, (bytes, bytearray, memoryview)):
+            content = [content]
+        file.writelines(content)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def _read_legacy(encryption_key: bytes, path: Path) -> pd.Series | pd.DataFrame:
+    """Read a file stored by `EncryptedStore` before data was stored in segments.
+
+    These files hold a pickled pandas data structure, encrypted as a single message
+    with `AESGCM4Encryptor.encrypt`.
 
     Parameters
     ----------
     encryption_key : bytes
-        Encryption key for storing data, provided as bytes.
-    storage_path : str, default="storage"
-        Folder to store data in.
+        Encryption key the file was stored with.
+    path : pathlib.Path
+        Path of the file.
+
+    Returns
+    -------
+    pandas.Series or pandas.DataFrame
+        The decrypted data structure.
     """
+    raw_data = AESGCM4Encryptor(encryption_key).decrypt(path.read_bytes())
+    return pd.read_pickle(io.BytesIO(raw_data))
 
-    def __init__(self, encryption_key: bytes, storage_path: Path) -> None:
+
+class SegmentStore:
+    """Base class for append-only storage in segments.
+
+    Data is stored in a folder as a series of segments, one for each call to
+    `append`, and a manifest listing the segments in order. Loading the store
+    concatenates all segments into one data structure. Subclasses define how
+    segments are encoded and concatenated.
+
+    Parameters
+    ----------
+    storage_path : pathlib.Path
+        Folder to store the segments in.
+    """
+
+    def __init__(self, storage_path: Path) -> None:
         self._data = None
         self._storage_path = storage_path
-        self._encryptor = AESGCM4Encryptor(encryption_key)
 
-    def store(self, data: pd.Series | pd.DataFrame) -> None:
-        """Encrypt and store a pandas data structure.
+        # Data appended after loading, concatenated on the next load.
+        self._pending = []
+        self._lock = threading.RLock()
+
+        # Counts changes to the data made through this object.
+        self.generation = 0
+
+    def __len__(self) -> int:
+        """Return the number of stored rows without loading the data."""
+        return sum(segment["rows"] for segment in self._read_manifest()["segments"])
+
+    @property
+    def metadata(self) -> dict:
+        """Metadata describing the stored data, such as format versions."""
+        return self._read_manifest().get("metadata", {})
+
+    def store(self, data, metadata: dict | None = None) -> None:
+        """Store data, replacing all stored data.
 
         Parameters
         ----------
-        data : pandas.DataFrame or pandas.Series
-            Data structure to store to file.
+        data
+            Data to store to file.
+        metadata : dict, optional
+            Metadata describing the data, replacing the stored metadata.
         """
-        self._data = data
+        with self._lock:
+            old_segments = self._read_manifest()["segments"]
 
-        byte_data = io.BytesIO()
-        data.to_pickle(byte_data)
+            segment = self._write_segment(data)
+            self._write_manifest({"segments": [segment], "metadata": metadata or {}})
+            self._remove_segments(old_segments)
+
+            self._data = data
+            self._pending = []
+            self.generation += 1
+
+    def append(self, data, metadata: dict | None = None) -> None:
+        """Store data as a new segment.
+
+        Only the new data is written; the segment is added to the manifest
+        atomically after it has been written completely. If the data was loaded,
+        the new data is added to it on the next `load`, so frequent small appends
+        do not copy all loaded data each time.
+
+        Parameters
+        ----------
+        data
+            Data to add to the stored data.
+        metadata : dict, optional
+            Metadata describing the data, updating the stored metadata.
+        """
+        if self._length(data) == 0:
+            return
+
+        with self._lock:
+            manifest = self._read_manifest()
+            manifest["segments"].append(self._write_segment(data))
+            manifest.setdefault("metadata", {}).update(metadata or {})
+            self._write_manifest(manifest)
+
+            if self._data is not None:
+                self._pending = [*self._pending, data]
+            self.generation += 1
 
-        byte_data = self._encryptor.encrypt(byte_data.getbuffer())
+    def truncate(self, n_rows: int) -> None:
+        """Remove the stored rows at and beyond a row position.
 
-        with open(self._storage_path, "wb") as data_file:
-            data_file.write(byte_data)
+        Rolls back rows that were appended, but never committed elsewhere, for
+        example by an interrupted `MultiMatcher.create`. Segments beyond the
+        position are removed; a segment partly beyond it is rewritten.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of rows to keep.
+        """
+        with self._lock:
+            manifest = self._read_manifest()
+            segments, kept, total = manifest["segments"], [], 0
+            for segment in segments:
+                if total >= n_rows:
+                    break
+                if total + segment["rows"] > n_rows:
+                    head = self._read_segment(segment)[: n_rows - total]
+                    segment = self._write_segment(head)
+                kept.append(segment)
+                total += segment["rows"]
+
+            if kept == segments:
+                return
+
+            self._write_manifest(manifest | {"segments": kept})
+            self._remove_segments([part for part in segments if part not in kept])
+            self._data = None
+            self._pending = []
+            self.generation += 1
+
+    def keep_rows(
+        self, rows: np.ndarray, token: str, metadata: dict | None = None
+    ) -> None:
+        """Replace the stored data with a subset of its rows.
+
+        The token is recorded in the metadata and a store already rewritten with
+        the same token is left as is, so an interrupted rewrite of several stores
+        can be repeated from the start.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            Sorted row positions of the rows to keep.
+        token : str
+            Identifies the rewrite.
+        metadata : dict, optional
+            Metadata describing the kept rows, updating the stored metadata.
+        """
+        with self._lock:
+            stored = self.metadata
+            if stored.get("rewrite") == token or not len(self):
+                return
 
-    def load(self) -> pd.Series | pd.DataFrame | None:
-        """Load and decrypt a pandas data structure.
+            data = self._select(self.load(), rows)
+            self.store(data, stored | (metadata or {}) | {"rewrite": token})
+
+    def load(self):
+        """Load the stored data.
 
         Returns
         -------
-        pandas.DataFrame or pandas.Series
-            The decrypted data structure.
+        object
+            The stored data or None if no data was stored.
         """
-        if self._data is not None:
+        if self._data is not None and not self._pending:
             return self._data
 
-        try:
-            with open(self._storage_path, "rb") as data_file:
-                raw_data = data_file.read()
+        with self._lock:
+            # Another thread may have loaded the data while waiting for the lock.
+            if self._data is not None:
+                if self._pending:
+                    with measure("load"):
+                        self._data = self._concat([self._data, *self._pending])
+                    self._pending = []
+                return self._data
 
-            raw_data = self._encryptor.decrypt(raw_data)
+            segments = self._read_manifest()["segments"]
+            if not segments:
+                print(f"Warning: Cannot find file: {self._storage_path}")
+                return None
 
-            raw_data = io.BytesIO(raw_data)
-            self._data = pd.read_pickle(raw_data)
+            with measure("load"):
+                self._data = self._concat(
+                    [self._read_segment(segment) for segment in segments]
+                )
             return self._data
 
-        except FileNotFoundError:
-            print(f"Warning: Cannot find file: {self._storage_path}")
-            return None
+    def compact(self, segment_rows: int = SEGMENT_ROWS) -> None:
+        """Merge consecutive small segments into larger ones.
+
+        Segments are merged without holding the lock, so `load` keeps serving the
+        previous snapshot and `append` can continue. The new manifest is swapped in
+        atomically at the end; segments appended in the meantime are kept.
+
+        Parameters
+        ----------
+        segment_rows : int, default=1_000_000
+            Segments are merged until they contain at least this many rows.
+        """
+        with self._lock:
+            snapshot = self._read_manifest()["segments"]
+
+        # Group consecutive segments until the group reaches segment_rows.
+        groups, group = [], []
+        for segment in snapshot:
+            group.append(segment)
+            if sum(part["rows"] for part in group) >= segment_rows:
+                groups.append(group)
+                group = []
+        if group:
+            groups.append(group)
+
+        segments = []
+        for group in groups:
+            if len(group) == 1:
+                segments.extend(group)
+                continue
+
+            data = self._concat([self._read_segment(segment) for segment in group])
+            segments.append(self._write_segment(data))
+
+        new_segments = [segment for segment in segments if segment not in snapshot]
+        with self._lock:
+            manifest = self._read_manifest()
+            current = manifest["segments"]
+            if current[: len(snapshot)] != snapshot:
+                # The store was replaced or compacted concurrently; discard.
+                self._remove_segments(new_segments)
+                return
+
+            segments.extend(current[len(snapshot) :])
+            self._write_manifest(manifest | {"segments": segments})
+            self._remove_orphans(segments)
 
     def delete(self) -> None:
         """Delete all stored data."""
+        with self._lock:
+            shutil.rmtree(self._storage_path, ignore_errors=True)
+            self._data = None
+            self._pending = []
+            self.generation += 1
+
+    def _encode(self, data) -> bytes | Iterable[bytes]:
+        """Serialize data to bytes, possibly in parts."""
+        raise NotImplementedError
+
+    def _decode(self, file: BinaryIO):
+        """Deserialize data from a segment file."""
+        raise NotImplementedError
+
+    def _concat(self, parts: list):
+        """Concatenate deserialized segments."""
+        raise NotImplementedError
+
+    @staticmethod
+    def _length(data) -> int:
+        """Return the number of rows in the data."""
+        return len(data)
+
+    @staticmethod
+    def _select(data, rows: np.ndarray):
+        """Return the rows at the given positions."""
+        return data[rows]
+
+    def _write_segment(self, data) -> dict:
+        """Write data to a new segment file and return its manifest entry."""
+        self._storage_path.mkdir(parents=True, exist_ok=True)
+
+        name = f"{uuid.uuid4().hex}.seg"
+        _write_atomic(self._storage_path / name, self._encode(data))
+        return {"name": name, "rows": self._length(data)}
+
+    def _read_segment(self, segment: dict):
+        """Read and decode a single segment file."""
+        with open(self._storage_path / segment["name"], "rb") as file:
+            return self._decode(file)
+
+    def _remove_segments(self, segments: list) -> None:
+        """Remove segment files no longer listed in the manifest."""
+        for segment in segments:
+            try:
+                (self._storage_path / segment["name"]).unlink()
+            except FileNotFoundError:
+                pass
+
+    def _remove_orphans(self, segments: list) -> None:
+        """Remove all segment and temporary files not in the segments list."""
+        names = {segment["name"] for segment in segments}
+        for path in self._storage_path.glob("*.seg*"):
+            if path.name not in names:
+                path.unlink(missing_ok=True)
+
+    def _read_manifest(self) -> dict:
+        """Read the manifest; returns an empty manifest if there is none."""
         try:
-            self._storage_path.unlink()
+            with open(self._storage_path / MANIFEST, "r", encoding="utf8") as file:
+                return json.load(file)
         except FileNotFoundError:
-            pass
-        self._data = None
+            return {"segments": []}
 
+    def _write_manifest(self, manifest: dict) -> None:
+        """Atomically replace the manifest."""
+        self._storage_path.mkdir(parents=True, exist_ok=True)
+        content = json.dumps(manifest, indent=2).encode("utf8")
+        _write_atomic(self._storage_path / MANIFEST, content)
 
-class VectorStore:
-    """Class for storing sparse vector matrices.
+
+class EncryptedStore(SegmentStore):
+    """Class for encrypted storage of pandas data structures.
+
+    Each segment is stored in a columnar format: numbers and dates as raw numpy
+    buffers, and strings as the UTF-8 bytes and offsets of their unique values, with
+    integer codes if values repeat or are missing. After decryption, both are wrapped
+    without copying; string columns are loaded as `Utf8Array`, which decodes values
+    only when they are used. Columns of other values are pickled. Segments are
+    encrypted with AES-GCM-SIV in chunks, see `AESGCM4Encryptor.encrypt_frames`.
 
     Parameters
     ----------
+    encryption_key : bytes
+        Encryption key for storing data, provided as bytes.
     storage_path : pathlib.Path
-        Path to a file to store the data in.
+        Folder to store the segments in.
     """
 
-    def __init__(self, storage_path: Path) -> None:
-        self._vectors = None
-        self._storage_path = storage_path
+    def __init__(self, encryption_key: bytes, storage_path: Path) -> None:
+        super().__init__(storage_path)
+        self._encryptor = AESGCM4Encryptor(encryption_key)
+
+    def store(
+        self, data: pd.Series | pd.DataFrame, metadata: dict | None = None
+    ) -> None:
+        """Encrypt and store data, replacing all stored data.
+
+        String columns are converted to `Utf8Array`, as they are loaded.
+
+        Parameters
+        ----------
+        data : pandas.Series or pandas.DataFrame
+            Data to store to file.
+        metadata : dict, optional
+            Metadata describing the data, replacing the stored metadata.
+        """
+        super().store(_as_stored(data), metadata)
+
+    def append(
+        self, data: pd.Series | pd.DataFrame, metadata: dict | None = None
+    ) -> None:
+        """Encrypt and store data as a new segment.
 
-    def store(self, vectors: sparse.csr_matrix) -> None:
-        """Store vectors to disk.
+        String columns are converted to `Utf8Array`, as they are loaded.
 
         Parameters
         ----------
-        vectors : scipy.sparse.csr_matrix
-            Sparse matrix of vectors.
+        data : pandas.Series or pandas.DataFrame
+            Data to add to the stored data.
+        metadata : dict, optional
+            Metadata describing the data, updating the stored metadata.
         """
-        sparse.save_npz(self._storage_path, vectors)
+        super().append(_as_stored(data), metadata)
 
-    def load(self) -> sparse.csr_matrix | None:
-        """Load vectors from disk.
+    def _encode(self, data: pd.Series | pd.DataFrame) -> Iterable[bytes]:
+        """Serialize and encrypt a pandas data structure."""
+        return self._encryptor.encrypt_frames(_to_columnar(data))
+
+    def _decode(self, file: BinaryIO) -> pd.Series | pd.DataFrame:
+        """Read, decrypt and deserialize a pandas data structure."""
+        with measure("decrypt", nbytes=os.fstat(file.fileno()).st_size):
+            raw_data = self._encryptor.decrypt_frames(file)
+        with measure("deserialize"):
+            return _from_columnar(raw_data)
+
+    def _concat(self, parts: list) -> pd.Series | pd.DataFrame:
+        """Concatenate pandas data structures."""
+        return pd.concat(parts)
+
+    @staticmethod
+    def _select(
+        data: pd.Series | pd.DataFrame, rows: np.ndarray
+    ) -> pd.Series | pd.DataFrame:
+        """Return the rows at the given positions with a default index."""
+        return data.iloc[rows].reset_index(drop=True)
+
+
+class VectorStore(SegmentStore):
+    """Class for encrypted storage of sparse vector matrices.
+
+    Each segment is a sparse matrix in numpy's uncompressed npz format, encrypted
+    with AES-GCM-SIV in chunks. Optionally, the decrypted matrix is written to a cache
+    folder and memory mapped from there. With the cache on a memory backed file
+    system, like `/dev/shm`, all processes on a machine share one copy of the
+    vectors instead of each decrypting a private copy.
+
+    Note: the cache holds decrypted vectors; only use a folder that is not
+    persisted and that other users cannot read.
+
+    Parameters
+    ----------
+    encryption_key : bytes
+        Encryption key for storing data, provided as bytes.
+    storage_path : pathlib.Path
+        Folder to store the segments in.
+    cache_path : pathlib.Path, optional
+        Folder for memory mapped, decrypted vectors.
+    """
+
+    def __init__(
+        self, encryption_key: bytes, storage_path: Path, cache_path: Path | None = None
+    ) -> None:
+        super().__init__(storage_path)
+        self._encryptor = AESGCM4Encryptor(encryption_key)
+        self._cache_path = Path(cache_path) if cache_path else None
+
+    def load(self) -> "sparse.csr_matrix | None":
+        """Load and decrypt the stored vectors.
 
         Returns
         -------
         scipy.sparse.csr_matrix
-            Sparse matrix of vectors.
+            Sparse matrix of vectors or None if no vectors were stored.
         """
-        if self._vectors is not None:
-            return self._vectors
+        if self._data is not None or self._cache_path is None:
+            return super().load()
 
-        try:
-            self._vectors = sparse.load_npz(self._storage_path)
-            return self._vectors
+        with self._lock:
+            # Another thread may have loaded the data while waiting for the lock.
+            if self._data is not None:
+                return super().load()
 
-        except FileNotFoundError:
-            print(f"Warning: Cannot find file: {self._storage_path}")
-            return None
+            segments = self._read_manifest()["segments"]
+            if not segments:
+                print(f"Warning: Cannot find file: {self._storage_path}")
+                return None
+
+            # The cache folder name identifies the store and its segments.
+            digest = hashlib.sha256(json.dumps(segments).encode("utf8")).hexdigest()
+            cache_folder = self._cache_path / f"{self._cache_prefix()}-{digest[:16]}"
+            with measure("load"):
+                if not cache_folder.exists():
+                    vectors = self._concat(
+                        [self._read_segment(segment) for segment in segments]
+                    )
+                    self._write_cache(cache_folder, vectors)
+
+                self._data = self._read_cache(cache_folder)
+            return self._data
 
     def delete(self) -> None:
-        """Delete all stored vectors."""
+        """Delete all stored vectors, including cached vectors."""
+        with self._lock:
+            super().delete()
+            self._remove_caches()
+
+    def _encode(self, vectors: "sparse.csr_matrix") -> Iterable[bytes]:
+        """Serialize and encrypt a sparse matrix."""
+        from scipy import sparse
+
+        byte_data = io.BytesIO()
+        sparse.save_npz(byte_data, vectors, compressed=False)
+        return self._encryptor.encrypt_frames(byte_data.getbuffer())
+
+    def _decode(self, file: BinaryIO) -> "sparse.csr_matrix":
+        """Read, decrypt and deserialize a sparse matrix."""
+        from scipy import sparse
+
+        with measure("decrypt", nbytes=os.fstat(file.fileno()).st_size):
+            raw_data = self._encryptor.decrypt_frames(file)
+        with measure("deserialize"):
+            return sparse.load_npz(io.BytesIO(raw_data))
+
+    def _concat(self, parts: list) -> "sparse.csr_matrix":
+        """Stack sparse matrices vertically."""
+        from scipy import sparse
+
+        return sparse.vstack(parts, format="csr")
+
+    @staticmethod
+    def _length(vectors: "sparse.csr_matrix") -> int:
+        """Return the number of vectors in the matrix."""
+        return vectors.shape[0]
+
+    def _cache_prefix(self) -> str:
+        """Return a cache folder prefix unique to the storage path."""
+        path = str(self._storage_path.resolve()).encode("utf8")
+        return hashlib.sha256(path).hexdigest()[:16]
+
+    def _write_cache(self, cache_folder: Path, vectors: "sparse.csr_matrix") -> None:
+        """Write the arrays of a sparse matrix to a cache folder."""
+        self._cache_path.mkdir(parents=True, exist_ok=True)
+
+        # Write to a private temporary folder, then rename it into place.
+        temp_folder = Path(tempfile.mkdtemp(dir=self._cache_path))
+        for name in ("data", "indices", "indptr"):
+            np.save(temp_folder / f"{name}.npy", getattr(vectors, name))
+        np.save(temp_folder / "shape.npy", np.array(vectors.shape))
+
         try:
-            self._storage_path.unlink()
-        except FileNotFoundError:
-            pass
-        self._vectors = None
+            temp_folder.rename(cache_folder)
+        except OSError:
+            # Another process created the cache in the meantime.
+            shutil.rmtree(temp_folder, ignore_errors=True)
+
+        self._remove_caches(keep=cache_folder)
+
+    @staticmethod
+    def _read_cache(cache_folder: Path) -> "sparse.csr_matrix":
+        """Memory map the arrays of a sparse matrix from a cache folder."""
+        from scipy import sparse
+
+        arrays = [
+            np.load(cache_folder / f"{name}.npy", mmap_mode="r")
+            for name in ("data", "indices", "indptr")
+        ]
+        shape = tuple(np.load(cache_folder / "shape.npy"))
+        return sparse.csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+    def _remove_caches(self, keep: Path | None = None) -> None:
+        """Remove cache folders of this store, except the one to keep.
+
+        Processes that mapped a removed cache keep their mapping.
+        """
+        if self._cache_path is None:
+            return
+
+        for cache_folder in self._cache_path.glob(f"{self._cache_prefix()}-*"):
+            if cache_folder != keep:
+                shutil.rmtree(cache_folder, ignore_errors=True)
+
+
+class IndexStore(EncryptedStore):
+    """Class for encrypted inverted indexes from integer keys to row positions.
+
+    Each segment is a DataFrame with a `key` and a `row` column. After loading, the
+    index is sorted by key once, so lookups only need a binary search.
+
+    Parameters
+    ----------
+    encryption_key : bytes
+        Encryption key for storing data, provided as bytes.
+    storage_path : pathlib.Path
+        Folder to store the segments in.
+    """
+
+    def __init__(self, encryption_key: bytes, storage_path: Path) -> None:
+        super().__init__(encryption_key, storage_path)
+        self._sorted = None
+
+    def store(self, data: pd.DataFrame, metadata: dict | None = None) -> None:
+        """Encrypt and store an index, replacing the stored index.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            DataFrame with `key` and `row` columns.
+        metadata : dict, optional
+            Metadata describing the index, replacing the stored metadata.
+        """
+        super().store(data, metadata)
+        self._sorted = None
+
+    def append(self, data: pd.DataFrame, metadata: dict | None = None) -> None:
+        """Encrypt and store index entries as a new segment.
+
+        Parameters
+        ----------
+        data : pandas.DataFrame
+            DataFrame with `key` and `row` columns.
+        metadata : dict, optional
+            Metadata describing the index, updating the stored metadata.
+        """
+        super().append(data, metadata)
+        self._sorted = None
+
+    def truncate(self, n_rows: int) -> None:
+        """Remove the index entries for rows at and beyond a row position.
+
+        Indexes record the number of indexed rows in the `rows` metadata, so the
+        index is only loaded and rewritten if entries were left by an interrupted
+        append.
+
+        Parameters
+        ----------
+        n_rows : int
+            Number of indexed rows to keep.
+        """
+        with self._lock:
+            metadata = self.metadata
+            if metadata.get("rows", np.inf) <= n_rows or not len(self):
+                return
+
+            data = self.load()
+
+            keep = data["row"].to_numpy() < n_rows
+            if keep.all():
+                manifest = self._read_manifest()
+                self._write_manifest(
+                    manifest | {"metadata": metadata | {"rows": n_rows}}
+                )
+                return
+
+            self.store(data[keep].reset_index(drop=True), metadata | {"rows": n_rows})
+
+    @staticmethod
+    def _select(data: pd.DataFrame, rows: np.ndarray) -> pd.DataFrame:
+        """Return the entries of the indexed rows kept, renumbering the rows."""
+        indexed = data["row"].to_numpy()
+        positions = np.minimum(np.searchsorted(rows, indexed), max(len(rows) - 1, 0))
+        keep = rows[positions] == indexed if len(rows) else np.zeros(len(data), bool)
+        return pd.DataFrame(
+            {"key": data["key"].to_numpy()[keep], "row": positions[keep]}
+        )
+
+    def lookup(self, keys: np.ndarray) -> np.ndarray:
+        """Return the row positions for a set of keys.
+
+        Parameters
+        ----------
+        keys : numpy.ndarray
+            Keys to look up.
+
+        Returns
+        -------
+        numpy.ndarray
+            Row positions of all index entries matching any of the keys. A row is
+            repeated once for every key it matches.
+        """
+        if not len(keys):
+            return np.empty(0, dtype=np.int64)
+
+        sorted_keys, rows = self._sorted_index()
+        starts = np.searchsorted(sorted_keys, keys, side="left")
+        ends = np.searchsorted(sorted_keys, keys, side="right")
+        return np.concatenate([rows[start:end] for start, end in zip(starts, ends)])
+
+    def preload(self) -> None:
+        """Load and sort the index ahead of the first lookup."""
+        self._sorted_index()
+
+    def between(self, low: int, high: int) -> tuple[np.ndarray, np.ndarray]:
+        """Return the index entries with keys in a closed range.
+
+        Parameters
+        ----------
+        low : int
+            Lowest key to include.
+        high : int
+            Highest key to include.
+
+        Returns
+        -------
+        tuple of numpy.ndarray
+            Sorted keys in the range and their row positions.
+        """
+        sorted_keys, rows = self._sorted_index()
+        start = np.searchsorted(sorted_keys, low, side="left")
+        end = np.searchsorted(sorted_keys, high, side="right")
+        return sorted_keys[start:end], rows[start:end]
+
+    def delete(self) -> None:
+        """Delete the stored index."""
+        super().delete()
+        self._sorted = None
+
+    def _sorted_index(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the index keys in sorted order and their row positions."""
+        if self._sorted is None:
+            data = self.load()
+            if data is None:
+                return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+            keys = data["key"].to_numpy()
+            order = np.argsort(keys, kind="stable")
+            self._sorted = keys[order], data["row"].to_numpy()[order]
+
+        return self._sorted
+
+
+@register_extension_dtype
+class Utf8Dtype(ExtensionDtype):
+    """Extension dtype for strings kept as UTF-8 bytes, see `Utf8Array`."""
+
+    name = "fuzzy_utf8"
+    type = str
+    kind = "O"
+    na_value = np.nan
+
+    @classmethod
+    def construct_array_type(cls) -> "type[Utf8Array]":
+        """Return the array type of the dtype."""
+        return Utf8Array
+
+
+class Utf8Array(ExtensionArray):
+    """Array of strings kept as UTF-8 bytes until their values are needed.
+
+    The unique values are stored back to back in one byte buffer, with the start of
+    each value in an offsets array. Codes map rows to unique values, -1 marking a
+    missing value; they are left out if all values are unique and none are missing.
+    Selecting rows only selects codes; strings are decoded when the values are
+    converted to a numpy array, and only for the selected rows unless most unique
+    values are needed. Decoded values are cached.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        UTF-8 bytes of the unique values as an uint8 array.
+    offsets : numpy.ndarray
+        Start of each unique value in `data`, followed by the end of the last one.
+    codes : numpy.ndarray, optional
+        Position of the unique value of each row, or -1 for missing values.
+    """
+
+    def __init__(
+        self, data: np.ndarray, offsets: np.ndarray, codes: np.ndarray | None = None
+    ) -> None:
+        self._data = data
+        self._offsets = offsets
+        self._codes = codes
+        self._uniques = None
+        self._values = None
+
+    @classmethod
+    def _from_sequence(cls, scalars, *, dtype=None, copy: bool = False) -> "Utf8Array":
+        """Encode a sequence of strings and missing values."""
+        if isinstance(scalars, cls):
+            return scalars
+        codes, uniques = pd.factorize(np.asarray(scalars, dtype=object))
+        if not all(isinstance(value, str) for value in uniques):
+            raise TypeError("Utf8Array can only hold strings and missing values.")
+
+        data, offsets = _join_utf8(uniques)
+        if len(uniques) == len(codes):
+            return cls(data, offsets)
+        return cls(data, offsets, codes.astype(np.int64))
+
+    @classmethod
+    def _from_factorized(cls, values, original: "Utf8Array") -> "Utf8Array":
+        """Reconstruct an array from factorized values."""
+        return cls._from_sequence(values)
+
+    @classmethod
+    def _concat_same_type(cls, to_concat) -> "Utf8Array":
+        """Concatenate arrays, combining their unique values without decoding."""
+        data, offsets, codes = [], [], []
+        n_bytes = n_uniques = 0
+        for array in to_concat:
+            start, stop = int(array._offsets[0]), int(array._offsets[-1])
+            data.append(array._data[start:stop])
+            offsets.append(array._offsets[:-1].astype(np.int64) - start + n_bytes)
+            positions = array._positions().astype(np.int64)
+            codes.append(np.where(positions >= 0, positions + n_uniques, -1))
+            n_bytes += stop - start
+            n_uniques += len(array._offsets) - 1
+        offsets.append(np.array([n_bytes], dtype=np.int64))
+
+        result = cls(
+            np.concatenate(data) if data else np.empty(0, dtype=np.uint8),
+            np.concatenate(offsets).astype(np.int64, copy=False),
+        )
+        if any(array._codes is not None for array in to_concat):
+            result._codes = np.concatenate(codes).astype(np.int64, copy=False)
+        return result
+
+    @property
+    def dtype(self) -> Utf8Dtype:
+        """The dtype of the array."""
+        return Utf8Dtype()
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes used by the encoded values, not counting decoded caches."""
+        nbytes = self._data.nbytes + self._offsets.nbytes
+        return nbytes + (0 if self._codes is None else self._codes.nbytes)
+
+    def __len__(self) -> int:
+        if self._codes is None:
+            return len(self._offsets) - 1
+        return len(self._codes)
+
+    def __getitem__(self, key):
+        if pd.api.types.is_integer(key):
+            if self._codes is None:
+                position = range(len(self))[key]
+            else:
+                position = self._codes[key]
+            if position < 0:
+                return self.dtype.na_value
+            return self._decode(np.array([position]))[0]
+
+        key = check_array_indexer(self, key)
+        if isinstance(key, slice) and self._codes is None:
+            start, stop, step = key.indices(len(self))
+            if step == 1:
+                stop = max(start, stop)
+                result = Utf8Array(self._data, self._offsets[start : stop + 1])
+                if self._uniques is not None:
+                    result._uniques = self._uniques[start:stop]
+                return result
+
+        result = Utf8Array(self._data, self._offsets, self._positions()[key])
+        result._uniques = self._uniques
+        return result
+
+    def __iter__(self):
+        return iter(self.to_numpy())
+
+    def __eq__(self, other):
+        if isinstance(other, (pd.Series, pd.Index, pd.DataFrame)):
+            return NotImplemented
+        return self.to_numpy() == (
+            np.asarray(other, dtype=object)
+            if pd.api.types.is_list_like(other)
+            else other
+        )
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        return self.to_numpy(dtype=dtype)
+
+    def __reduce__(self):
+        # Decoded caches are not pickled.
+        return Utf8Array, (self._data, self._offsets, self._codes)
+
+    def to_numpy(
+        self, dtype=None, copy: bool = False, na_value=no_default
+    ) -> np.ndarray:
+        """Decode the values to a numpy object array.
+
+        The decoded array is cached, so it is only copied if `copy` is set or
+        missing values are replaced.
+        """
+        if self._values is None and self._codes is None:
+            if self._uniques is None:
+                self._uniques = _split_utf8(self._data, self._offsets)
+            self._values = self._uniques
+        elif self._values is None:
+            self._values = self._decode(self._codes)
+        values = self._values
+
+        if na_value is not no_default and self._codes is not None:
+            values = values.copy()
+            values[self._codes < 0] = na_value
+        elif copy:
+            values = values.copy()
+        if dtype is not None and np.dtype(dtype) != object:
+            values = values.astype(dtype)
+        return values
+
+    def isna(self) -> np.ndarray:
+        """Return a boolean array marking missing values."""
+        if self._codes is None:
+            return np.zeros(len(self), dtype=bool)
+        return self._codes < 0
+
+    def take(
+        self, indices, *, allow_fill: bool = False, fill_value=None
+    ) -> "Utf8Array":
+        """Take rows by position; with `allow_fill`, -1 gives a missing value."""
+        if allow_fill and fill_value is not None and not pd.isna(fill_value):
+            raise ValueError("Utf8Array can only fill with missing values.")
+        codes = take(self._positions(), indices, allow_fill=allow_fill, fill_value=-1)
+        result = Utf8Array(self._data, self._offsets, codes)
+        result._uniques = self._uniques
+        return result
+
+    def copy(self) -> "Utf8Array":
+        """Return a copy of the array; the buffers are read-only and shared."""
+        result = Utf8Array(self._data, self._offsets, self._codes)
+        result._uniques, result._values = self._uniques, self._values
+        return result
+
+    def _positions(self) -> np.ndarray:
+        """Return the unique value position of each row, -1 for missing values."""
+        if self._codes is None:
+            return np.arange(len(self._offsets) - 1, dtype=np.int64)
+        return self._codes
+
+    def _decode(self, positions: np.ndarray) -> np.ndarray:
+        """Decode the unique values at the positions to an object array."""
+        n_uniques = len(self._offsets) - 1
+        if self._uniques is None and len(positions) * 4 >= n_uniques:
+            self._uniques = _split_utf8(self._data, self._offsets)
+
+        values = np.full(len(positions), np.nan, dtype=object)
+        found = positions >= 0
+        if self._uniques is not None:
+            values[found] = self._uniques[positions[found]]
+        elif found.any():
+            buffer = memoryview(self._data)
+            starts = self._offsets[positions[found]].tolist()
+            stops = self._offsets[positions[found] + 1].tolist()
+            strings = [str(buffer[a:b], "utf8") for a, b in zip(starts, stops)]
+            values[found] = np.array(strings, dtype=object)
+        return values
+
+
+def _join_utf8(strings) -> tuple[np.ndarray, np.ndarray]:
+    """Encode strings to one UTF-8 buffer and the offsets of each string."""
+    if not len(strings):
+        return np.empty(0, dtype=np.uint8), np.zeros(1, dtype=np.int64)
+
+    # Joining with a separator encodes all strings at once, unless one contains it.
+    joined = np.frombuffer(SEPARATOR.join(strings).encode("utf8"), dtype=np.uint8)
+    data, offsets = _unjoin_utf8(joined)
+    if len(offsets) == len(strings) + 1:
+        return data, offsets
+
+    encoded = [value.encode("utf8") for value in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _unjoin_utf8(joined: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Remove the separators between UTF-8 strings, returning bytes and offsets."""
+    separators = np.flatnonzero(joined == ord(SEPARATOR))
+    offsets = np.zeros(len(separators) + 2, dtype=np.int64)
+    offsets[1:-1] = separators - np.arange(len(separators))
+    offsets[-1] = len(joined) - len(separators)
+    return np.delete(joined, separators), offsets
+
+
+def _as_utf8(column: pd.Series) -> Utf8Array | None:
+    """Return a string column as `Utf8Array`, or None if it holds other values."""
+    if isinstance(column.array, Utf8Array):
+        return column.array
+    if column.dtype.kind in "biufcmM":
+        return None
+    if pd.api.types.infer_dtype(column, skipna=True) not in ("string", "empty"):
+        return None
+    try:
+        return Utf8Array._from_sequence(column.to_numpy())
+    except UnicodeEncodeError:
+        return None
+
+
+def _as_stored(data: pd.Series | pd.DataFrame) -> pd.Series | pd.DataFrame:
+    """Convert string columns to `Utf8Array`, the form in which they are loaded."""
+    if isinstance(data, pd.Series):
+        values = _as_utf8(data)
+        if values is None or values is data.array:
+            return data
+        return pd.Series(values, index=data.index, name=data.name, copy=False)
+
+    if not all(isinstance(name, str) for name in data.columns):
+        return data
+    converted = {}
+    for name, column in data.items():
+        values = _as_utf8(column)
+        if values is not None and values is not column.array:
+            converted[name] = values
+    return data.assign(**converted) if converted else data
+
+
+def _split_utf8(data: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    """Decode all strings in an UTF-8 buffer to an object array."""
+    strings = np.empty(len(offsets) - 1, dtype=object)
+    buffer = data[offsets[0] : offsets[-1]]
+    if len(strings) and not (buffer == ord(SEPARATOR)).any():
+        # Inserting separators lets all strings be decoded at once.
+        joined = np.full(len(buffer) + len(strings) - 1, ord(SEPARATOR), dtype=np.uint8)
+        keep = np.ones(len(joined), dtype=bool)
+        keep[offsets[1:-1] - offsets[0] + np.arange(len(strings) - 1)] = False
+        joined[keep] = buffer
+        strings[:] = joined.tobytes().decode("utf8").split(SEPARATOR)
+    elif len(strings):
+        view = memoryview(data)
+        bounds = zip(offsets[:-1].tolist(), offsets[1:].tolist())
+        strings[:] = [str(view[start:stop], "utf8") for start, stop in bounds]
+    return strings
+
+
+def _to_columnar(data: pd.Series | pd.DataFrame) -> bytes:
+    """Serialize a pandas data structure to the columnar format.
+
+    The format consists of the `COLUMNAR` marker, the length of a JSON header and
+    the header itself, followed by the column buffers at aligned positions. The
+    header lists the type, dtype and buffer positions of each column. The index is
+    not stored; loaded data has a default index.
+
+    Parameters
+    ----------
+    data : pandas.Series or pandas.DataFrame
+        Data to serialize; column names and the name of a Series must be strings.
+
+    Returns
+    -------
+    bytes
+        Serialized data.
+    """
+    series = isinstance(data, pd.Series)
+    frame = data.to_frame() if series else data
+    if not all(isinstance(name, str) for name in frame.columns):
+        raise ValueError("Only data with string column names can be stored.")
+
+    buffers = []
+    size = 0
+
+    def add(buffer: bytes | np.ndarray) -> list[int]:
+        """Add a buffer at the next aligned position and return its position."""
+        nonlocal size
+        padding = -size % ALIGNMENT
+        start, nbytes = size + padding, len(buffer)
+        buffers.extend([bytes(padding), buffer])
+        size = start + nbytes
+        return [start, nbytes]
+
+    columns = []
+    for name, column in frame.items():
+        entry = {"name": name}
+        if isinstance(column.dtype, np.dtype) and column.dtype.kind in "biufmM":
+            values = np.ascontiguousarray(column.to_numpy())
+            entry |= {"type": "array", "dtype": values.dtype.str}
+            entry["buffers"] = [add(values.view(np.uint8))]
+        elif (strings := _as_utf8(column)) is not None:
+            start, stop = int(strings._offsets[0]), int(strings._offsets[-1])
+            dtype = np.int32 if stop - start < 2**31 else np.int64
+            offsets = (strings._offsets - start).astype(dtype)
+            entry |= {"type": "utf8", "offsets": offsets.dtype.str}
+            entry["buffers"] = [
+                add(strings._data[start:stop]),
+                add(offsets.view(np.uint8)),
+            ]
+
+            # Codes are left out if all values are unique and none are missing.
+            if strings._codes is not None:
+                dtype = np.int32 if len(offsets) <= 2**31 else np.int64
+                codes = np.ascontiguousarray(strings._codes, dtype=dtype)
+                entry["dtype"] = codes.dtype.str
+                entry["buffers"].append(add(codes.view(np.uint8)))
+        else:
+            entry["type"] = "pickle"
+            entry["buffers"] = [add(pickle.dumps(column.to_numpy(), protocol=5))]
+        columns.append(entry)
+
+    header = {"series": series, "rows": len(frame), "columns": columns}
+    header = json.dumps(header).encode("utf8")
+    return b"".join([COLUMNAR, len(header).to_bytes(8, "little"), header, *buffers])
+
+
+def _from_columnar(raw_data: bytes) -> pd.Series | pd.DataFrame:
+    """Deserialize a pandas data structure from the columnar format.
+
+    Numeric and string columns share memory with `raw_data` and are read-only.
+
+    Parameters
+    ----------
+    raw_data : bytes
+        Data serialized with `_to_columnar`.
+
+    Returns
+    -------
+    pandas.Series or pandas.DataFrame
+        Deserialized data.
+    """
+    start = len(COLUMNAR) + 8
+    header_size = int.from_bytes(raw_data[len(COLUMNAR) : start], "little")
+    header = json.loads(raw_data[start : start + header_size])
+    body = memoryview(raw_data)[start + header_size :]
+
+    columns = {}
+    for column in header["columns"]:
+        buffers = [body[offset : offset + size] for offset, size in column["buffers"]]
+        if column["type"] == "array":
+            values = np.frombuffer(buffers[0], dtype=column["dtype"])
+        elif column["type"] == "utf8":
+            data = np.frombuffer(buffers[0], dtype=np.uint8)
+            offsets = np.frombuffer(buffers[1], dtype=column["offsets"])
+            codes = None
+            if "dtype" in column:
+                codes = np.frombuffer(buffers[-1], dtype=column["dtype"])
+            values = Utf8Array(data, offsets, codes)
+        else:
+            values = pickle.loads(buffers[0])
+        columns[column["name"]] = values
+
+    frame = pd.DataFrame(columns, index=pd.RangeIndex(header["rows"]), copy=False)
+    return frame.iloc[:, 0] if header["series"] else frame
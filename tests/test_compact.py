@@ -0,0 +1,128 @@
+"""Tests for dropping removed entities in `MultiMatcher.compact`."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fuzzy_matching.match_multi import MultiMatcher
+
+KEY = bytes(range(32))
+
+CONFIG = {
+    "name": {"algoritm": "levenshtein", "qgram_index": True, "weight": 0.3},
+    "city": {"algoritm": "vector", "weight": 0.1},
+    "street": {"algoritm": "minhash", "weight": 0.1},
+    "birthdate": {"algoritm": "timedelta", "weight": 0.2},
+    "surname": {"algoritm": "phonetic", "weight": 0.1},
+    "national_id": {"algoritm": "exact", "weight": 0.2},
+}
+
+TARGETS = [
+    {
+        "name": "jan jansen",
+        "city": "amsterdam",
+        "street": "kerkstraat 12",
+        "birthdate": "02-01-1980",
+        "surname": "jansen",
+        "national_id": "id-3",
+    },
+    {
+        "name": "piet puk",
+        "city": "utrecht",
+        "street": "dorpsweg 3",
+        "birthdate": "30-06-1975",
+        "surname": "puk",
+        "national_id": "id-40",
+    },
+]
+
+
+def make_records(n_records: int, offset: int = 0) -> pd.DataFrame:
+    """Return records with similar values, so entities share index keys."""
+    rng = np.random.default_rng(offset)
+    names = np.array(["jan", "piet", "klaas", "anna", "els", "joost"])
+    surnames = np.array(["jansen", "puk", "vaak", "bakker", "de vries", "smit"])
+    cities = np.array(["amsterdam", "utrecht", "rotterdam", "den haag"])
+    streets = np.array(["kerkstraat", "dorpsweg", "stationsplein", "molenlaan"])
+    numbers = np.arange(offset, offset + n_records)
+    first = rng.choice(names, n_records)
+    last = rng.choice(surnames, n_records)
+    return pd.DataFrame(
+        {
+            "id": [f"e{number}" for number in numbers],
+            "name": [f"{a} {b}" for a, b in zip(first, last)],
+            "city": rng.choice(cities, n_records),
+            "street": [
+                f"{street} {number % 20}"
+                for street, number in zip(rng.choice(streets, n_records), numbers)
+            ],
+            "birthdate": [
+                (pd.Timestamp("1970-01-01") + pd.Timedelta(days=int(days))).strftime(
+                    "%d-%m-%Y"
+                )
+                for days in rng.integers(0, 365 * 20, n_records)
+            ],
+            "surname": last,
+            "national_id": [f"id-{number % 50}" for number in numbers],
+        }
+    )
+
+
+def query(matcher: MultiMatcher) -> list[pd.DataFrame]:
+    """Return the results of `get` and `get_many` for the targets."""
+    results = [matcher.get(target) for target in TARGETS]
+    results.append(matcher.get_many(pd.DataFrame(TARGETS)))
+    return results
+
+
+@pytest.fixture
+def matcher(tmp_path) -> MultiMatcher:
+    """Matching set with removed and replaced entities."""
+    matcher = MultiMatcher(10, CONFIG, KEY, tmp_path)
+    matcher.create(make_records(200), "id")
+    matcher.create(make_records(100, offset=200), "id")
+
+    replaced = make_records(30, offset=50)
+    replaced["city"] = "zwolle"
+    matcher.upsert(replaced, "id")
+    matcher.remove([f"e{number}" for number in range(100, 160)])
+    return matcher
+
+
+def test_compact_drops_removed_rows(matcher, tmp_path):
+    before = query(matcher)
+    n_entities = len(matcher)
+
+    matcher.compact()
+
+    assert len(matcher) == n_entities == 240
+    assert len(matcher._ids) == n_entities
+    for field_matcher in matcher._matchers.values():
+        assert len(field_matcher) == n_entities
+    for expected, result in zip(before, query(matcher)):
+        pd.testing.assert_frame_equal(result, expected)
+
+    # The compacted set can be reopened and extended.
+    reopened = MultiMatcher(10, CONFIG, KEY, tmp_path)
+    for expected, result in zip(before, query(reopened)):
+        pd.testing.assert_frame_equal(result, expected)
+    reopened.upsert(make_records(5, offset=60), "id")
+    assert len(reopened) == n_entities
+
+
+def test_compact_resumes_when_interrupted(matcher, tmp_path, monkeypatch):
+    before = query(matcher)
+
+    def fail(*_):
+        raise OSError("Interrupted")
+
+    # Interrupt after all fields, but before the identifiers are rewritten.
+    monkeypatch.setattr(matcher._ids, "keep_rows", fail)
+    with pytest.raises(OSError):
+        matcher.compact()
+
+    reopened = MultiMatcher(10, CONFIG, KEY, tmp_path)
+    assert not (tmp_path / "multimatcher_compaction.json").exists()
+    assert len(reopened._ids) == len(reopened) == 240
+    for expected, result in zip(before, query(reopened)):
+        pd.testing.assert_frame_equal(result, expected)